@@ -21,4 +21,6 @@ from overturemaps_wfsserver_app import views
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("wfs/overturemaps/", views.OverturemapsWFSView.as_view()),
+    path("tiles/<int:z>/<int:x>/<int:y>.mvt", views.BuildingTileView.as_view()),
+    path("cache/stats", views.ResponseCacheStatsView.as_view()),
 ]
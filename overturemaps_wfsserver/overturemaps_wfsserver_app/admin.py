@@ -1,9 +1,11 @@
 from django.contrib import admin
 
 from django.contrib import admin
-from .models import BBOXRequestBuildingModel, OverturemapsBuildingModel, OverturemapsSourceModel
+from .models import BBOXRequestBuildingModel, CoverageCellModel, IngestionJobModel, OverturemapsBuildingModel, ReleaseManifestModel
 
 admin.site.register(BBOXRequestBuildingModel)
 admin.site.register(OverturemapsBuildingModel)
-admin.site.register(OverturemapsSourceModel)
+admin.site.register(IngestionJobModel)
+admin.site.register(CoverageCellModel)
+admin.site.register(ReleaseManifestModel)
 
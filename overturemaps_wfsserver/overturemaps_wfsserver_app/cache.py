@@ -0,0 +1,237 @@
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.gis.geos import Polygon
+from django.core.cache import caches
+from django.db.models import Max
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from . import conf
+from .models import BBOXRequestBuildingModel, get_cell_generations
+from .tiles import tile_bounds, tile_range
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The GetFeature parameters that change the response, with their aliases
+KEY_PARAMETERS = {
+    "VERSION": "VERSION",
+    "TYPENAMES": "TYPENAMES",
+    "TYPENAME": "TYPENAMES",
+    "BBOX": "BBOX",
+    "FILTER": "FILTER",
+    "SRSNAME": "SRSNAME",
+    "OUTPUTFORMAT": "OUTPUTFORMAT",
+    "COUNT": "COUNT",
+    "MAXFEATURES": "COUNT",
+    "STARTINDEX": "STARTINDEX",
+    "RESULTTYPE": "RESULTTYPE",
+    "SORTBY": "SORTBY",
+    "PROPERTYNAME": "PROPERTYNAME",
+    "LOD": "LOD",
+    "HITS": "HITS",
+    "CURSOR": "CURSOR",
+}
+
+# Response headers kept with the cached content
+CACHED_HEADERS = ("Content-Disposition",)
+
+def normalize_parameters(params):
+    """Return the GetFeature parameters as a canonical dict, so equivalent requests share a key."""
+    normalized = {}
+    for name, value in params.items():
+        key = KEY_PARAMETERS.get(name)
+        if key is None or value is None:
+            continue
+        value = value.strip()
+        if key == "BBOX":
+            parts = value.split(",")
+            coordinates = [round(float(part), conf.OVERTUREMAPS_RESPONSE_CACHE_PRECISION) for part in parts[:4]]
+            value = [coordinates, [part.strip().lower() for part in parts[4:]]]
+        elif key == "FILTER":
+            value = re.sub(r">\s+<", "><", value)
+        elif key in ("TYPENAMES", "OUTPUTFORMAT", "RESULTTYPE", "SRSNAME", "HITS"):
+            value = value.lower()
+        elif key == "STARTINDEX" and value == "0":
+            continue
+        normalized[key] = value
+    return normalized
+
+def _get_generations(bbox):
+    """The generations of the coverage cells of the bbox, None when it is not completely ingested."""
+    zoom = conf.OVERTUREMAPS_COVERAGE_ZOOM
+    tile_min_x, tile_min_y, tile_max_x, tile_max_y = tile_range(bbox, zoom)
+    generations = get_cell_generations(bbox, zoom)
+    if len(generations) < (tile_max_x - tile_min_x + 1) * (tile_max_y - tile_min_y + 1):
+        return None
+    return generations
+
+def get_request_version(params, bbox, server_url):
+    """
+    Return a digest of the GetFeature request and of the data it reads: the
+    release and the generations of the coverage cells of the bbox. None when
+    the bbox is not completely ingested. The server URL (scheme and host) is
+    part of it, as the responses link to their other pages.
+    """
+    generations = _get_generations(bbox)
+    if generations is None:
+        return None
+    try:
+        normalized = normalize_parameters(params)
+    except ValueError:
+        # invalid parameters, gisserver reports them
+        return None
+    data = json.dumps([conf.OVERTUREMAPS_RELEASE, server_url, normalized, generations], sort_keys=True)
+    return hashlib.sha1(data.encode()).hexdigest()
+
+def get_tile_version(z, x, y):
+    """Return a digest of the data of the vector tile, None when it is not completely ingested."""
+    generations = _get_generations(tile_bounds(x, y, z))
+    if generations is None:
+        return None
+    data = json.dumps(["tile", conf.OVERTUREMAPS_RELEASE, z, x, y, generations])
+    return hashlib.sha1(data.encode()).hexdigest()
+
+def get_last_modified(bbox):
+    """The last time buildings of the bbox were ingested, None if never."""
+    geometry = Polygon.from_bbox(bbox)
+    geometry.srid = 4326
+    return (
+        BBOXRequestBuildingModel.objects.filter(geometry__intersects=geometry)
+        .aggregate(last_modified=Max("timestamp"))["last_modified"]
+    )
+
+def get_cached_response(request, version, last_modified, response_cache, cache_control):
+    """
+    Answer a request of completely ingested data without querying it: 304
+    when the client has this version (If-None-Match or If-Modified-Since),
+    else the response cache. Returns None when it has to be rendered.
+    """
+    response = get_conditional_response(
+        request, etag=quote_etag(version), last_modified=last_modified.timestamp() if last_modified else None
+    )
+    if response is None and response_cache is not None:
+        response = response_cache.get(version)
+    if response is not None:
+        set_validators(response, version, last_modified, cache_control)
+    return response
+
+def set_validators(response, version, last_modified, cache_control):
+    response["ETag"] = quote_etag(version)
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified.timestamp())
+    response["Cache-Control"] = cache_control
+
+class ResponseCache:
+    """
+    Cache of rendered responses, by version (see get_request_version and
+    get_tile_version). Writing buildings in a cell (see touch_cells)
+    changes the versions of the requests of that area only.
+
+    The responses stored by the process are limited to max_bytes in total,
+    the least recently used ones are removed first.
+    """
+    def __init__(self, alias, max_size=None, max_bytes=None):
+        self.alias = alias
+        self.cache = caches[alias]
+        self.max_bytes = max_bytes or conf.OVERTUREMAPS_RESPONSE_CACHE_MAX_BYTES
+        self.max_size = min(max_size or conf.OVERTUREMAPS_RESPONSE_CACHE_MAX_SIZE, self.max_bytes)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # The size of the stored responses by key, least recently used first
+        self.sizes = OrderedDict()
+        self.size = 0
+
+    def get_key(self, version):
+        return "response:" + version
+
+    def get(self, version):
+        """Return the cached response of the request version, or None."""
+        key = self.get_key(version)
+        value = self.cache.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                # expired or evicted by the cache backend
+                self.size -= self.sizes.pop(key, 0)
+            else:
+                self.hits += 1
+                if key in self.sizes:
+                    self.sizes.move_to_end(key)
+        if value is None:
+            return None
+        logger.debug('Response cache hit %s (%s hits, %s misses)', key, self.hits, self.misses)
+        response = HttpResponse(value["content"], content_type=value["content_type"], status=value["status"])
+        for name, header in value["headers"].items():
+            response[name] = header
+        response["X-Cache"] = "HIT"
+        return response
+
+    def set(self, version, response):
+        """Store the response once it is completely rendered, returns the response to send."""
+        key = self.get_key(version)
+        response["X-Cache"] = "MISS"
+        if response.status_code != 200:
+            return response
+        if response.streaming:
+            response.streaming_content = self._store_stream(key, response, response.streaming_content)
+        elif len(response.content) <= self.max_size:
+            self._store(key, response, response.content)
+        return response
+
+    def _store_stream(self, key, response, stream):
+        chunks = []
+        size = 0
+        for chunk in stream:
+            if chunks is not None:
+                size += len(chunk)
+                if size <= self.max_size:
+                    chunks.append(chunk)
+                else:
+                    # too large, stream the rest without keeping it
+                    chunks = None
+            yield chunk
+        # only reached when the whole response was rendered
+        if chunks is not None:
+            self._store(key, response, b"".join(chunks))
+
+    def _store(self, key, response, content):
+        self.cache.set(key, {
+            "status": response.status_code,
+            "content_type": response["Content-Type"],
+            "headers": {name: response[name] for name in CACHED_HEADERS if response.has_header(name)},
+            "content": content,
+        })
+        with self._lock:
+            self.size += len(content) - self.sizes.pop(key, 0)
+            self.sizes[key] = len(content)
+            while self.size > self.max_bytes:
+                evicted, size = self.sizes.popitem(last=False)
+                self.size -= size
+                self.cache.delete(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.sizes), "bytes": self.size}
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """The response cache of OVERTUREMAPS_RESPONSE_CACHE, None when disabled."""
+    global _response_cache
+    alias = conf.OVERTUREMAPS_RESPONSE_CACHE
+    if not alias or alias not in settings.CACHES:
+        return None
+    with _response_cache_lock:
+        if _response_cache is None or _response_cache.alias != alias:
+            _response_cache = ResponseCache(alias)
+        return _response_cache
@@ -0,0 +1,189 @@
+from django.conf import settings
+
+# -- ingestion
+
+# How a cache miss is ingested: "background" enqueues an ingestion job that is
+# processed by the `ingestion_worker` management command, "inline" fetches the
+# data from Overture maps within the request itself.
+OVERTUREMAPS_INGESTION_MODE = getattr(settings, "OVERTUREMAPS_INGESTION_MODE", "background")
+
+# What to answer while a background ingestion is pending: "cached" serves what
+# is already in the database (flagged with an X-Ingestion: pending header, and
+# not cached), "pending" returns a 202 response.
+OVERTUREMAPS_PENDING_RESPONSE = getattr(settings, "OVERTUREMAPS_PENDING_RESPONSE", "cached")
+
+# Seconds suggested to clients (Retry-After header) for the "pending" response.
+OVERTUREMAPS_PENDING_RETRY_AFTER = getattr(settings, "OVERTUREMAPS_PENDING_RETRY_AFTER", 10)
+
+# Zoom level of the tile grid used to track which areas are already ingested.
+# Missing cells are fetched, merged in a few rectangular envelopes.
+OVERTUREMAPS_COVERAGE_ZOOM = getattr(settings, "OVERTUREMAPS_COVERAGE_ZOOM", 14)
+
+# Number of buildings written by each INSERT ... ON CONFLICT statement.
+OVERTUREMAPS_INGESTION_BATCH_SIZE = getattr(settings, "OVERTUREMAPS_INGESTION_BATCH_SIZE", 1000)
+
+# Bytes of arrow data read from Overture maps before they are written and
+# committed. Bounds the memory used by an ingestion, whatever the bbox size.
+OVERTUREMAPS_INGESTION_MEMORY_BUDGET = getattr(settings, "OVERTUREMAPS_INGESTION_MEMORY_BUDGET", 32 * 1024 * 1024)
+
+# The Overture maps release read from S3, and from PMTiles (see
+# OVERTUREMAPS_PMTILES_URL). Its files and row groups are listed once in a
+# manifest (see the `refresh_manifest` management command).
+OVERTUREMAPS_RELEASE = getattr(settings, "OVERTUREMAPS_RELEASE", "2024-07-22.0")
+
+# Where the buildings are read from: "s3" reads the public Overture maps
+# release, "local" the GeoParquet mirror written by the `sync_mirror`
+# management command (areas outside the mirrored regions fail to ingest).
+OVERTUREMAPS_SOURCE_BACKEND = getattr(settings, "OVERTUREMAPS_SOURCE_BACKEND", "s3")
+
+# Directory of the local GeoParquet mirror.
+OVERTUREMAPS_MIRROR_DIR = getattr(settings, "OVERTUREMAPS_MIRROR_DIR", "/data/overturemaps")
+
+# Named regions that can be mirrored, as {"name": (min_x, min_y, max_x, max_y)}.
+OVERTUREMAPS_REGIONS = getattr(settings, "OVERTUREMAPS_REGIONS", {})
+
+# Number of threads reading from Overture maps concurrently. The area to fetch
+# is split in tiles of OVERTUREMAPS_FETCH_ZOOM, each read by its own request.
+OVERTUREMAPS_FETCH_WORKERS = getattr(settings, "OVERTUREMAPS_FETCH_WORKERS", 4)
+OVERTUREMAPS_FETCH_ZOOM = getattr(settings, "OVERTUREMAPS_FETCH_ZOOM", 12)
+
+# Tolerances (degrees) of the simplified geometries computed at ingest,
+# served for zoomed-out requests (~1m and ~10m).
+OVERTUREMAPS_LOD1_TOLERANCE = getattr(settings, "OVERTUREMAPS_LOD1_TOLERANCE", 0.00001)
+OVERTUREMAPS_LOD2_TOLERANCE = getattr(settings, "OVERTUREMAPS_LOD2_TOLERANCE", 0.0001)
+
+# -- ingestion worker
+
+# Seconds to wait before looking for new jobs when the queue is empty.
+OVERTUREMAPS_WORKER_POLL_INTERVAL = getattr(settings, "OVERTUREMAPS_WORKER_POLL_INTERVAL", 2)
+
+# Number of times a job is tried before it is marked as failed.
+OVERTUREMAPS_WORKER_MAX_ATTEMPTS = getattr(settings, "OVERTUREMAPS_WORKER_MAX_ATTEMPTS", 3)
+
+# Seconds after which a running job is considered abandoned (e.g. the worker
+# was killed) and is queued again.
+OVERTUREMAPS_WORKER_REQUEUE_AFTER = getattr(settings, "OVERTUREMAPS_WORKER_REQUEUE_AFTER", 3600)
+
+# -- feature source
+
+# Where GetFeature reads the buildings from: "postgis" serves the ingested
+# buildings, "pmtiles" serves GeoJSON straight from the Overture maps
+# PMTiles archive without any ingestion, "auto" lets the request planner
+# choose by the scale of the bbox. Can be overridden per request with the
+# SOURCE parameter.
+OVERTUREMAPS_FEATURE_SOURCE = getattr(settings, "OVERTUREMAPS_FEATURE_SOURCE", "auto")
+
+# The PMTiles archive of Overture maps buildings, of OVERTUREMAPS_RELEASE (the
+# archives are published by the date of their release).
+OVERTUREMAPS_PMTILES_URL = getattr(
+    settings, "OVERTUREMAPS_PMTILES_URL",
+    f"https://overturemaps-tiles-us-west-2-beta.s3.amazonaws.com/{OVERTUREMAPS_RELEASE[:10]}/buildings.pmtiles",
+)
+
+# Maximum number of tiles read for a request, a lower zoom is used for larger bboxes.
+OVERTUREMAPS_PMTILES_MAX_TILES = getattr(settings, "OVERTUREMAPS_PMTILES_MAX_TILES", 64)
+
+# Number of range requests made concurrently.
+OVERTUREMAPS_PMTILES_CONCURRENCY = getattr(settings, "OVERTUREMAPS_PMTILES_CONCURRENCY", 16)
+
+# Tiles closer than this many bytes in the archive are read with a single range request.
+OVERTUREMAPS_PMTILES_COALESCE_GAP = getattr(settings, "OVERTUREMAPS_PMTILES_COALESCE_GAP", 64 * 1024)
+
+# Number of decoded tiles kept in memory.
+OVERTUREMAPS_PMTILES_CACHE_SIZE = getattr(settings, "OVERTUREMAPS_PMTILES_CACHE_SIZE", 512)
+
+# The simplified geometries are served from these Web Mercator zoom levels
+# down: the zoom of the tiles, and of the bbox for GetFeature (see
+# OVERTUREMAPS_VIEWPORT_SIZE), unless the LOD=0|1|2 parameter asks otherwise.
+OVERTUREMAPS_LOD1_ZOOM = getattr(settings, "OVERTUREMAPS_LOD1_ZOOM", 14)
+OVERTUREMAPS_LOD2_ZOOM = getattr(settings, "OVERTUREMAPS_LOD2_ZOOM", 13)
+
+# -- response cache
+
+# Alias in CACHES of the GetFeature response cache, None disables it. The
+# responses of an area are invalidated when its buildings are written again.
+OVERTUREMAPS_RESPONSE_CACHE = getattr(settings, "OVERTUREMAPS_RESPONSE_CACHE", "overturemaps")
+
+# Larger responses are not cached.
+OVERTUREMAPS_RESPONSE_CACHE_MAX_SIZE = getattr(settings, "OVERTUREMAPS_RESPONSE_CACHE_MAX_SIZE", 8 * 1024 * 1024)
+
+# Bytes of responses cached by each server process, the least recently used
+# ones are removed beyond it. Keep it well within the memory of the server.
+OVERTUREMAPS_RESPONSE_CACHE_MAX_BYTES = getattr(settings, "OVERTUREMAPS_RESPONSE_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+
+# Decimals the BBOX is rounded to in the cache key.
+OVERTUREMAPS_RESPONSE_CACHE_PRECISION = getattr(settings, "OVERTUREMAPS_RESPONSE_CACHE_PRECISION", 7)
+
+# Cache-Control of the GetFeature responses of ingested areas. They carry an
+# ETag (and Last-Modified), so clients and proxies can revalidate cheaply.
+OVERTUREMAPS_CACHE_CONTROL = getattr(settings, "OVERTUREMAPS_CACHE_CONTROL", "public, max-age=60")
+
+# -- output
+
+# Let PostgreSQL write the whole GML and GeoJSON features (not only their
+# geometries), Python only streams the text. The output is the same.
+OVERTUREMAPS_DB_FEATURE_RENDERING = getattr(settings, "OVERTUREMAPS_DB_FEATURE_RENDERING", False)
+
+# Store the GeoJSON and GML of every building at ingest (EPSG:4326 and
+# EPSG:3857), responses in those CRS write them as they are. Buildings
+# ingested before are rendered with the render_fragments command.
+OVERTUREMAPS_FEATURE_FRAGMENTS = getattr(settings, "OVERTUREMAPS_FEATURE_FRAGMENTS", False)
+
+# Maximum features of a FlatGeobuf page. Its spatial index is written before
+# the features, so the whole page is held in memory (the other binary formats
+# are streamed without limit).
+OVERTUREMAPS_FLATGEOBUF_MAX_PAGE_SIZE = getattr(settings, "OVERTUREMAPS_FLATGEOBUF_MAX_PAGE_SIZE", 10000)
+
+# Rows fetched at once from the server side cursor of a streamed result page
+# (see the GetFeature workaround in workarounds/wfs20.py).
+OVERTUREMAPS_STREAMING_CHUNK_SIZE = getattr(settings, "OVERTUREMAPS_STREAMING_CHUNK_SIZE", 2000)
+
+# -- paging
+
+# Pages of a single feature type without sortBy are read in primary key order
+# and their next links carry a CURSOR (the last primary key of the page), so
+# deep pages seek with WHERE id > ... instead of skipping rows with an OFFSET.
+OVERTUREMAPS_CURSOR_PAGING = getattr(settings, "OVERTUREMAPS_CURSOR_PAGING", True)
+
+# -- numberMatched
+
+# How the numberMatched of plain BBOX requests is counted: "exact" sums the
+# building counts of the coverage cells inside the bbox and counts the rest,
+# "estimated" uses the request planner estimate (no query of the buildings).
+# Can be overridden per request with the HITS parameter.
+OVERTUREMAPS_HITS = getattr(settings, "OVERTUREMAPS_HITS", "exact")
+
+# -- vector tiles
+
+# Zoom levels served by the building tiles endpoint, lower zooms get empty
+# tiles. Tiles ingest their missing coverage cells like GetFeature does.
+OVERTUREMAPS_TILES_MIN_ZOOM = getattr(settings, "OVERTUREMAPS_TILES_MIN_ZOOM", 13)
+OVERTUREMAPS_TILES_MAX_ZOOM = getattr(settings, "OVERTUREMAPS_TILES_MAX_ZOOM", 22)
+
+# Cache-Control of the tiles of ingested areas.
+OVERTUREMAPS_TILES_CACHE_CONTROL = getattr(settings, "OVERTUREMAPS_TILES_CACHE_CONTROL", "public, max-age=3600")
+
+# -- request planner ("auto" feature source)
+
+# Buildings per km2 assumed to estimate the size of a request when the
+# release manifest isn't built.
+OVERTUREMAPS_PLANNER_DENSITY = getattr(settings, "OVERTUREMAPS_PLANNER_DENSITY", 1000)
+
+# Size in pixels of the map of a client, the zoom level of a bbox is the Web
+# Mercator zoom (as the XYZ tile zooms) at which the bbox fills such a map.
+OVERTUREMAPS_VIEWPORT_SIZE = getattr(settings, "OVERTUREMAPS_VIEWPORT_SIZE", 1024)
+
+# Requests up to this many (estimated) buildings, from this zoom level on,
+# are served from PostGIS, ingesting what is missing.
+OVERTUREMAPS_PLANNER_MAX_POSTGIS_FEATURES = getattr(settings, "OVERTUREMAPS_PLANNER_MAX_POSTGIS_FEATURES", 50000)
+OVERTUREMAPS_PLANNER_MIN_POSTGIS_ZOOM = getattr(settings, "OVERTUREMAPS_PLANNER_MIN_POSTGIS_ZOOM", 12)
+
+# Larger GeoJSON requests from this zoom level on are served from PMTiles.
+OVERTUREMAPS_PLANNER_MIN_PMTILES_ZOOM = getattr(settings, "OVERTUREMAPS_PLANNER_MIN_PMTILES_ZOOM", 8)
+
+# Hard limit of buildings for PostGIS, even when SOURCE=postgis is requested.
+OVERTUREMAPS_PLANNER_MAX_FEATURES = getattr(settings, "OVERTUREMAPS_PLANNER_MAX_FEATURES", 500000)
+
+# What to answer for larger requests: "refuse" returns an error asking to zoom
+# in, "summary" a GeoJSON feature of the bbox with the estimated count.
+OVERTUREMAPS_PLANNER_HUGE = getattr(settings, "OVERTUREMAPS_PLANNER_HUGE", "refuse")
@@ -0,0 +1,81 @@
+import random
+import statistics
+import time
+
+from django.contrib.gis.geos import Polygon
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from overturemaps_wfsserver_app import conf
+from overturemaps_wfsserver_app.models import CoverageCellModel, get_missing_envelopes
+from overturemaps_wfsserver_app.tiles import tile_bounds, tile_range
+
+class Command(BaseCommand):
+    help = (
+        "Measure the latency of the coverage check while the number of covered "
+        "cells grows. Synthetic rows are rolled back at the end"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--checkpoints", default="1000,10000,100000",
+                            help="Comma separated numbers of covered cells to measure at")
+        parser.add_argument("--queries", type=int, default=200, help="Coverage checks per checkpoint")
+        parser.add_argument("--extent", default="-75.0,40.0,-73.0,41.5",
+                            help="Area where the synthetic cells and bboxes are generated (min_x,min_y,max_x,max_y)")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        zoom = conf.OVERTUREMAPS_COVERAGE_ZOOM
+        checkpoints = sorted(int(value) for value in options["checkpoints"].split(","))
+        extent = tuple(map(float, options["extent"].split(",")))
+        rnd = random.Random(options["seed"])
+
+        tile_min_x, tile_min_y, tile_max_x, tile_max_y = tile_range(extent, zoom)
+        cells = [
+            (x, y)
+            for x in range(tile_min_x, tile_max_x + 1)
+            for y in range(tile_min_y, tile_max_y + 1)
+        ]
+        rnd.shuffle(cells)
+        if len(cells) < checkpoints[-1]:
+            self.stderr.write(f"The extent only holds {len(cells)} cells at zoom {zoom}")
+
+        self.stdout.write(f"{'cells':>10} {'mean ms':>10} {'p95 ms':>10}")
+        with transaction.atomic():
+            CoverageCellModel.objects.filter(zoom=zoom).delete()
+            covered = 0
+            for checkpoint in checkpoints:
+                self._insert(zoom, cells[covered:checkpoint])
+                covered = min(checkpoint, len(cells))
+                with connection.cursor() as cursor:
+                    cursor.execute(f"ANALYZE {CoverageCellModel._meta.db_table}")
+
+                timings = []
+                for _ in range(options["queries"]):
+                    bbox = self._random_bbox(rnd, extent)
+                    start = time.perf_counter()
+                    get_missing_envelopes(bbox, zoom)
+                    timings.append((time.perf_counter() - start) * 1000)
+
+                timings.sort()
+                p95 = timings[int(len(timings) * 0.95) - 1]
+                self.stdout.write(f"{covered:>10} {statistics.mean(timings):>10.2f} {p95:>10.2f}")
+
+            transaction.set_rollback(True)
+
+    def _insert(self, zoom, cells, batch_size=5000):
+        for start in range(0, len(cells), batch_size):
+            rows = []
+            for x, y in cells[start:start + batch_size]:
+                geometry = Polygon.from_bbox(tile_bounds(x, y, zoom))
+                geometry.srid = 4326
+                rows.append(CoverageCellModel(zoom=zoom, x=x, y=y, geometry=geometry))
+            CoverageCellModel.objects.bulk_create(rows)
+
+    def _random_bbox(self, rnd, extent):
+        # Viewport sized boxes, roughly what a map client sends
+        width = rnd.uniform(0.001, 0.01)
+        height = rnd.uniform(0.001, 0.01)
+        min_x = rnd.uniform(extent[0], extent[2] - width)
+        min_y = rnd.uniform(extent[1], extent[3] - height)
+        return (min_x, min_y, min_x + width, min_y + height)
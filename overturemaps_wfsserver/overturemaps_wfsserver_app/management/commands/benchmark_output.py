@@ -0,0 +1,77 @@
+import statistics
+import time
+from unittest import mock
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from overturemaps_wfsserver_app import conf
+from overturemaps_wfsserver_app.models import OverturemapsBuildingModel, get_missing_envelopes
+
+class Command(BaseCommand):
+    help = (
+        "Compare the size and encode time of the GetFeature output formats for "
+        "an already ingested bbox (run warm_cache first)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bbox", required=True, help="Ingested area to request (min_x,min_y,max_x,max_y)")
+        parser.add_argument("--formats", default="geojson,csv,geoparquet,arrow,flatgeobuf",
+                            help="Comma separated outputFormat values to compare")
+        parser.add_argument("--count", type=int, help="Page size (COUNT), all features by default")
+        parser.add_argument("--repeat", type=int, default=3, help="Requests per format")
+        parser.add_argument("--url", default="/wfs/overturemaps/")
+
+    def handle(self, *args, **options):
+        bbox = tuple(map(float, options["bbox"].split(",")))
+        if get_missing_envelopes(bbox):
+            raise CommandError("The bbox is not completely ingested, run warm_cache for it first")
+
+        params = {
+            "SERVICE": "WFS",
+            "VERSION": "2.0.0",
+            "REQUEST": "GetFeature",
+            "TYPENAMES": OverturemapsBuildingModel._meta.model_name,
+            "BBOX": options["bbox"],
+            "SOURCE": "postgis",
+            "LOD": "0",
+        }
+        if options["count"]:
+            params["COUNT"] = options["count"]
+
+        # every request has to render its response
+        with mock.patch.object(conf, "OVERTUREMAPS_RESPONSE_CACHE", None):
+            results = [
+                self.benchmark(options, params, output_format) for output_format in options["formats"].split(",")
+            ]
+
+        baseline = {name: (size, elapsed) for name, size, elapsed, _ in results}.get("geojson")
+        self.stdout.write(f"{'format':>12} {'bytes':>12} {'seconds':>9} {'first byte':>11}  vs geojson")
+        for name, size, elapsed, first_byte in results:
+            relative = ""
+            if baseline and baseline[0] and baseline[1]:
+                relative = f"{size / baseline[0]:.2f}x size {elapsed / baseline[1]:.2f}x time"
+            self.stdout.write(f"{name:>12} {size:>12} {elapsed:>9.3f} {first_byte:>11.3f}  {relative}")
+
+    def benchmark(self, options, params, output_format):
+        """Return the (format, bytes, median seconds, median seconds to the first byte) of the output format."""
+        client = Client()
+        timings = []
+        first_bytes = []
+        size = 0
+        for _ in range(options["repeat"]):
+            start = time.perf_counter()
+            response = client.get(options["url"], {**params, "OUTPUTFORMAT": output_format})
+            if response.status_code != 200:
+                raise CommandError(f"{output_format}: HTTP {response.status_code} {response.content[:500]!r}")
+            if response.streaming:
+                size = 0
+                for chunk in response.streaming_content:
+                    if not size:
+                        first_bytes.append(time.perf_counter() - start)
+                    size += len(chunk)
+            else:
+                size = len(response.content)
+                first_bytes.append(time.perf_counter() - start)
+            timings.append(time.perf_counter() - start)
+        return output_format, size, statistics.median(timings), statistics.median(first_bytes)
@@ -0,0 +1,67 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from overturemaps_wfsserver_app import conf
+from overturemaps_wfsserver_app.models import (
+    IngestionJobModel,
+    ensure_manifest,
+    get_buildings_feature_type,
+    get_missing_envelopes,
+)
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = "Process the pending Overture maps ingestion jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true",
+            help="Process the pending jobs and exit instead of waiting for new ones",
+        )
+        parser.add_argument(
+            "--poll-interval", type=float, default=conf.OVERTUREMAPS_WORKER_POLL_INTERVAL,
+            help="Seconds to wait when the queue is empty",
+        )
+
+    def handle(self, *args, **options):
+        if conf.OVERTUREMAPS_SOURCE_BACKEND == "s3":
+            # once, rather than within the first job (or request) reading the release
+            try:
+                ensure_manifest()
+            except Exception:
+                logger.exception('Building the manifest of release %s failed', conf.OVERTUREMAPS_RELEASE)
+        buildings_ft = get_buildings_feature_type()
+        while True:
+            requeued = IngestionJobModel.requeue_stale(conf.OVERTUREMAPS_WORKER_REQUEUE_AFTER)
+            if requeued:
+                logger.warning('Requeued %s abandoned ingestion jobs', requeued)
+
+            job = IngestionJobModel.claim_next()
+            if job is None:
+                if options["once"]:
+                    break
+                time.sleep(options["poll_interval"])
+                continue
+
+            self.run_job(buildings_ft, job)
+
+    def run_job(self, buildings_ft, job):
+        logger.info('Running %s', job)
+        # Another job may have covered (part of) the area while this one was queued
+        envelopes = get_missing_envelopes(job.bbox)
+
+        start = time.monotonic()
+        feature_count = 0
+        try:
+            for envelope in envelopes:
+                feature_count += buildings_ft.ingest(envelope)
+        except Exception as e:
+            logger.exception('Ingestion job %s failed', job.pk)
+            job.mark_failed(str(e), conf.OVERTUREMAPS_WORKER_MAX_ATTEMPTS)
+            return
+
+        job.mark_done(feature_count)
+        logger.info('Job %s ingested %s features in %.1fs', job.pk, feature_count, time.monotonic() - start)
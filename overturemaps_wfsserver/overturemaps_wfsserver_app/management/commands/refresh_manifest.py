@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from overturemaps_wfsserver_app import conf
+from overturemaps_wfsserver_app.models import build_manifest
+
+class Command(BaseCommand):
+    help = (
+        "(Re)build the manifest listing the files and row groups of an Overture "
+        "maps release, e.g. after switching OVERTUREMAPS_RELEASE"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--release", default=conf.OVERTUREMAPS_RELEASE,
+                            help="Release to index, OVERTUREMAPS_RELEASE by default")
+        parser.add_argument("--workers", type=int, default=16, help="Parquet footers read concurrently")
+
+    def handle(self, *args, **options):
+        manifest = build_manifest(options["release"], workers=options["workers"])
+        self.stdout.write(f"Built {manifest}")
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from overturemaps_wfsserver_app import conf
+from overturemaps_wfsserver_app.models import OverturemapsBuildingModel, get_buildings_feature_type, store_fragments
+
+class Command(BaseCommand):
+    help = (
+        "Render the GeoJSON and GML fragments of the buildings ingested without "
+        "them, or of all buildings (--all) after the feature type changed"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Render the buildings that have fragments too")
+        parser.add_argument("--batch-size", type=int, default=conf.OVERTUREMAPS_INGESTION_BATCH_SIZE,
+                            help="Buildings rendered per transaction")
+
+    def handle(self, *args, **options):
+        feature_type = get_buildings_feature_type()
+        queryset = OverturemapsBuildingModel.objects.order_by("pk")
+        if not options["all"]:
+            missing = Q()
+            for column in OverturemapsBuildingModel.fragment_fields.values():
+                missing |= Q(**{f"{column}__isnull": True})
+            queryset = queryset.filter(missing)
+
+        rendered = 0
+        after = 0
+        while True:
+            ids = list(queryset.filter(pk__gt=after).values_list("pk", flat=True)[:options["batch_size"]])
+            if not ids:
+                break
+            with transaction.atomic():
+                rendered += store_fragments(feature_type, ids)
+            after = ids[-1]
+            self.stdout.write(f"Rendered {rendered} buildings", ending="\r")
+        self.stdout.write(f"Rendered {rendered} buildings")
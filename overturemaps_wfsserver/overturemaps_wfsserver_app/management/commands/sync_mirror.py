@@ -0,0 +1,116 @@
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from overturemaps_wfsserver_app import conf
+from overturemaps_wfsserver_app.models.overturemapsreader import REGION_FILE, mirror_path, owned_rows, read_s3
+from overturemaps_wfsserver_app.tiles import split_bbox, tile_bounds, tile_range
+
+class Command(BaseCommand):
+    help = (
+        "Copy the Overture maps buildings of some regions from the S3 release "
+        "into the local GeoParquet mirror (OVERTUREMAPS_MIRROR_DIR)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("regions", nargs="*",
+                            help="Names of the OVERTUREMAPS_REGIONS to sync, all of them by default")
+        parser.add_argument("--bbox", help="Sync this area (min_x,min_y,max_x,max_y) instead, requires --name")
+        parser.add_argument("--name", help="Region name of --bbox")
+        parser.add_argument("--workers", type=int, default=conf.OVERTUREMAPS_FETCH_WORKERS)
+        parser.add_argument("--row-group-size", type=int, default=10000,
+                            help="Rows per parquet row group, the granularity of the bbox pruning")
+
+    def handle(self, *args, **options):
+        if options["bbox"]:
+            if not options["name"]:
+                raise CommandError("--bbox requires --name")
+            regions = {options["name"]: tuple(map(float, options["bbox"].split(",")))}
+        else:
+            names = options["regions"] or list(conf.OVERTUREMAPS_REGIONS)
+            unknown = set(names) - set(conf.OVERTUREMAPS_REGIONS)
+            if unknown:
+                raise CommandError(f"Unknown regions: {', '.join(sorted(unknown))} (see OVERTUREMAPS_REGIONS)")
+            if not names:
+                raise CommandError("No regions to sync, set OVERTUREMAPS_REGIONS or use --bbox")
+            regions = {name: conf.OVERTUREMAPS_REGIONS[name] for name in names}
+
+        for name, bbox in regions.items():
+            self.sync_region(name, bbox, options["workers"], options["row_group_size"])
+
+    def sync_region(self, name, bbox, workers, row_group_size):
+        # Align the region to the coverage cells, as the ingested envelopes are,
+        # so adjacent regions share their edges and an envelope never ends
+        # within a cell of a region
+        zoom = conf.OVERTUREMAPS_COVERAGE_ZOOM
+        tile_min_x, tile_min_y, tile_max_x, tile_max_y = tile_range(bbox, zoom)
+        min_x, _, _, max_y = tile_bounds(tile_min_x, tile_min_y, zoom)
+        _, min_y, max_x, _ = tile_bounds(tile_max_x, tile_max_y, zoom)
+        bbox = (min_x, min_y, max_x, max_y)
+
+        # Each tile becomes a file, which keeps the files spatially compact
+        tiles = split_bbox(bbox, conf.OVERTUREMAPS_FETCH_ZOOM)
+        target = mirror_path(name)
+        tmp = mirror_path(f".{name}.tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        self.stdout.write(f"Syncing {name} {bbox} ({len(tiles)} tiles)")
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(workers) as executor:
+            counts = list(executor.map(
+                lambda item: self.sync_tile(os.path.join(tmp, f"part-{item[0]:05d}.parquet"), item[1], bbox, row_group_size),
+                enumerate(tiles),
+            ))
+        with open(os.path.join(tmp, REGION_FILE), "w") as f:
+            json.dump({"bbox": bbox, "synced": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}, f)
+
+        # Swap the directories, so readers never see a partial region
+        old = mirror_path(f".{name}.old")
+        shutil.rmtree(old, ignore_errors=True)
+        if os.path.exists(target):
+            os.rename(target, old)
+        os.rename(tmp, target)
+        shutil.rmtree(old, ignore_errors=True)
+        self.stdout.write(f"Synced {sum(counts)} buildings of {name} in {time.monotonic() - start:.0f}s")
+
+    def sync_tile(self, path, tile, bbox, row_group_size):
+        try:
+            reader = read_s3(tile)
+        finally:
+            # the manifest lookup opens a database connection in this thread
+            connections.close_all()
+        count = 0
+        writer = None
+        buffer = []
+        try:
+            while True:
+                try:
+                    batch = reader.read_next_batch()
+                except StopIteration:
+                    break
+                # don't store the buildings on a tile edge twice
+                batch = owned_rows(batch, tile, bbox)
+                if batch.num_rows == 0:
+                    continue
+                if writer is None:
+                    writer = pq.ParquetWriter(path, batch.schema, compression="zstd")
+                # the downloaded batches are small, group them in full row groups
+                buffer.append(batch)
+                count += batch.num_rows
+                if sum(b.num_rows for b in buffer) >= row_group_size:
+                    writer.write_table(pa.Table.from_batches(buffer), row_group_size=row_group_size)
+                    buffer = []
+            if buffer:
+                writer.write_table(pa.Table.from_batches(buffer), row_group_size=row_group_size)
+        finally:
+            if writer is not None:
+                writer.close()
+        return count
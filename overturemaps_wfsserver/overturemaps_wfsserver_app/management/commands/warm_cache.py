@@ -0,0 +1,119 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.contrib.gis.geos import GEOSGeometry, Polygon
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from overturemaps_wfsserver_app import conf
+from overturemaps_wfsserver_app.models import (
+    get_buildings_feature_type,
+    get_missing_envelopes,
+)
+from overturemaps_wfsserver_app.tiles import tile_bounds, tiles_for_bbox
+
+class Command(BaseCommand):
+    help = (
+        "Ingest the buildings of an area before it is requested. The area is "
+        "split in tiles ingested in parallel; only the cells not covered yet are "
+        "fetched, so an interrupted run continues where it stopped"
+    )
+
+    def add_arguments(self, parser):
+        area = parser.add_mutually_exclusive_group(required=True)
+        area.add_argument("--bbox", help="Area to ingest (min_x,min_y,max_x,max_y)")
+        area.add_argument("--polygon-file", help="GeoJSON file with the (multi)polygon(s) of the area to ingest")
+        area.add_argument("--region", action="append", help="Name of an OVERTUREMAPS_REGIONS entry, can be repeated")
+        parser.add_argument("--tile-zoom", type=int, default=conf.OVERTUREMAPS_FETCH_ZOOM,
+                            help="Zoom level of the tiles the area is split in, each tile is a unit of work")
+        parser.add_argument("--workers", type=int, default=2, help="Tiles ingested concurrently")
+
+    def handle(self, *args, **options):
+        area = self.get_area(options)
+        zoom = options["tile_zoom"]
+        if zoom > conf.OVERTUREMAPS_COVERAGE_ZOOM:
+            raise CommandError(f"--tile-zoom can't exceed the coverage zoom ({conf.OVERTUREMAPS_COVERAGE_ZOOM})")
+
+        tiles = []
+        for x, y in tiles_for_bbox(area.extent, zoom):
+            bbox = tile_bounds(x, y, zoom)
+            if area.intersects(Polygon.from_bbox(bbox)):
+                tiles.append(bbox)
+
+        todo = [bbox for bbox in tiles if get_missing_envelopes(bbox)]
+        self.stdout.write(
+            f"{len(tiles)} tiles at zoom {zoom}, {len(tiles) - len(todo)} already covered, "
+            f"{len(todo)} to ingest with {options['workers']} workers"
+        )
+        if not todo:
+            return
+
+        buildings_ft = get_buildings_feature_type()
+        done = 0
+        buildings = 0
+        failed = []
+        start = time.monotonic()
+        with ThreadPoolExecutor(options["workers"]) as executor:
+            futures = {executor.submit(self.ingest_tile, buildings_ft, bbox): bbox for bbox in todo}
+            for future in as_completed(futures):
+                bbox = futures[future]
+                try:
+                    written, elapsed = future.result()
+                except Exception as e:
+                    failed.append(bbox)
+                    self.stderr.write(f"Failed tile {bbox}: {e}")
+                    continue
+                done += 1
+                buildings += written
+                total_elapsed = time.monotonic() - start
+                self.stdout.write(
+                    f"[{done}/{len(todo)}] {bbox}: {written} buildings in {elapsed:.1f}s "
+                    f"(total {buildings}, {buildings / total_elapsed:.0f} buildings/sec)"
+                )
+
+        elapsed = time.monotonic() - start
+        self.stdout.write(
+            f"Ingested {buildings} buildings in {done} tiles in {elapsed:.0f}s "
+            f"({buildings / elapsed:.0f} buildings/sec, {done / elapsed * 60:.1f} tiles/min)"
+        )
+        if failed:
+            raise CommandError(f"{len(failed)} tiles failed, run the command again to retry them")
+
+    def get_area(self, options):
+        if options["bbox"]:
+            area = Polygon.from_bbox(tuple(map(float, options["bbox"].split(","))))
+        elif options["polygon_file"]:
+            with open(options["polygon_file"]) as f:
+                data = json.load(f)
+            if data.get("type") == "FeatureCollection":
+                geometries = [feature["geometry"] for feature in data["features"]]
+            elif data.get("type") == "Feature":
+                geometries = [data["geometry"]]
+            else:
+                geometries = [data]
+            area = GEOSGeometry(json.dumps(geometries[0]))
+            for geometry in geometries[1:]:
+                area = area.union(GEOSGeometry(json.dumps(geometry)))
+        else:
+            unknown = set(options["region"]) - set(conf.OVERTUREMAPS_REGIONS)
+            if unknown:
+                raise CommandError(f"Unknown regions: {', '.join(sorted(unknown))} (see OVERTUREMAPS_REGIONS)")
+            regions = [Polygon.from_bbox(conf.OVERTUREMAPS_REGIONS[name]) for name in options["region"]]
+            area = regions[0]
+            for region in regions[1:]:
+                area = area.union(region)
+        area.srid = 4326
+        return area
+
+    def ingest_tile(self, buildings_ft, bbox):
+        start = time.monotonic()
+        written = 0
+        try:
+            # checked again, a request may have covered part of it meanwhile
+            for envelope in get_missing_envelopes(bbox):
+                written += buildings_ft.ingest(envelope)
+        finally:
+            # each worker thread has its own database connection
+            connections.close_all()
+        return written, time.monotonic() - start
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('overturemaps_wfsserver_app', '0005_auto_20241122_1525'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionJobModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='pending', max_length=20)),
+                ('min_x', models.FloatField()),
+                ('min_y', models.FloatField()),
+                ('max_x', models.FloatField()),
+                ('max_y', models.FloatField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('feature_count', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:40
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('overturemaps_wfsserver_app', '0006_ingestionjobmodel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bboxrequestbuildingmodel',
+            name='geometry',
+            field=django.contrib.gis.db.models.fields.PolygonField(null=True, srid=4326),
+        ),
+        migrations.RunSQL(
+            sql="UPDATE overturemaps_wfsserver_app_bboxrequestbuildingmodel "
+                "SET geometry = ST_MakeEnvelope(min_x, min_y, max_x, max_y, 4326) "
+                "WHERE geometry IS NULL",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:05
+
+import django.contrib.gis.db.models.fields
+from django.conf import settings
+from django.contrib.gis.geos import Polygon
+from django.db import migrations, models
+
+from overturemaps_wfsserver_app.tiles import tile_bounds, tiles_for_bbox
+
+
+def bbox_requests_to_cells(apps, schema_editor):
+    """Keep as covered the cells that are completely inside an already requested bbox."""
+    BBOXRequestBuildingModel = apps.get_model('overturemaps_wfsserver_app', 'BBOXRequestBuildingModel')
+    CoverageCellModel = apps.get_model('overturemaps_wfsserver_app', 'CoverageCellModel')
+    zoom = getattr(settings, 'OVERTUREMAPS_COVERAGE_ZOOM', 14)
+
+    for bbox_request in BBOXRequestBuildingModel.objects.all().iterator():
+        cells = []
+        for x, y in tiles_for_bbox((bbox_request.min_x, bbox_request.min_y, bbox_request.max_x, bbox_request.max_y), zoom):
+            min_x, min_y, max_x, max_y = tile_bounds(x, y, zoom)
+            if (bbox_request.min_x <= min_x and bbox_request.min_y <= min_y and
+                    max_x <= bbox_request.max_x and max_y <= bbox_request.max_y):
+                geometry = Polygon.from_bbox((min_x, min_y, max_x, max_y))
+                geometry.srid = 4326
+                cells.append(CoverageCellModel(zoom=zoom, x=x, y=y, geometry=geometry))
+        CoverageCellModel.objects.bulk_create(cells, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('overturemaps_wfsserver_app', '0007_bboxrequestbuildingmodel_geometry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoverageCellModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zoom', models.SmallIntegerField()),
+                ('x', models.IntegerField()),
+                ('y', models.IntegerField()),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+                ('geometry', django.contrib.gis.db.models.fields.PolygonField(srid=4326)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='coveragecellmodel',
+            constraint=models.UniqueConstraint(fields=('zoom', 'x', 'y'), name='unique_coverage_cell'),
+        ),
+        migrations.RunPython(bbox_requests_to_cells, migrations.RunPython.noop),
+    ]
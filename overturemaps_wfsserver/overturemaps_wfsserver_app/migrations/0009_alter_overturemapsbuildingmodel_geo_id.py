@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 14:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('overturemaps_wfsserver_app', '0008_coveragecellmodel'),
+    ]
+
+    operations = [
+        # Keep only the last ingested row of each geo_id before adding the unique constraint
+        migrations.RunSQL(
+            sql=[
+                "DELETE FROM overturemaps_wfsserver_app_overturemapsbuildingmodel_sources s "
+                "USING overturemaps_wfsserver_app_overturemapsbuildingmodel a, "
+                "overturemaps_wfsserver_app_overturemapsbuildingmodel b "
+                "WHERE s.overturemapsbuildingmodel_id = a.id AND a.geo_id = b.geo_id AND a.id < b.id",
+                "DELETE FROM overturemaps_wfsserver_app_overturemapsbuildingmodel a "
+                "USING overturemaps_wfsserver_app_overturemapsbuildingmodel b "
+                "WHERE a.geo_id = b.geo_id AND a.id < b.id",
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AlterField(
+            model_name='overturemapsbuildingmodel',
+            name='geo_id',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+    ]
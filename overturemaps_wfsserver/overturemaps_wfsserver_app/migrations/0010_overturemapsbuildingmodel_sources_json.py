@@ -0,0 +1,61 @@
+# Generated by Django 3.2.25 on 2026-10-18 15:02
+
+from django.db import migrations, models
+
+
+def sources_to_json(apps, schema_editor):
+    """Copy the sources linked to each building into its json sources field."""
+    OverturemapsBuildingModel = apps.get_model('overturemaps_wfsserver_app', 'OverturemapsBuildingModel')
+    Through = OverturemapsBuildingModel.sources.through
+
+    buildings = {}
+    links = Through.objects.select_related('overturemapssourcemodel').order_by('overturemapsbuildingmodel_id')
+    for link in links.iterator():
+        # the links are ordered by building, so a full batch only holds complete buildings
+        if len(buildings) >= 1000 and link.overturemapsbuildingmodel_id not in buildings:
+            _save_sources(OverturemapsBuildingModel, buildings)
+            buildings = {}
+        source = link.overturemapssourcemodel
+        buildings.setdefault(link.overturemapsbuildingmodel_id, []).append({
+            'property': source.property,
+            'dataset': source.dataset,
+            'record_id': source.record_id,
+            'confidence': source.confidence,
+        })
+    _save_sources(OverturemapsBuildingModel, buildings)
+
+
+def _save_sources(OverturemapsBuildingModel, buildings):
+    instances = [
+        OverturemapsBuildingModel(pk=pk, sources_json=sources)
+        for pk, sources in buildings.items()
+    ]
+    OverturemapsBuildingModel.objects.bulk_update(instances, ['sources_json'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('overturemaps_wfsserver_app', '0009_alter_overturemapsbuildingmodel_geo_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='overturemapsbuildingmodel',
+            name='sources_json',
+            field=models.JSONField(default=list),
+        ),
+        migrations.RunPython(sources_to_json, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='overturemapsbuildingmodel',
+            name='sources',
+        ),
+        migrations.RenameField(
+            model_name='overturemapsbuildingmodel',
+            old_name='sources_json',
+            new_name='sources',
+        ),
+        migrations.DeleteModel(
+            name='OverturemapsSourceModel',
+        ),
+    ]
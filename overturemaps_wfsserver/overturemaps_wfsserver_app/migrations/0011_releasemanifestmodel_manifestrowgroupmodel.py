@@ -0,0 +1,38 @@
+# Generated by Django 3.2.25 on 2026-10-18 16:10
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('overturemaps_wfsserver_app', '0010_overturemapsbuildingmodel_sources_json'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReleaseManifestModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('release', models.CharField(max_length=100, unique=True)),
+                ('path', models.CharField(max_length=255)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('schema', models.BinaryField()),
+                ('file_count', models.IntegerField()),
+                ('row_group_count', models.IntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ManifestRowGroupModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255)),
+                ('row_group', models.IntegerField()),
+                ('num_rows', models.IntegerField()),
+                ('geometry', django.contrib.gis.db.models.fields.PolygonField(srid=4326)),
+                ('manifest', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='row_groups', to='overturemaps_wfsserver_app.releasemanifestmodel')),
+            ],
+        ),
+    ]
@@ -0,0 +1,97 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:20
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+BUILDINGS_TABLE = 'overturemaps_wfsserver_app_overturemapsbuildingmodel'
+BUILDING_COLUMNS = (
+    'id, geo_id, version, update_time, has_parts, sources, subtype, classtype, '
+    'num_floors, height, roof_shape, roof_direction, roof_material'
+)
+# The default OVERTUREMAPS_LOD1_TOLERANCE and OVERTUREMAPS_LOD2_TOLERANCE, frozen
+# so the migration gives the same result whatever the settings of the deploy
+LOD1_TOLERANCE = 0.00001
+LOD2_TOLERANCE = 0.0001
+
+
+def _lod_view(lod):
+    view = f'overturemaps_wfsserver_app_overturemapsbuildinglod{lod}model'
+    return migrations.RunSQL(
+        f'CREATE VIEW {view} AS SELECT {BUILDING_COLUMNS}, geometry_lod{lod} AS geometry FROM {BUILDINGS_TABLE}',
+        f'DROP VIEW {view}',
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('overturemaps_wfsserver_app', '0011_releasemanifestmodel_manifestrowgroupmodel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='overturemapsbuildingmodel',
+            name='geometry_lod1',
+            field=django.contrib.gis.db.models.fields.MultiPolygonField(null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='overturemapsbuildingmodel',
+            name='geometry_lod2',
+            field=django.contrib.gis.db.models.fields.MultiPolygonField(null=True, srid=4326),
+        ),
+        migrations.RunSQL(
+            [(
+                f'UPDATE {BUILDINGS_TABLE} SET '
+                'geometry_lod1 = ST_Multi(ST_SimplifyPreserveTopology(geometry, %s)), '
+                'geometry_lod2 = ST_Multi(ST_SimplifyPreserveTopology(geometry, %s))',
+                [LOD1_TOLERANCE, LOD2_TOLERANCE],
+            )],
+            migrations.RunSQL.noop,
+        ),
+        _lod_view(1),
+        _lod_view(2),
+        migrations.CreateModel(
+            name='OverturemapsBuildingLOD1Model',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('geo_id', models.CharField(max_length=100, unique=True)),
+                ('version', models.IntegerField()),
+                ('update_time', models.DateTimeField()),
+                ('has_parts', models.BooleanField()),
+                ('sources', models.JSONField(default=list)),
+                ('subtype', models.CharField(blank=True, max_length=100, null=True)),
+                ('classtype', models.CharField(blank=True, max_length=100, null=True)),
+                ('num_floors', models.IntegerField(null=True)),
+                ('height', models.FloatField(null=True)),
+                ('roof_shape', models.CharField(blank=True, max_length=100, null=True)),
+                ('roof_direction', models.FloatField(null=True)),
+                ('roof_material', models.CharField(blank=True, max_length=100, null=True)),
+                ('geometry', django.contrib.gis.db.models.fields.MultiPolygonField(srid=4326)),
+            ],
+            options={
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='OverturemapsBuildingLOD2Model',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('geo_id', models.CharField(max_length=100, unique=True)),
+                ('version', models.IntegerField()),
+                ('update_time', models.DateTimeField()),
+                ('has_parts', models.BooleanField()),
+                ('sources', models.JSONField(default=list)),
+                ('subtype', models.CharField(blank=True, max_length=100, null=True)),
+                ('classtype', models.CharField(blank=True, max_length=100, null=True)),
+                ('num_floors', models.IntegerField(null=True)),
+                ('height', models.FloatField(null=True)),
+                ('roof_shape', models.CharField(blank=True, max_length=100, null=True)),
+                ('roof_direction', models.FloatField(null=True)),
+                ('roof_material', models.CharField(blank=True, max_length=100, null=True)),
+                ('geometry', django.contrib.gis.db.models.fields.MultiPolygonField(srid=4326)),
+            ],
+            options={
+                'managed': False,
+            },
+        ),
+    ]
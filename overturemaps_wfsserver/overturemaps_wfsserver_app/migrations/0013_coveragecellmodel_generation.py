@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('overturemaps_wfsserver_app', '0012_overturemapsbuildingmodel_geometry_lod'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coveragecellmodel',
+            name='generation',
+            field=models.IntegerField(default=0),
+        ),
+    ]
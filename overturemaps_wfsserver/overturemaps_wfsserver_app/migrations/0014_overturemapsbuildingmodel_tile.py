@@ -0,0 +1,99 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+BUILDINGS_TABLE = 'overturemaps_wfsserver_app_overturemapsbuildingmodel'
+CELLS_TABLE = 'overturemaps_wfsserver_app_coveragecellmodel'
+BUILDING_COLUMNS = (
+    'id, geo_id, version, update_time, has_parts, sources, subtype, classtype, '
+    'num_floors, height, roof_shape, roof_direction, roof_material, tile_x, tile_y'
+)
+OLD_BUILDING_COLUMNS = (
+    'id, geo_id, version, update_time, has_parts, sources, subtype, classtype, '
+    'num_floors, height, roof_shape, roof_direction, roof_material'
+)
+ZOOM = int(getattr(settings, 'OVERTUREMAPS_COVERAGE_ZOOM', 14))
+# A frozen copy of TILE_X_SQL and TILE_Y_SQL of models/overturemapsingestion.py,
+# the runtime definition: a migration must keep computing what it did when it
+# was written, even if the ingestion code changes later
+TILE_X_SQL = 'LEAST(GREATEST(floor((ST_XMin(geometry) + 180) / 360 * 2 ^ {zoom}), 0), 2 ^ {zoom} - 1)::integer'
+TILE_Y_SQL = (
+    'LEAST(GREATEST(floor((1 - asinh(tan(radians(GREATEST(LEAST(ST_YMin(geometry), 85.0511287798066), '
+    '-85.0511287798066)))) / pi()) / 2 * 2 ^ {zoom}), 0), 2 ^ {zoom} - 1)::integer'
+)
+
+
+def _lod_view(lod):
+    view = f'overturemaps_wfsserver_app_overturemapsbuildinglod{lod}model'
+    return migrations.RunSQL(
+        [
+            f'DROP VIEW {view}',
+            f'CREATE VIEW {view} AS SELECT {BUILDING_COLUMNS}, geometry_lod{lod} AS geometry FROM {BUILDINGS_TABLE}',
+        ],
+        [
+            f'DROP VIEW {view}',
+            f'CREATE VIEW {view} AS SELECT {OLD_BUILDING_COLUMNS}, geometry_lod{lod} AS geometry FROM {BUILDINGS_TABLE}',
+        ],
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('overturemaps_wfsserver_app', '0013_coveragecellmodel_generation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='overturemapsbuildingmodel',
+            name='tile_x',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='overturemapsbuildingmodel',
+            name='tile_y',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='overturemapsbuildingmodel',
+            index=models.Index(fields=['tile_x', 'tile_y'], name='building_tile_idx'),
+        ),
+        migrations.AddField(
+            model_name='overturemapsbuildinglod1model',
+            name='tile_x',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='overturemapsbuildinglod1model',
+            name='tile_y',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='overturemapsbuildinglod2model',
+            name='tile_x',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='overturemapsbuildinglod2model',
+            name='tile_y',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='coveragecellmodel',
+            name='feature_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunSQL(
+            [
+                f'UPDATE {BUILDINGS_TABLE} SET '
+                f'tile_x = {TILE_X_SQL.format(zoom=ZOOM)}, tile_y = {TILE_Y_SQL.format(zoom=ZOOM)}',
+                f'UPDATE {CELLS_TABLE} c SET feature_count = '
+                f'(SELECT count(*) FROM {BUILDINGS_TABLE} b WHERE b.tile_x = c.x AND b.tile_y = c.y) '
+                f'WHERE c.zoom = {ZOOM}',
+            ],
+            migrations.RunSQL.noop,
+        ),
+        _lod_view(1),
+        _lod_view(2),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('overturemaps_wfsserver_app', '0014_overturemapsbuildingmodel_tile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='overturemapsbuildingmodel',
+            name='geojson_4326',
+            field=models.TextField(null=True),
+        ),
+        migrations.AddField(
+            model_name='overturemapsbuildingmodel',
+            name='geojson_3857',
+            field=models.TextField(null=True),
+        ),
+        migrations.AddField(
+            model_name='overturemapsbuildingmodel',
+            name='gml_4326',
+            field=models.TextField(null=True),
+        ),
+        migrations.AddField(
+            model_name='overturemapsbuildingmodel',
+            name='gml_3857',
+            field=models.TextField(null=True),
+        ),
+    ]
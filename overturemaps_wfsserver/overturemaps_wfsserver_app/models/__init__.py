@@ -1,10 +1,17 @@
 # models/__init__.py
 from .overturemapsutils import BaseGeoJSONWriter
 from .overturemapsutils import GeoJSONWriter
-from .overturemapsutils import is_bbox_contained, copy, get_writer
+from .overturemapsutils import copy, get_writer, iter_chunks
 
-from .overturemapssourcemodel import OverturemapsSourceModel
+from .overturemapsingestionjob import IngestionJobModel
+from .overturemapsmanifest import ReleaseManifestModel, ManifestRowGroupModel, build_manifest, ensure_manifest, get_manifest
+from .overturemapsreader import MirrorMissError, ParallelRecordBatchReader, fetch_buildings, owned_rows
+from .overturemapscoverage import CoverageCellModel, count_cell_features, count_features, get_cell_generations, get_missing_cells, get_missing_envelopes, mark_covered, touch_cells
 
 from .overturemapsbuilding import OverturemapsBuildingModel
-from .overturemapsbuilding import OverturemapsBuildingFeatureType
+from .overturemapsbuilding import OverturemapsBuildingLOD1Model, OverturemapsBuildingLOD2Model
+from .overturemapsbuilding import BUILDING_FIELDS, LOD_MODELS
+from .overturemapsbuilding import OverturemapsBuildingFeatureType, get_buildings_feature_type
+from .overturemapsfragments import store_fragments
 from .overturemapsbuilding import BBOXRequestBuildingModel
+from .overturemapsbuilding import IngestionContext
@@ -1,14 +1,17 @@
-import geojson
-import io
-
-from overturemaps import record_batch_reader
+import time
 
 from django.contrib.gis.db import models
-from django.contrib.gis.geos import MultiPolygon, Polygon
+from django.contrib.gis.geos import Polygon
 from gisserver.features import FeatureType
+from gisserver.geometries import CRS
 from django.db import transaction
-from .overturemapssourcemodel import OverturemapsSourceModel
-from .overturemapsutils import is_bbox_contained, get_writer, copy
+from .. import conf
+from .overturemapscoverage import count_cell_features, get_missing_envelopes, mark_covered, touch_cells
+from .overturemapsfragments import store_fragments
+from .overturemapsingestion import batch_to_rows, upsert_buildings
+from .overturemapsingestionjob import IngestionJobModel
+from .overturemapsreader import ParallelRecordBatchReader
+from .overturemapsutils import iter_chunks
 
 import logging
 
@@ -19,13 +22,21 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-class OverturemapsBuildingModel(models.Model):
-    geo_id = models.CharField(max_length=100)
+# The fields exposed by the buildings feature type, for every level of detail
+BUILDING_FIELDS = [
+    "id", "geo_id", "version", "update_time", "has_parts", "sources", "geometry",
+    "subtype", "classtype", "num_floors", "height", "roof_shape", "roof_direction", "roof_material",
+]
+
+# The other CRS the buildings are served in, next to EPSG:4326
+RD_NEW = CRS.from_srid(3857)
+
+class BaseBuildingModel(models.Model):
+    geo_id = models.CharField(max_length=100, unique=True)
     version = models.IntegerField()
     update_time = models.DateTimeField()
     has_parts = models.BooleanField()
-    sources = models.ManyToManyField(OverturemapsSourceModel)
-    geometry = models.MultiPolygonField()
+    sources = models.JSONField(default=list)
 
     subtype = models.CharField(max_length=100, blank=True, null=True)
     classtype = models.CharField(max_length=100, blank=True, null=True)
@@ -34,153 +45,179 @@ class OverturemapsBuildingModel(models.Model):
     roof_shape = models.CharField(max_length=100, blank=True, null=True)
     roof_direction = models.FloatField(null=True)
     roof_material = models.CharField(max_length=100, blank=True, null=True)
+    # The coverage cell of the lower-left corner of the building extent,
+    # each building is counted in that cell only (see count_features)
+    tile_x = models.IntegerField(null=True)
+    tile_y = models.IntegerField(null=True)
+
+    class Meta:
+        abstract = True
 
     def __str__(self):
         return self.geo_id
 
+class OverturemapsBuildingModel(BaseBuildingModel):
+    geometry = models.MultiPolygonField()
+    # Simplified geometries (OVERTUREMAPS_LOD1_TOLERANCE and
+    # OVERTUREMAPS_LOD2_TOLERANCE) computed at ingest, for zoomed-out requests
+    geometry_lod1 = models.MultiPolygonField(null=True)
+    geometry_lod2 = models.MultiPolygonField(null=True)
+    # The GeoJSON feature and the GML feature elements, rendered at ingest
+    # (see store_fragments) for the CRS the buildings are served in
+    geojson_4326 = models.TextField(null=True)
+    geojson_3857 = models.TextField(null=True)
+    gml_4326 = models.TextField(null=True)
+    gml_3857 = models.TextField(null=True)
+
+    # The fragment field of each (format, srid)
+    fragment_fields = {
+        ("geojson", 4326): "geojson_4326",
+        ("geojson", 3857): "geojson_3857",
+        ("gml", 4326): "gml_4326",
+        ("gml", 3857): "gml_3857",
+    }
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["tile_x", "tile_y"], name="building_tile_idx"),
+        ]
+
+class OverturemapsBuildingLOD1Model(BaseBuildingModel):
+    """The buildings with the geometry_lod1 as geometry (a database view)."""
+    geometry = models.MultiPolygonField()
+
+    class Meta:
+        managed = False
+
+class OverturemapsBuildingLOD2Model(BaseBuildingModel):
+    """The buildings with the geometry_lod2 as geometry (a database view)."""
+    geometry = models.MultiPolygonField()
+
+    class Meta:
+        managed = False
+
+# Model to read the buildings from, by level of detail
+LOD_MODELS = {
+    0: OverturemapsBuildingModel,
+    1: OverturemapsBuildingLOD1Model,
+    2: OverturemapsBuildingLOD2Model,
+}
+
 class BBOXRequestBuildingModel(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     min_x = models.FloatField()
     min_y = models.FloatField()
     max_x = models.FloatField()
     max_y = models.FloatField()
+    geometry = models.PolygonField(null=True)
+
+    def save(self, *args, **kwargs):
+        if self.geometry is None:
+            self.geometry = Polygon.from_bbox((self.min_x, self.min_y, self.max_x, self.max_y))
+            self.geometry.srid = 4326
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"BBOX({self.min_x}, {self.min_y}, {self.max_x}, {self.max_y}) at {self.timestamp}"
 
-class OverturemapsBuildingFeatureType(FeatureType):
+class IngestionContext:
+    """
+    The ingestion state of a single request. The feature types only read
+    it, so concurrent requests never see each other's bbox
+    """
+    def __init__(self, bbox):
+        self.bbox = bbox
+        self.contained = None
+        self.jobs = []
 
-    bbox = None
+class OverturemapsBuildingFeatureType(FeatureType):
 
-    def set_data(self, bb):
-        self.bbox = bb
-        min_x, min_y, max_x, max_y = bb
-        if is_bbox_contained(BBOXRequestBuildingModel, min_x, min_y, max_x, max_y):
+    def __init__(self, *args, context=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.context = context
+
+    def set_data(self, context):
+        """Make sure the bbox of the request context gets ingested.
+        Only the coverage cells not ingested yet are fetched.
+        Returns whether the bbox is already available in the database.
+        """
+        envelopes = get_missing_envelopes(context.bbox)
+        if not envelopes:
             logger.debug('BBOX is already contained in database')
-            return
+            context.contained = True
         else:
-            logger.debug('BBOX is not completly contained in database')
-            self.dump_to_database()
-            # save the bbox after dump of objects
-            bbox_request = BBOXRequestBuildingModel.objects.create(min_x=min_x,min_y=min_y,max_x=max_x,max_y=max_y)
-
-    def _load_overturemaps(self):
-        # locality|locality_area|administrative_boundary|building|building_part|division|division_area|place|segment|connector|infrastructure|land|land_cover|land_use|water
-        datatype = 'building'
-        output_format = 'geojson'
-        output = io.StringIO()
-        reader = record_batch_reader(datatype, self.bbox)
-        with get_writer(output_format, output, schema=reader.schema) as writer:
-            copy(reader, writer)
-        output.seek(0)
-        gj = geojson.loads(output.getvalue())
-        return gj
+            logger.debug('BBOX is not completly contained in database, missing %s', envelopes)
+            if conf.OVERTUREMAPS_INGESTION_MODE == "inline":
+                for envelope in envelopes:
+                    self.ingest(envelope)
+                context.contained = True
+            else:
+                context.jobs = [IngestionJobModel.enqueue(*envelope) for envelope in envelopes]
+                context.contained = False
+                logger.debug('BBOX ingestion queued as jobs %s', [job.pk for job in context.jobs])
+        return context.contained
+
+    def ingest(self, bb):
+        """Fetch the (coverage cell aligned) bbox from overturemaps and record it as contained in database.
+        Returns the number of inserted/updated buildings.
+        """
+        min_x, min_y, max_x, max_y = bb
+        written = self.dump_to_database(bb)
+        # save the bbox after dump of objects
+        BBOXRequestBuildingModel.objects.create(min_x=min_x,min_y=min_y,max_x=max_x,max_y=max_y)
+        mark_covered(bb)
+        count_cell_features(OverturemapsBuildingModel, bb)
+        return written
+
+    def _load_overturemaps(self, bb):
+        # the bbox is fetched as tiles read concurrently
+        return ParallelRecordBatchReader(bb)
 
     def get_queryset(self):
-        logger.debug('Get queryset')
+        logger.debug('Get queryset (BBOX %s)', self.context.bbox if self.context else None)
         return super().get_queryset()
 
-    def dump_to_database(self):
+    def dump_to_database(self, bb):
         # load from overturemaps
         logger.debug('Request to overturemaps')
-        self.data = self._load_overturemaps()
-        # dump to database
-        features = self.data['features']
+        # dump to database, straight from the arrow batches. Every chunk is
+        # committed on its own; the bbox is only marked as covered once all
+        # of them are written, so a failed ingestion is simply retried.
         logger.debug('Dumping')
-        instances = []
-        with transaction.atomic():
-            for feature in features:
-                properties = feature['properties']
-                geom = feature['geometry']
-
-                geometry = ''
-                if geom['type'] == "Polygon":
-                  try:
-                    geomPoly = Polygon(geom['coordinates'][0])
-                    geometry = MultiPolygon(geomPoly)
-                    geometry.srid = 4326
-                  except (ValueError, TypeError) as e:
-                    logger.error(f"Error creating Polygon from feature {properties['id']},{geom}: {e}")
-                    continue
-                else:
-                    if geom['type'] == "MultiPolygon":
-                        try:
-                            polygons = []
-                            #logger.debug("Check coordinates")
-                            for polygon_coords in geom['coordinates']:
-                                exterior_coords = polygon_coords[0][0]
-                                holes = [Polygon(hole) for hole in polygon_coords[0][1:]]
-                                #holes = []
-                                polygons.append(Polygon(exterior_coords, holes))
-                                #logger.debug(f"MultiPolygon exterior_coords coods {len(exterior_coords)}")
-                                #logger.debug(f"MultiPolygon holes {len(holes)}")
-                                #polygons.append(Polygon(exterior_coords))
-
-                            #logger.debug(f"MultiPolygon geom size {len(geom['coordinates'])}")
-                            geometry = MultiPolygon(polygons)
-                            geometry.srid = 4326
-                        except (ValueError, TypeError) as e:
-                            logger.error(f"Error creating MultiPolygon from feature {properties['id']},{geom}: {e}")
-                            continue
-                    else:
-                        logger.error(f"Feature {properties['id']} does not contain a valid geometry type {geom}")
-                        continue
-
-                if not geometry.valid:
-                    logger.error(f"Feature {properties['id']} does not contains a valid geometry {geom}")
-                    continue
-
-                try:
-                    matches = OverturemapsBuildingModel.objects.filter(geo_id=properties['id'])
-
-                    if matches.exists():
-                        matches.update(
-                            version=properties['version'],
-                            update_time=properties['update_time'],
-                            has_parts=properties['has_parts'],
-                            geometry=geometry,
-                            subtype=properties.get('subtype', ''),
-                            classtype=properties.get('class', ''),
-                            num_floors=properties.get('num_floors', 0),
-                            height=properties.get('height', 0),
-                            roof_shape=properties.get('roof_shape', ''),
-                            roof_direction=properties.get('roof_direction', 0),
-                            roof_material=properties.get('roof_material', '')
-                        )
-                        instance = matches.first()
-                        created = False
-                    else:
-                        instance = OverturemapsBuildingModel.objects.create(
-                            geo_id=properties['id'],
-                            version=properties['version'],
-                            update_time=properties['update_time'],
-                            has_parts=properties['has_parts'],
-                            geometry=geometry,
-                            subtype=properties.get('subtype', ''),
-                            classtype=properties.get('class', ''),
-                            num_floors=properties.get('num_floors', 0),
-                            height=properties.get('height', 0),
-                            roof_shape=properties.get('roof_shape', ''),
-                            roof_direction=properties.get('roof_direction', 0),
-                            roof_material=properties.get('roof_material', '')
-                        )
-                        created = True
-
-                    if not created:
-                        instance.sources.clear()
-
-                    for source in properties['sources']:
-                        source_instance = OverturemapsSourceModel.objects.create(
-                            property=source['property'],
-                            dataset=source['dataset'],
-                            record_id=source['record_id'],
-                            confidence=source['confidence']
-                        )
-                        instance.sources.add(source_instance)
-
-                    instances.append(instance)
-
-                except (ValueError, TypeError) as e:
-                    logger.error(f"Error saving feature {properties['id']}: {e}")
-                    continue
-        return instances
+        start = time.monotonic()
+        total = 0
+        written = 0
+        with self._load_overturemaps(bb) as reader:
+            for chunk in iter_chunks(reader, conf.OVERTUREMAPS_INGESTION_MEMORY_BUDGET):
+                with transaction.atomic():
+                    for batch in chunk:
+                        rows = batch_to_rows(batch)
+                        ids, extent = upsert_buildings(OverturemapsBuildingModel, rows)
+                        if ids:
+                            # the cached responses and counts of the area are outdated now
+                            touch_cells(extent)
+                            count_cell_features(OverturemapsBuildingModel, extent)
+                            if conf.OVERTUREMAPS_FEATURE_FRAGMENTS:
+                                store_fragments(get_buildings_feature_type(), ids)
+                        written += len(ids)
+                        total += batch.num_rows
+                # release the chunk before the next one is read
+                del chunk, batch, rows
+        elapsed = time.monotonic() - start
+        logger.info(
+            'Upserted %s of %s features in %.1fs (%.0f features/sec)',
+            written, total, elapsed, total / elapsed if elapsed else 0
+        )
+        return written
+
+def get_buildings_feature_type(model=OverturemapsBuildingModel, context=None):
+    """The buildings feature type, as served by the WFS (the levels of detail are other models)."""
+    return OverturemapsBuildingFeatureType(
+        model.objects.all(),
+        fields=BUILDING_FIELDS,
+        name=OverturemapsBuildingModel._meta.model_name,
+        # the gml:name, as str() of the model, but readable by the database
+        display_field_name="geo_id",
+        other_crs=[RD_NEW],
+        context=context,
+    )
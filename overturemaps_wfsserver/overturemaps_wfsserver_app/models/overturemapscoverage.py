@@ -0,0 +1,137 @@
+from django.contrib.gis.db import models
+from django.db import connection
+from django.db.models import Count, F, Sum
+from django.contrib.gis.geos import Polygon
+
+from .. import conf
+from ..tiles import EPSILON, merge_tiles, quadkey, tile_bounds, tile_range, tiles_for_bbox
+
+class CoverageCellModel(models.Model):
+    """A tile of the coverage grid whose buildings are already in the database."""
+    zoom = models.SmallIntegerField()
+    x = models.IntegerField()
+    y = models.IntegerField()
+    timestamp = models.DateTimeField(auto_now_add=True)
+    # Incremented whenever buildings of the cell are written again
+    generation = models.IntegerField(default=0)
+    # Number of buildings anchored in the cell (see count_cell_features)
+    feature_count = models.IntegerField(default=0)
+    geometry = models.PolygonField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["zoom", "x", "y"], name="unique_coverage_cell"),
+        ]
+
+    @property
+    def quadkey(self):
+        return quadkey(self.x, self.y, self.zoom)
+
+    def __str__(self):
+        return f"Cell {self.zoom}/{self.x}/{self.y} at {self.timestamp}"
+
+def get_missing_cells(bbox, zoom=None):
+    """Return the (x, y) of the cells covering the bbox which are not ingested yet."""
+    zoom = zoom or conf.OVERTUREMAPS_COVERAGE_ZOOM
+    covered = set(_cells_filter(bbox, zoom).values_list("x", "y"))
+    return set(tiles_for_bbox(bbox, zoom)) - covered
+
+def get_missing_envelopes(bbox, zoom=None):
+    """Return the few bboxes to fetch so the bbox is completely covered."""
+    zoom = zoom or conf.OVERTUREMAPS_COVERAGE_ZOOM
+    missing = get_missing_cells(bbox, zoom)
+    if not missing:
+        return []
+    return merge_tiles(missing, zoom)
+
+def mark_covered(bbox, zoom=None):
+    """Record the cells of the (cell aligned) bbox as ingested."""
+    zoom = zoom or conf.OVERTUREMAPS_COVERAGE_ZOOM
+    cells = []
+    for x, y in tiles_for_bbox(bbox, zoom):
+        geometry = Polygon.from_bbox(tile_bounds(x, y, zoom))
+        geometry.srid = 4326
+        cells.append(CoverageCellModel(zoom=zoom, x=x, y=y, geometry=geometry))
+    CoverageCellModel.objects.bulk_create(cells, ignore_conflicts=True)
+    return cells
+
+def _cells_filter(bbox, zoom):
+    tile_min_x, tile_min_y, tile_max_x, tile_max_y = tile_range(bbox, zoom)
+    return CoverageCellModel.objects.filter(
+        zoom=zoom,
+        x__range=(tile_min_x, tile_max_x),
+        y__range=(tile_min_y, tile_max_y),
+    )
+
+def get_cell_generations(bbox, zoom=None):
+    """Return the sorted (x, y, generation) of the covered cells of the bbox."""
+    zoom = zoom or conf.OVERTUREMAPS_COVERAGE_ZOOM
+    return list(_cells_filter(bbox, zoom).order_by("x", "y").values_list("x", "y", "generation"))
+
+def touch_cells(bbox, zoom=None):
+    """Increment the generation of the covered cells intersecting the bbox."""
+    zoom = zoom or conf.OVERTUREMAPS_COVERAGE_ZOOM
+    return _cells_filter(bbox, zoom).update(generation=F("generation") + 1)
+
+def count_cell_features(buildingmodel, bbox):
+    """
+    Recount the buildings of the covered cells intersecting the bbox. Each
+    building is counted in the cell of the lower-left corner of its extent
+    (its tile_x and tile_y), so a building crossing cells is counted once.
+    """
+    zoom = conf.OVERTUREMAPS_COVERAGE_ZOOM
+    tile_min_x, tile_min_y, tile_max_x, tile_max_y = tile_range(bbox, zoom)
+    cells = connection.ops.quote_name(CoverageCellModel._meta.db_table)
+    buildings = connection.ops.quote_name(buildingmodel._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {cells} c SET feature_count = "
+            f"(SELECT count(*) FROM {buildings} b WHERE b.tile_x = c.x AND b.tile_y = c.y) "
+            "WHERE c.zoom = %s AND c.x BETWEEN %s AND %s AND c.y BETWEEN %s AND %s",
+            [zoom, tile_min_x, tile_max_x, tile_min_y, tile_max_y],
+        )
+        return cursor.rowcount
+
+def inner_cells(bbox, zoom):
+    """
+    Return the (min_x, min_y, max_x, max_y) tile numbers of the cells
+    completely inside the bbox, None when there are none.
+    """
+    min_x, min_y, max_x, max_y = bbox
+    tile_min_x, tile_min_y, tile_max_x, tile_max_y = tile_range(bbox, zoom)
+    if tile_bounds(tile_min_x, tile_min_y, zoom)[0] < min_x - EPSILON:
+        tile_min_x += 1
+    if tile_bounds(tile_min_x, tile_min_y, zoom)[3] > max_y + EPSILON:
+        tile_min_y += 1
+    if tile_bounds(tile_max_x, tile_max_y, zoom)[2] > max_x + EPSILON:
+        tile_max_x -= 1
+    if tile_bounds(tile_max_x, tile_max_y, zoom)[1] < min_y - EPSILON:
+        tile_max_y -= 1
+    if tile_min_x > tile_max_x or tile_min_y > tile_max_y:
+        return None
+    return (tile_min_x, tile_min_y, tile_max_x, tile_max_y)
+
+def count_features(queryset, bbox):
+    """
+    Count the buildings of the queryset (filtered by the bbox only): the
+    buildings anchored in the covered cells completely inside the bbox are
+    summed from the cell counts, only the others are counted by the database.
+    """
+    zoom = conf.OVERTUREMAPS_COVERAGE_ZOOM
+    inner = inner_cells(bbox, zoom)
+    if inner is None:
+        return queryset.count()
+    tile_min_x, tile_min_y, tile_max_x, tile_max_y = inner
+    cells = CoverageCellModel.objects.filter(
+        zoom=zoom,
+        x__range=(tile_min_x, tile_max_x),
+        y__range=(tile_min_y, tile_max_y),
+    ).aggregate(cells=Count("id"), features=Sum("feature_count"))
+    if cells["cells"] < (tile_max_x - tile_min_x + 1) * (tile_max_y - tile_min_y + 1):
+        # not completely ingested
+        return queryset.count()
+    others = queryset.exclude(
+        tile_x__range=(tile_min_x, tile_max_x),
+        tile_y__range=(tile_min_y, tile_max_y),
+    ).count()
+    return cells["features"] + others
@@ -0,0 +1,48 @@
+from django.db import connection
+from gisserver.geometries import CRS
+from psycopg2.extras import execute_values
+
+from .. import conf
+from ..output import DBFeatureGeoJsonRenderer, DBFeatureGML32Renderer, db_feature_rendering_supported
+
+# The renderer of each fragment format
+FRAGMENT_RENDERERS = {
+    DBFeatureGeoJsonRenderer.fragment_format: DBFeatureGeoJsonRenderer,
+    DBFeatureGML32Renderer.fragment_format: DBFeatureGML32Renderer,
+}
+
+def store_fragments(feature_type, ids):
+    """
+    Pre-render the features of the ids in the fragment_fields of the model,
+    as the database feature renderers write them for the feature type.
+    Returns the number of rendered features, none with another django-gisserver
+    version than the renderers follow (render_fragments writes them later).
+    """
+    if not db_feature_rendering_supported():
+        return 0
+    model = feature_type.model
+    columns = list(model.fragment_fields.values())
+    queryset = model.objects.filter(pk__in=ids)
+    fragments = {}
+    for (fragment_format, srid), column in model.fragment_fields.items():
+        renderer_class = FRAGMENT_RENDERERS[fragment_format]
+        for pk, text in renderer_class.render_fragments(feature_type, queryset, CRS.from_srid(srid)):
+            fragments.setdefault(pk, {})[column] = text
+    if not fragments:
+        return 0
+
+    table = connection.ops.quote_name(model._meta.db_table)
+    updates = ", ".join(f"{column} = fragment.{column}" for column in columns)
+    sql = (
+        f"UPDATE {table} SET {updates} "
+        f"FROM (VALUES %s) AS fragment (id, {', '.join(columns)}) "
+        f"WHERE {table}.id = fragment.id"
+    )
+    rows = [(pk, *(texts.get(column) for column in columns)) for pk, texts in fragments.items()]
+    with connection.cursor() as cursor:
+        execute_values(
+            cursor.cursor, sql, rows,
+            template="(%s" + ", %s::text" * len(columns) + ")",
+            page_size=conf.OVERTUREMAPS_INGESTION_BATCH_SIZE,
+        )
+    return len(fragments)
@@ -0,0 +1,168 @@
+import numpy as np
+import pyarrow.compute as pc
+import shapely
+from psycopg2.extras import Json, execute_values
+
+from django.db import connection
+
+from .. import conf
+
+import logging
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+# Column order of the rows given to upsert_buildings()
+BUILDING_COLUMNS = [
+    "geo_id",
+    "version",
+    "update_time",
+    "has_parts",
+    "geometry",
+    "subtype",
+    "classtype",
+    "num_floors",
+    "height",
+    "roof_shape",
+    "roof_direction",
+    "roof_material",
+    "sources",
+]
+
+# The geometry is given as (valid, MultiPolygon) WKB
+BUILDING_TEMPLATE = (
+    "(%s, %s::integer, %s::timestamptz, %s::boolean, ST_GeomFromWKB(%s, 4326), %s, %s, "
+    "%s::integer, %s::double precision, %s, %s::double precision, %s, %s::jsonb)"
+)
+
+# Overture maps column, model column and value used for nulls/missing columns
+BUILDING_ATTRIBUTES = [
+    ("subtype", "subtype", ""),
+    ("class", "classtype", ""),
+    ("num_floors", "num_floors", 0),
+    ("height", "height", 0),
+    ("roof_shape", "roof_shape", ""),
+    ("roof_direction", "roof_direction", 0),
+    ("roof_material", "roof_material", ""),
+]
+
+def _column(batch, name, default=None):
+    """The values of a RecordBatch column, with nulls replaced by the default."""
+    index = batch.schema.get_field_index(name)
+    if index == -1:
+        return [default] * batch.num_rows
+    column = batch.column(index)
+    if default is not None and column.null_count:
+        column = pc.fill_null(column, default)
+    return column.to_pylist()
+
+def prepare_geometries(wkb):
+    """
+    Decode a whole WKB column at once and return it as MultiPolygon WKB.
+    Invalid geometries are repaired with make_valid, keeping their polygonal
+    parts. Geometries that can't be decoded or have no area left are None.
+    """
+    geometries = shapely.from_wkb(wkb, on_invalid="ignore")
+    invalid = ~shapely.is_valid(geometries) & ~shapely.is_missing(geometries)
+    if invalid.any():
+        logger.debug('Repairing %s invalid geometries', invalid.sum())
+        geometries[invalid] = shapely.make_valid(geometries[invalid])
+
+    # Flatten to polygons. The collections created by make_valid may contain
+    # multipolygons, lines or points, hence the second pass and type filter.
+    parts, index = shapely.get_parts(geometries, return_index=True)
+    parts, part_index = shapely.get_parts(parts, return_index=True)
+    index = index[part_index]
+    keep = (shapely.get_type_id(parts) == shapely.GeometryType.POLYGON) & ~shapely.is_empty(parts)
+
+    multipolygons = np.empty(len(geometries), dtype=object)
+    shapely.multipolygons(parts[keep], indices=index[keep], out=multipolygons)
+    return shapely.to_wkb(multipolygons)
+
+def batch_to_rows(batch):
+    """
+    Convert an Overture maps building RecordBatch to upsert_buildings() rows,
+    without building any intermediate feature objects.
+    Buildings without a usable geometry are left out.
+    """
+    ids = _column(batch, "id")
+    geometries = prepare_geometries(batch.column("geometry").to_numpy(zero_copy_only=False))
+    columns = [
+        ids,
+        _column(batch, "version"),
+        _column(batch, "update_time"),
+        _column(batch, "has_parts", False),
+        geometries,
+    ]
+    columns += [_column(batch, name, default) for name, _, default in BUILDING_ATTRIBUTES]
+    columns.append([Json(sources or []) for sources in _column(batch, "sources")])
+    rows = [row for row in zip(*columns) if row[4] is not None]
+    if len(rows) < batch.num_rows:
+        logger.warning('Skipped %s buildings without a valid geometry', batch.num_rows - len(rows))
+    return rows
+
+# The tile (x, y) of the lower-left corner of the geometry at {zoom}, as tiles.lonlat_to_tile
+# (migration 0014 keeps a frozen copy)
+TILE_X_SQL = "LEAST(GREATEST(floor((ST_XMin(geometry) + 180) / 360 * 2 ^ {zoom}), 0), 2 ^ {zoom} - 1)::integer"
+TILE_Y_SQL = (
+    "LEAST(GREATEST(floor((1 - asinh(tan(radians(GREATEST(LEAST(ST_YMin(geometry), 85.0511287798066), "
+    "-85.0511287798066)))) / pi()) / 2 * 2 ^ {zoom}), 0), 2 ^ {zoom} - 1)::integer"
+)
+
+def upsert_buildings(buildingmodel, rows):
+    """
+    Write the building rows with batched INSERT ... ON CONFLICT (geo_id)
+    statements. Existing buildings are only rewritten when their version
+    changed, their pre-rendered fragments are cleared then.
+    Returns the ids of the inserted/updated buildings and their extent
+    (None when nothing was written).
+    """
+    # ON CONFLICT can't affect the same row twice within a statement
+    rows = list({row[0]: row for row in rows}.values())
+    if not rows:
+        return [], None
+
+    table = connection.ops.quote_name(buildingmodel._meta.db_table)
+    columns = ", ".join(BUILDING_COLUMNS)
+    updates = ", ".join(
+        [f"{column} = EXCLUDED.{column}" for column in BUILDING_COLUMNS[1:]]
+        + [f"{column} = NULL" for column in getattr(buildingmodel, "fragment_fields", {}).values()]
+    )
+    sql = (
+        f"INSERT INTO {table} ({columns}) VALUES %s "
+        f"ON CONFLICT (geo_id) DO UPDATE SET {updates} "
+        f"WHERE {table}.version IS DISTINCT FROM EXCLUDED.version "
+        "RETURNING id, ST_XMin(geometry), ST_YMin(geometry), ST_XMax(geometry), ST_YMax(geometry)"
+    )
+    with connection.cursor() as cursor:
+        written = execute_values(
+            cursor.cursor, sql, rows,
+            template=BUILDING_TEMPLATE,
+            page_size=conf.OVERTUREMAPS_INGESTION_BATCH_SIZE,
+            fetch=True,
+        )
+        if written:
+            # the simplified levels of detail and the coverage cell of the new geometries
+            zoom = int(conf.OVERTUREMAPS_COVERAGE_ZOOM)
+            cursor.execute(
+                f"UPDATE {table} SET "
+                "geometry_lod1 = ST_Multi(ST_SimplifyPreserveTopology(geometry, %s)), "
+                "geometry_lod2 = ST_Multi(ST_SimplifyPreserveTopology(geometry, %s)), "
+                f"tile_x = {TILE_X_SQL.format(zoom=zoom)}, tile_y = {TILE_Y_SQL.format(zoom=zoom)} "
+                "WHERE id = ANY(%s)",
+                [
+                    conf.OVERTUREMAPS_LOD1_TOLERANCE, conf.OVERTUREMAPS_LOD2_TOLERANCE,
+                    [row[0] for row in written],
+                ],
+            )
+    if not written:
+        return [], None
+    extent = (
+        min(row[1] for row in written), min(row[2] for row in written),
+        max(row[3] for row in written), max(row[4] for row in written),
+    )
+    return [row[0] for row in written], extent
@@ -0,0 +1,85 @@
+from datetime import timedelta
+
+from django.contrib.gis.db import models
+from django.db import transaction
+from django.utils import timezone
+
+class IngestionJobModel(models.Model):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    min_x = models.FloatField()
+    min_y = models.FloatField()
+    max_x = models.FloatField()
+    max_y = models.FloatField()
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    feature_count = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+
+    def __str__(self):
+        return f"Job {self.pk} BBOX({self.min_x}, {self.min_y}, {self.max_x}, {self.max_y}) {self.status}"
+
+    @property
+    def bbox(self):
+        return (self.min_x, self.min_y, self.max_x, self.max_y)
+
+    @classmethod
+    def enqueue(cls, min_x, min_y, max_x, max_y):
+        """Queue the ingestion of a bbox, reusing a job that is already queued for it."""
+        job = cls.objects.filter(
+            status__in=[cls.PENDING, cls.RUNNING],
+            min_x=min_x, min_y=min_y, max_x=max_x, max_y=max_y
+        ).first()
+        if job is None:
+            job = cls.objects.create(min_x=min_x, min_y=min_y, max_x=max_x, max_y=max_y)
+        return job
+
+    @classmethod
+    def claim_next(cls):
+        """Take the oldest pending job, skipping the ones locked by other workers."""
+        with transaction.atomic():
+            job = (
+                cls.objects.select_for_update(skip_locked=True)
+                .filter(status=cls.PENDING)
+                .order_by("created")
+                .first()
+            )
+            if job is None:
+                return None
+            job.status = cls.RUNNING
+            job.started = timezone.now()
+            job.attempts += 1
+            job.save(update_fields=["status", "started", "attempts"])
+        return job
+
+    @classmethod
+    def requeue_stale(cls, seconds):
+        """Queue again the running jobs that were abandoned by a worker."""
+        limit = timezone.now() - timedelta(seconds=seconds)
+        return cls.objects.filter(status=cls.RUNNING, started__lt=limit).update(status=cls.PENDING)
+
+    def mark_done(self, feature_count):
+        self.status = self.DONE
+        self.finished = timezone.now()
+        self.feature_count = feature_count
+        self.error = ""
+        self.save(update_fields=["status", "finished", "feature_count", "error"])
+
+    def mark_failed(self, error, max_attempts):
+        # Keep the job in the queue until it used all its attempts
+        self.status = self.PENDING if self.attempts < max_attempts else self.FAILED
+        self.finished = timezone.now()
+        self.error = error
+        self.save(update_fields=["status", "finished", "error"])
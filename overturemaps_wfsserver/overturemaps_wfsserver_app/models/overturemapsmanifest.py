@@ -0,0 +1,145 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.fs
+import pyarrow.parquet as pq
+
+from django.contrib.gis.db import models
+from django.contrib.gis.geos import Polygon
+from django.db import IntegrityError, transaction
+from .. import conf
+
+import logging
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+# Columns of the row group statistics giving its extent
+EXTENT_COLUMNS = ("bbox.xmin", "bbox.ymin", "bbox.xmax", "bbox.ymax")
+
+class ReleaseManifestModel(models.Model):
+    """The parquet files of an Overture maps release, see ManifestRowGroupModel."""
+    release = models.CharField(max_length=100, unique=True)
+    path = models.CharField(max_length=255)
+    created = models.DateTimeField(auto_now_add=True)
+    schema = models.BinaryField()
+    file_count = models.IntegerField()
+    row_group_count = models.IntegerField()
+
+    def __str__(self):
+        return f"Release {self.release} ({self.file_count} files, {self.row_group_count} row groups)"
+
+    @property
+    def arrow_schema(self):
+        return pa.ipc.read_schema(pa.py_buffer(bytes(self.schema)))
+
+class ManifestRowGroupModel(models.Model):
+    """A row group of a release file, with the extent of its buildings."""
+    manifest = models.ForeignKey(ReleaseManifestModel, on_delete=models.CASCADE, related_name='row_groups')
+    path = models.CharField(max_length=255)
+    row_group = models.IntegerField()
+    num_rows = models.IntegerField()
+    geometry = models.PolygonField()
+
+    def __str__(self):
+        return f"{self.path} row group {self.row_group}"
+
+def get_filesystem():
+    return pyarrow.fs.S3FileSystem(anonymous=True, region="us-west-2")
+
+def release_path(release):
+    return f"overturemaps-us-west-2/release/{release}/theme=buildings/type=building/"
+
+def _row_group_extents(filesystem, path):
+    """Read the footer of a parquet file, returning its schema and row group extents."""
+    metadata = pq.read_metadata(path, filesystem=filesystem)
+    columns = {metadata.schema.column(i).path: i for i in range(metadata.num_columns)}
+    row_groups = []
+    for index in range(metadata.num_row_groups):
+        row_group = metadata.row_group(index)
+        stats = [row_group.column(columns[name]).statistics for name in EXTENT_COLUMNS]
+        if all(stat is not None and stat.has_min_max for stat in stats):
+            extent = (stats[0].min, stats[1].min, stats[2].max, stats[3].max)
+        else:
+            # Without statistics the row group has to be read for any bbox
+            extent = (-180.0, -90.0, 180.0, 90.0)
+        row_groups.append((index, row_group.num_rows, extent))
+    return metadata.schema.to_arrow_schema(), row_groups
+
+def build_manifest(release=None, workers=16):
+    """List the files and row groups of the release (only their footers are read)
+    and store them, replacing a previous manifest of the same release.
+    """
+    release = release or conf.OVERTUREMAPS_RELEASE
+    filesystem = get_filesystem()
+    path = release_path(release)
+    paths = sorted(
+        info.path for info in filesystem.get_file_info(pyarrow.fs.FileSelector(path, recursive=True))
+        if info.type == pyarrow.fs.FileType.File
+    )
+    if not paths:
+        raise ValueError(f"No files found for Overture maps release {release} ({path})")
+
+    logger.info('Building manifest of release %s (%s files)', release, len(paths))
+    with ThreadPoolExecutor(workers) as executor:
+        footers = list(executor.map(lambda p: _row_group_extents(filesystem, p), paths))
+
+    with transaction.atomic():
+        ReleaseManifestModel.objects.filter(release=release).delete()
+        manifest = ReleaseManifestModel.objects.create(
+            release=release,
+            path=path,
+            schema=footers[0][0].serialize().to_pybytes(),
+            file_count=len(paths),
+            row_group_count=sum(len(row_groups) for _, row_groups in footers),
+        )
+        instances = []
+        for file_path, (_, row_groups) in zip(paths, footers):
+            for index, num_rows, extent in row_groups:
+                geometry = Polygon.from_bbox(extent)
+                geometry.srid = 4326
+                instances.append(ManifestRowGroupModel(
+                    manifest=manifest, path=file_path, row_group=index, num_rows=num_rows, geometry=geometry
+                ))
+        ManifestRowGroupModel.objects.bulk_create(instances, batch_size=5000)
+    logger.info('Built %s', manifest)
+    return manifest
+
+def get_manifest(release=None):
+    """
+    Return the manifest of the release, None when it isn't built yet. It is
+    never built here: reading every footer of a release takes minutes, see
+    refresh_manifest and ensure_manifest.
+    """
+    release = release or conf.OVERTUREMAPS_RELEASE
+    return ReleaseManifestModel.objects.filter(release=release).first()
+
+def ensure_manifest(release=None):
+    """Return the manifest of the release, building it when it is missing."""
+    release = release or conf.OVERTUREMAPS_RELEASE
+    manifest = get_manifest(release)
+    if manifest is None:
+        try:
+            manifest = build_manifest(release)
+        except IntegrityError:
+            # built concurrently by another process
+            manifest = ReleaseManifestModel.objects.get(release=release)
+    return manifest
+
+def get_row_groups(manifest, bbox):
+    """Return {path: [row group, ...]} of the row groups intersecting the bbox."""
+    geometry = Polygon.from_bbox(bbox)
+    geometry.srid = 4326
+    files = {}
+    row_groups = (
+        manifest.row_groups.filter(geometry__intersects=geometry)
+        .order_by('path', 'row_group')
+        .values_list('path', 'row_group')
+    )
+    for path, row_group in row_groups:
+        files.setdefault(path, []).append(row_group)
+    return files
@@ -0,0 +1,243 @@
+import json
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs
+import shapely
+
+from django.db import connections
+from .. import conf
+from .overturemapsmanifest import get_filesystem, get_manifest, get_row_groups, release_path
+from ..tiles import EPSILON, split_bbox
+
+import logging
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the batches of a single tile in the queue
+_TILE_DONE = object()
+
+# Name of the file describing a mirrored region, ignored by pyarrow.dataset
+REGION_FILE = '_region.json'
+
+class MirrorMissError(Exception):
+    """The requested area is not part of the local mirror."""
+
+def fetch_buildings(bbox):
+    """Open a record batch reader on the Overture maps buildings of the bbox,
+    from the source configured by OVERTUREMAPS_SOURCE_BACKEND.
+    """
+    if conf.OVERTUREMAPS_SOURCE_BACKEND == "local":
+        return read_mirror(bbox)
+    return read_s3(bbox)
+
+def read_s3(bbox):
+    """
+    Read the buildings from the public Overture maps release on S3
+    (OVERTUREMAPS_RELEASE). The release manifest tells which row groups
+    intersect the bbox, so only those are opened. Until it is built, pyarrow
+    discovers the files of the release and skips the row groups by their
+    statistics, as overturemaps.record_batch_reader does.
+    """
+    filesystem = get_filesystem()
+    manifest = get_manifest()
+    if manifest is None:
+        logger.warning('No manifest of release %s, run refresh_manifest', conf.OVERTUREMAPS_RELEASE)
+        dataset = ds.dataset(release_path(conf.OVERTUREMAPS_RELEASE), filesystem=filesystem)
+        return pa.RecordBatchReader.from_batches(dataset.schema, dataset.to_batches(filter=bbox_filter(bbox)))
+
+    schema = manifest.arrow_schema
+    files = get_row_groups(manifest, bbox)
+    parquet_format = ds.ParquetFileFormat()
+    fragments = [
+        parquet_format.make_fragment(path, filesystem=filesystem, row_groups=row_groups)
+        for path, row_groups in files.items()
+    ]
+    dataset = ds.FileSystemDataset(fragments, schema=schema, format=parquet_format, filesystem=filesystem)
+    batches = dataset.to_batches(filter=bbox_filter(bbox))
+    return pa.RecordBatchReader.from_batches(schema, batches)
+
+def bbox_filter(bbox):
+    """The dataset filter selecting the rows whose bbox intersects the given one.
+    Row groups whose bbox statistics don't match are skipped without being read.
+    """
+    min_x, min_y, max_x, max_y = bbox
+    return (
+        (ds.field("bbox", "xmin") < max_x)
+        & (ds.field("bbox", "xmax") > min_x)
+        & (ds.field("bbox", "ymin") < max_y)
+        & (ds.field("bbox", "ymax") > min_y)
+    )
+
+def mirror_path(*parts):
+    return os.path.join(conf.OVERTUREMAPS_MIRROR_DIR, "building", *parts)
+
+_mirror = {}
+_mirror_lock = threading.Lock()
+
+def get_mirror():
+    """
+    Return the (dataset, region bboxes) of the local mirror. The file
+    discovery is done once and redone only when sync_mirror changed the
+    mirrored regions.
+    """
+    root = mirror_path()
+    try:
+        version = os.stat(root).st_mtime_ns
+    except FileNotFoundError:
+        raise MirrorMissError(f"No local Overture maps mirror in {root}, run sync_mirror first")
+
+    with _mirror_lock:
+        if _mirror.get("version") != version:
+            regions = {}
+            for name in os.listdir(root):
+                region_file = os.path.join(root, name, REGION_FILE)
+                if os.path.exists(region_file):
+                    with open(region_file) as f:
+                        regions[name] = tuple(json.load(f)["bbox"])
+            dataset = ds.dataset(
+                root, format="parquet",
+                filesystem=pyarrow.fs.LocalFileSystem(use_mmap=True),
+            )
+            _mirror.update(version=version, dataset=dataset, regions=regions)
+        return _mirror["dataset"], _mirror["regions"]
+
+def covered_by_regions(bbox, regions):
+    """Whether the bbox is inside the union of the region bboxes (e.g. across adjacent regions)."""
+    if not regions:
+        return False
+    union = shapely.union_all([shapely.box(*region) for region in regions])
+    # the regions are aligned to the coverage cells, tolerate the rounding of their shared edges
+    return shapely.covers(shapely.buffer(union, EPSILON, join_style="mitre"), shapely.box(*bbox))
+
+def read_mirror(bbox):
+    """
+    Read the buildings from the local GeoParquet mirror written by sync_mirror.
+    The bbox may span several regions, as long as they cover it together.
+    """
+    dataset, regions = get_mirror()
+    if not covered_by_regions(bbox, regions.values()):
+        # Reading would silently return nothing, and the area would be
+        # recorded as ingested
+        raise MirrorMissError(f"BBOX {bbox} is not covered by the mirrored regions ({', '.join(regions) or 'none'})")
+
+    batches = dataset.to_batches(filter=bbox_filter(bbox))
+    return pa.RecordBatchReader.from_batches(dataset.schema, batches)
+
+def owned_rows(batch, tile, bbox):
+    """
+    Drop the buildings of the tile (part of bbox) that belong to a neighbour
+    tile: each one only belongs to the tile containing the lower left corner
+    of its bbox, or to the tiles on the edge of the whole bbox.
+    """
+    min_x, min_y, _, _ = tile
+    bboxes = batch.column('bbox')
+    mask = None
+    if min_x > bbox[0]:
+        mask = pc.greater_equal(bboxes.field('xmin'), min_x)
+    if min_y > bbox[1]:
+        owned_y = pc.greater_equal(bboxes.field('ymin'), min_y)
+        mask = owned_y if mask is None else pc.and_(mask, owned_y)
+    return batch if mask is None else batch.filter(mask)
+
+class ParallelRecordBatchReader:
+    """
+    Read a bbox from Overture maps as a set of tiles fetched concurrently by
+    a thread pool. The batches are handed over through a bounded queue, so
+    the workers never get far ahead of the ingestion reading them.
+
+    Overture maps returns every building whose bbox intersects the requested
+    one, so buildings on a tile edge are returned by several tiles. Each one
+    is only kept by a single tile (see owned_rows), which deduplicates them
+    on id without tracking the ids already seen.
+    """
+    def __init__(self, bbox, workers=None, zoom=None, fetch=fetch_buildings):
+        self.bbox = bbox
+        self.tiles = split_bbox(bbox, conf.OVERTUREMAPS_FETCH_ZOOM if zoom is None else zoom)
+        self.workers = min(workers or conf.OVERTUREMAPS_FETCH_WORKERS, len(self.tiles))
+        self.fetch = fetch
+
+        self._queue = queue.Queue(maxsize=self.workers * 2)
+        self._stopped = threading.Event()
+        self._pending = len(self.tiles)
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='overturemaps-fetch')
+        for tile in self.tiles:
+            self._executor.submit(self._read_tile, tile)
+        logger.debug('Fetching %s in %s tiles with %s workers', bbox, len(self.tiles), self.workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, value, traceback):
+        self.close()
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.read_next_batch()
+            except StopIteration:
+                return
+
+    def read_next_batch(self):
+        while self._pending:
+            item = self._queue.get()
+            if item is _TILE_DONE:
+                self._pending -= 1
+            elif isinstance(item, Exception):
+                self.close()
+                raise item
+            else:
+                return item
+        raise StopIteration
+
+    def close(self):
+        """Stop the workers, e.g. when the ingestion failed halfway."""
+        self._stopped.set()
+        # unblock the workers waiting for room in the queue
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self._executor.shutdown(wait=False)
+
+    def _put(self, item):
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _read_tile(self, tile):
+        if self._stopped.is_set():
+            return
+        try:
+            reader = self.fetch(tile)
+            while True:
+                try:
+                    batch = reader.read_next_batch()
+                except StopIteration:
+                    break
+                batch = owned_rows(batch, tile, self.bbox)
+                if batch.num_rows and not self._put(batch):
+                    return
+        except Exception as e:
+            logger.exception('Fetching tile %s failed', tile)
+            self._put(e)
+            return
+        finally:
+            # the manifest lookup opens a database connection in this thread
+            connections.close_all()
+        self._put(_TILE_DONE)
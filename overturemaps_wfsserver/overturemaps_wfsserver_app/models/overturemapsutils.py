@@ -1,6 +1,6 @@
 import os
 import json
-import shapely.wkb
+import shapely
 
 from django.contrib.gis.db import models
 from django.contrib.gis.geos import MultiPolygon, Polygon, LinearRing, GEOSGeometry
@@ -30,15 +30,41 @@ def copy(reader, writer):
         if batch.num_rows > 0:
             writer.write_batch(batch)
 
-def is_bbox_contained(bboxmodel, new_min_x, new_min_y, new_max_x, new_max_y):
-    bbox_requests = bboxmodel.objects.all()
-    for bbox in bbox_requests:
-        if (bbox.min_x <= new_min_x <= bbox.max_x and
-            bbox.min_y <= new_min_y <= bbox.max_y and
-            bbox.min_x <= new_max_x <= bbox.max_x and
-            bbox.min_y <= new_max_y <= bbox.max_y):
-            return True
-    return False
+def iter_chunks(reader, memory_budget):
+    """
+    Read the batches of the reader one at a time and group them in chunks
+    (lists of batches) of at most memory_budget bytes of arrow data.
+    Batches larger than the budget are sliced, so only a single chunk needs
+    to be held in memory whatever the size of the requested area.
+    """
+    chunk = []
+    chunk_size = 0
+    while True:
+        try:
+            batch = reader.read_next_batch()
+        except StopIteration:
+            break
+        if batch.num_rows == 0:
+            continue
+
+        if batch.nbytes > memory_budget:
+            rows_per_slice = max(1, batch.num_rows * memory_budget // batch.nbytes)
+            slices = [batch.slice(offset, rows_per_slice) for offset in range(0, batch.num_rows, rows_per_slice)]
+        else:
+            slices = [batch]
+
+        for part in slices:
+            part_size = part.nbytes
+            if chunk and chunk_size + part_size > memory_budget:
+                yield chunk
+                chunk = []
+                chunk_size = 0
+            chunk.append(part)
+            chunk_size += part_size
+        del batch, slices
+
+    if chunk:
+        yield chunk
 
 class BaseGeoJSONWriter:
     """
@@ -73,8 +99,10 @@ class BaseGeoJSONWriter:
         if batch.num_rows == 0:
             return
 
-        for row in batch.to_pylist():
-            feature = self.row_to_feature(row)
+        # decode all geometries of the batch at once
+        geometries = shapely.from_wkb(batch.column("geometry").to_numpy(zero_copy_only=False))
+        for row, geometry in zip(batch.to_pylist(), geometries):
+            feature = self.row_to_feature(row, geometry)
             self.write_feature(feature)
 
     def write_feature(self, feature):
@@ -83,8 +111,8 @@ class BaseGeoJSONWriter:
     def finalize(self):
         pass
 
-    def row_to_feature(self, row):
-        geometry = shapely.wkb.loads(row.pop("geometry"))
+    def row_to_feature(self, row, geometry):
+        row.pop("geometry")
         row.pop("bbox")
         # This only removes null values in the top-level dictionary but will leave in
         # nulls in sub-properties
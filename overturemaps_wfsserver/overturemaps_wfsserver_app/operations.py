@@ -0,0 +1,221 @@
+import base64
+import hashlib
+import json
+import math
+from functools import cached_property
+from urllib.parse import urlencode
+
+from gisserver import output, queries
+from gisserver.exceptions import InvalidParameterValue
+from gisserver.operations import wfs20
+from gisserver.operations.base import OutputFormat
+
+from . import conf, planner
+from .cache import normalize_parameters
+from .models import count_features
+from .output import (
+    ArrowStreamRenderer, DBFeatureGeoJsonRenderer, DBFeatureGML32Renderer, FlatGeobufRenderer, GeoParquetRenderer,
+    select_feature_renderer,
+)
+
+# The GML and GeoJSON renderers, with the database written features as option
+FEATURE_RENDERERS = {
+    output.gml32_renderer: select_feature_renderer(output.gml32_renderer, DBFeatureGML32Renderer),
+    output.geojson_renderer: select_feature_renderer(output.geojson_renderer, DBFeatureGeoJsonRenderer),
+}
+
+def _with_feature_renderer(output_format):
+    if output_format.renderer_class not in FEATURE_RENDERERS:
+        return output_format
+    return OutputFormat(
+        output_format.content_type,
+        renderer_class=FEATURE_RENDERERS[output_format.renderer_class],
+        max_page_size=output_format._max_page_size,
+        title=output_format.title,
+        **output_format.extra,
+    )
+
+# Values of the HITS request parameter
+HITS_EXACT = "exact"
+HITS_ESTIMATED = "estimated"
+
+class CountedFeatureCollection(wfs20.StreamingFeatureCollection):
+    """A result page whose numberMatched is counted by the operation (see GetFeature.count_matched)."""
+    count_matched = None
+
+    @cached_property
+    def number_matched(self) -> int:
+        if self.count_matched is None or self._is_surely_last_page:
+            return super().number_matched
+        return self.count_matched(self.queryset)
+
+class KeysetFeatureCollection(CountedFeatureCollection):
+    """
+    A result page in primary key order, read after the last primary key of
+    the previous page (WHERE id > ...) instead of skipping the earlier pages
+    with an OFFSET, so every page costs the same as the first one.
+    """
+
+    def __init__(self, feature_type, queryset, start, stop, after=None):
+        queryset = queryset.order_by("pk")
+        # All the matches, whatever the page
+        self.matched_queryset = queryset
+        # The index of the first feature of the page
+        self.offset = start
+        if after is not None:
+            queryset = queryset.filter(pk__gt=after)
+            start, stop = 0, stop - start
+        super().__init__(feature_type, queryset, start, stop)
+
+    def get_next_after(self):
+        """The primary key of the last feature of the page, None when it is the last page."""
+        pks = list(self.queryset.values_list("pk", flat=True)[self.stop - 1 : self.stop + 1])
+        return pks[0] if len(pks) == 2 else None
+
+    @cached_property
+    def number_matched(self) -> int:
+        if self._is_surely_last_page:
+            return self.offset + self.number_returned
+        if self.count_matched is not None:
+            return self.count_matched(self.matched_queryset)
+        return self.matched_queryset.count()
+
+def get_query_key(params):
+    """A digest of what the request selects, whatever the page."""
+    normalized = normalize_parameters(params)
+    for key in ("COUNT", "STARTINDEX"):
+        normalized.pop(key, None)
+    return hashlib.sha1(json.dumps(normalized, sort_keys=True).encode()).hexdigest()[:16]
+
+def encode_cursor(after, query_key):
+    """The opaque CURSOR of the page after the primary key, for the request of the query key."""
+    data = json.dumps([after, query_key], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+def decode_cursor(cursor, query_key):
+    """Return the primary key of a CURSOR made by encode_cursor for the request of the query key."""
+    try:
+        after, cursor_key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise InvalidParameterValue("cursor", "Invalid CURSOR value") from None
+    if not isinstance(after, int) or cursor_key != query_key:
+        raise InvalidParameterValue("cursor", "The CURSOR belongs to another request")
+    return after
+
+class GetFeature(wfs20.GetFeature):
+    """
+    GetFeature with binary output formats next to the GML, GeoJSON and CSV
+    ones. The numberMatched of plain BBOX requests (resultType=hits, and the
+    next links of paged results) is summed from the per cell counts kept at
+    ingest instead of a COUNT of all the buildings of the bbox.
+
+    Pages of a single feature type without sortBy are read in primary key
+    order, and their next links carry a CURSOR (the last primary key of the
+    page) so the next page seeks instead of using an OFFSET.
+
+    With OVERTUREMAPS_DB_FEATURE_RENDERING, the GML and GeoJSON features are
+    written by the database (see DBFeatureRenderingMixin), with
+    OVERTUREMAPS_FEATURE_FRAGMENTS they are copied from the text stored at
+    ingest.
+    """
+
+    output_formats = [_with_feature_renderer(output_format) for output_format in wfs20.GetFeature.output_formats] + [
+        OutputFormat(
+            "application/flatgeobuf",
+            subtype="flatgeobuf",
+            renderer_class=FlatGeobufRenderer,
+            title="FlatGeobuf",
+        ),
+        OutputFormat(
+            "application/vnd.apache.parquet",
+            subtype="geoparquet",
+            renderer_class=GeoParquetRenderer,
+            title="GeoParquet",
+        ),
+        OutputFormat(
+            "application/vnd.apache.arrow.stream",
+            subtype="arrow",
+            renderer_class=ArrowStreamRenderer,
+            title="Arrow IPC stream",
+        ),
+    ]
+
+    def count_matched(self, queryset):
+        """numberMatched of the queryset of a plain BBOX request (see the view count_bbox)."""
+        if self.view.hits_mode == HITS_ESTIMATED:
+            return planner.estimate_features(self.view.count_bbox)
+        return count_features(wfs20.without_output_annotations(queryset), self.view.count_bbox)
+
+    def get_hits(self, query):
+        if self.view.count_bbox is None:
+            return super().get_hits(query)
+        querysets = query.get_querysets()
+        return output.FeatureCollection(
+            results=[
+                output.SimpleFeatureCollection(feature_type=ft, queryset=qs.none(), start=0, stop=0)
+                for ft, qs in querysets
+            ],
+            number_matched=sum(self.count_matched(qs) for ft, qs in querysets),
+        )
+
+    def get_results(self, query, start, count):
+        collection = super().get_results(query, start, count)
+        if self.view.count_bbox is not None:
+            collection.results = [
+                CountedFeatureCollection.from_collection(sub_collection) for sub_collection in collection.results
+            ]
+            for sub_collection in collection.results:
+                sub_collection.count_matched = self.count_matched
+        return collection
+
+    def supports_cursor(self, query, **params):
+        return isinstance(query, queries.AdhocQuery) and len(query.typeNames) == 1 and not params["sortBy"]
+
+    def get_paginated_results(self, query, outputFormat, **params):
+        cursor = self.view.KVP.get("CURSOR")
+        max_page_size = outputFormat.max_page_size or self.view.max_page_size
+        page_size = min(max_page_size, params["count"] or max_page_size)
+        if not conf.OVERTUREMAPS_CURSOR_PAGING or page_size == math.inf or not self.supports_cursor(query, **params):
+            if cursor:
+                raise InvalidParameterValue(
+                    "cursor", "CURSOR needs a paged request of a single typeName without sortBy"
+                )
+            return super().get_paginated_results(query, outputFormat, **params)
+
+        start = max(0, params["startIndex"])
+        stop = start + page_size
+        query_key = get_query_key(self.view.KVP)
+        after = decode_cursor(cursor, query_key) if cursor else None
+
+        collection = query.get_results(start, count=page_size)
+        collection.results = [
+            KeysetFeatureCollection(sub_collection.feature_type, sub_collection.queryset, start, stop, after)
+            for sub_collection in collection.results
+        ]
+        if self.view.count_bbox is not None:
+            for sub_collection in collection.results:
+                sub_collection.count_matched = self.count_matched
+        next_after = collection.results[0].get_next_after()
+
+        if outputFormat.renderer_class is not None:
+            output_crs = params["srsName"]
+            if not output_crs and collection.results:
+                output_crs = collection.results[0].feature_type.crs
+            outputFormat.renderer_class.decorate_collection(collection, output_crs, **params)
+
+        if start > 0:
+            collection.previous = self._page_url(max(0, start - page_size), page_size)
+        if next_after is not None:
+            collection.next = self._page_url(stop, page_size, encode_cursor(next_after, query_key))
+        return collection
+
+    def _page_url(self, start, count, cursor=None):
+        """The URL of another page, the STARTINDEX is kept to number the features."""
+        params = {
+            name: value for name, value in self.view.request.GET.items()
+            if name.upper() not in ("STARTINDEX", "COUNT", "MAXFEATURES", "CURSOR")
+        }
+        params.update(STARTINDEX=start, COUNT=count)
+        if cursor is not None:
+            params["CURSOR"] = cursor
+        return f"{self.view.server_url}?{urlencode(params)}"
@@ -0,0 +1,719 @@
+import io
+import json
+import logging
+import math
+from datetime import date, datetime, time, timezone
+from decimal import Decimal
+
+import geopandas
+import gisserver
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyproj
+import shapely
+from django.contrib.gis.db.models.functions import AsGeoJSON, AsWKB
+from django.db import models
+from django.db.models import Case, F, Func, Q, TextField, Value, When
+from django.db.models.functions import Cast, Coalesce, Replace
+from django.utils.functional import Promise, classproperty
+from gisserver import conf as gisserver_conf
+from gisserver.db import AsGML, build_db_annotations, get_db_annotation, get_db_geometry_selects, get_db_geometry_target
+from gisserver.exceptions import InvalidParameterValue
+from gisserver.output import OutputRenderer
+from gisserver.output.geojson import DBGeoJsonRenderer
+from gisserver.output.gml32 import DBGML32Renderer
+from gisserver.types import GmlBoundedByElement
+
+from . import conf
+
+logger = logging.getLogger(__name__)
+
+# Arrow types of the model fields, other fields are written as strings
+ARROW_TYPES = {
+    "AutoField": pa.int64(),
+    "BigAutoField": pa.int64(),
+    "SmallIntegerField": pa.int16(),
+    "IntegerField": pa.int32(),
+    "BigIntegerField": pa.int64(),
+    "FloatField": pa.float64(),
+    "BooleanField": pa.bool_(),
+    "DateTimeField": pa.timestamp("us", tz="UTC"),
+    "DateField": pa.date32(),
+}
+
+# GeoParquet names of the geometry types of the model fields
+GEOMETRY_TYPES = {
+    "POINT": "Point",
+    "LINESTRING": "LineString",
+    "POLYGON": "Polygon",
+    "MULTIPOINT": "MultiPoint",
+    "MULTILINESTRING": "MultiLineString",
+    "MULTIPOLYGON": "MultiPolygon",
+}
+
+WKB_ANNOTATION = "_as_wkb_{name}"
+
+class StreamSink(io.RawIOBase):
+    """A write-only file that keeps what is written until it is drained."""
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def _to_json(value):
+    return json.dumps(value) if value is not None else None
+
+def _to_string(value):
+    return str(value) if value is not None else None
+
+def _to_utc(value):
+    return value.astimezone(timezone.utc) if isinstance(value, datetime) else value
+
+class ArrowRenderer(OutputRenderer):
+    """
+    Base of the binary output formats. The features are converted to Arrow
+    record batches straight from the model values, the geometries are WKB
+    made by the database (transformed to the output CRS), so nothing is
+    converted to GeoJSON or GEOS objects in between.
+    """
+    max_page_size = math.inf
+    batch_size = 10000
+
+    @classmethod
+    def decorate_collection(cls, collection, output_crs, **params):
+        if len(collection.results) > 1:
+            raise InvalidParameterValue(
+                "typeNames", "Binary output formats support a single feature type per request"
+            )
+        super().decorate_collection(collection, output_crs, **params)
+
+    @classmethod
+    def decorate_queryset(cls, feature_type, queryset, output_crs, **params):
+        queryset = super().decorate_queryset(feature_type, queryset, output_crs, **params)
+        geo_selects = get_db_geometry_selects(feature_type.xsd_type.geometry_elements, output_crs)
+        if geo_selects:
+            queryset = queryset.defer(*geo_selects.keys()).annotate(
+                **build_db_annotations(geo_selects, WKB_ANNOTATION, AsWKB)
+            )
+        return queryset
+
+    def get_columns(self, feature_type):
+        """Return the (element, arrow field, value converter) of each column."""
+        columns = []
+        for element in feature_type.xsd_type.elements:
+            if element.is_many or element.type.is_complex_type:
+                continue
+            if element.is_geometry:
+                columns.append((element, self.get_geometry_field(element), None))
+                continue
+            field = element.source
+            internal_type = field.get_internal_type() if isinstance(field, models.Field) else None
+            if internal_type == "JSONField":
+                arrow_type, convert = pa.string(), _to_json
+            elif internal_type == "DateTimeField":
+                arrow_type, convert = ARROW_TYPES[internal_type], _to_utc
+            elif internal_type in ARROW_TYPES:
+                arrow_type, convert = ARROW_TYPES[internal_type], None
+            else:
+                arrow_type, convert = pa.string(), _to_string
+            columns.append((element, pa.field(element.name, arrow_type), convert))
+        return columns
+
+    def get_geometry_field(self, element):
+        return pa.field(element.name, pa.binary())
+
+    def get_schema(self, feature_type, columns):
+        return pa.schema([arrow_field for _, arrow_field, _ in columns])
+
+    def iter_batches(self, sub_collection, columns, schema):
+        """Read the page as record batches of batch_size rows."""
+        values = [[] for _ in columns]
+        count = 0
+        for instance in sub_collection.iterator():
+            for column_values, (element, _, convert) in zip(values, columns):
+                if element.is_geometry:
+                    value = get_db_annotation(instance, element.name, WKB_ANNOTATION)
+                    column_values.append(bytes(value) if value is not None else None)
+                else:
+                    value = element.get_value(instance)
+                    column_values.append(convert(value) if convert is not None else value)
+            count += 1
+            if count == self.batch_size:
+                yield self._to_batch(values, schema)
+                values = [[] for _ in columns]
+                count = 0
+        if count:
+            yield self._to_batch(values, schema)
+
+    def _to_batch(self, values, schema):
+        arrays = [pa.array(column_values, type=field.type) for column_values, field in zip(values, schema)]
+        return pa.record_batch(arrays, schema=schema)
+
+    def get_crs_projjson(self):
+        """The output CRS as PROJJSON, None for lon/lat (the default of GeoParquet/GeoArrow)."""
+        if self.output_crs.srid == 4326:
+            return None
+        return pyproj.CRS.from_epsg(self.output_crs.srid).to_json_dict()
+
+    def render_exception(self, exception: Exception):
+        # Nothing can be appended to a binary stream, the client sees it truncated.
+        return b""
+
+class ArrowStreamRenderer(ArrowRenderer):
+    """Arrow IPC stream, with the geometries as GeoArrow WKB."""
+    content_type = "application/vnd.apache.arrow.stream"
+    content_disposition = 'attachment; filename="{typenames} {page} {date}.arrows"'
+
+    def get_geometry_field(self, element):
+        crs = self.get_crs_projjson()
+        extension = {"crs": crs} if crs is not None else {}
+        return pa.field(element.name, pa.binary(), metadata={
+            "ARROW:extension:name": "geoarrow.wkb",
+            "ARROW:extension:metadata": json.dumps(extension),
+        })
+
+    def render_stream(self):
+        sub_collection = self.collection.results[0]
+        columns = self.get_columns(sub_collection.feature_type)
+        schema = self.get_schema(sub_collection.feature_type, columns)
+        sink = StreamSink()
+        with pa.ipc.new_stream(sink, schema) as writer:
+            for batch in self.iter_batches(sub_collection, columns, schema):
+                writer.write_batch(batch)
+                yield sink.drain()
+        yield sink.drain()
+
+class GeoParquetRenderer(ArrowRenderer):
+    """GeoParquet 1.0, every record batch is written as a row group when it is read."""
+    content_type = "application/vnd.apache.parquet"
+    content_disposition = 'attachment; filename="{typenames} {page} {date}.parquet"'
+
+    def get_schema(self, feature_type, columns):
+        schema = super().get_schema(feature_type, columns)
+        geometry_columns = {}
+        for element, _, _ in columns:
+            if element.is_geometry:
+                geometry_type = GEOMETRY_TYPES.get(element.source.geom_type)
+                geometry_columns[element.name] = {
+                    "encoding": "WKB",
+                    "geometry_types": [geometry_type] if geometry_type else [],
+                }
+                crs = self.get_crs_projjson()
+                if crs is not None:
+                    geometry_columns[element.name]["crs"] = crs
+        if not geometry_columns:
+            return schema
+        primary = feature_type.geometry_field.name
+        if primary not in geometry_columns:
+            primary = next(iter(geometry_columns))
+        geo = {"version": "1.0.0", "primary_column": primary, "columns": geometry_columns}
+        return schema.with_metadata({b"geo": json.dumps(geo).encode()})
+
+    def render_stream(self):
+        sub_collection = self.collection.results[0]
+        columns = self.get_columns(sub_collection.feature_type)
+        schema = self.get_schema(sub_collection.feature_type, columns)
+        sink = StreamSink()
+        with pq.ParquetWriter(sink, schema, compression="zstd") as writer:
+            for batch in self.iter_batches(sub_collection, columns, schema):
+                writer.write_batch(batch)
+                yield sink.drain()
+        # the footer
+        yield sink.drain()
+
+class FlatGeobufRenderer(ArrowRenderer):
+    """
+    FlatGeobuf with a spatial index, written by GDAL. The index comes
+    before the features, so the page is built completely before it is sent
+    (and its size is limited); clients can still read it as a stream.
+    """
+    content_type = "application/flatgeobuf"
+    content_disposition = 'attachment; filename="{typenames} {page} {date}.fgb"'
+
+    @classproperty
+    def max_page_size(cls):
+        return conf.OVERTUREMAPS_FLATGEOBUF_MAX_PAGE_SIZE
+
+    def render_stream(self):
+        sub_collection = self.collection.results[0]
+        feature_type = sub_collection.feature_type
+        columns = self.get_columns(feature_type)
+        schema = self.get_schema(feature_type, columns)
+        table = pa.Table.from_batches(list(self.iter_batches(sub_collection, columns, schema)), schema=schema)
+
+        geometry_name = feature_type.geometry_field.name
+        geometries = shapely.from_wkb(table.column(geometry_name).to_numpy(zero_copy_only=False))
+        frame = geopandas.GeoDataFrame(
+            table.drop_columns([geometry_name]).to_pandas(),
+            geometry=geopandas.GeoSeries(geometries, crs=f"EPSG:{self.output_crs.srid}"),
+        )
+        output = io.BytesIO()
+        frame.to_file(output, driver="FlatGeobuf", engine="pyogrio", layer=feature_type.name, SPATIAL_INDEX="YES")
+        return output.getvalue()
+
+# The django-gisserver version whose output the database feature renderers
+# write byte for byte: the helpers below are copied from it, and the SQL
+# expressions reproduce them. Other versions use the gisserver renderers.
+GISSERVER_VERSION = "1.4.0"
+
+def db_feature_rendering_supported():
+    """Whether the installed django-gisserver is the one the database feature renderers follow."""
+    return gisserver.__version__ == GISSERVER_VERSION
+
+if not db_feature_rendering_supported():
+    logger.warning(
+        "django-gisserver %s is installed, the database feature renderers follow %s and are disabled",
+        gisserver.__version__, GISSERVER_VERSION,
+    )
+
+# Copied from gisserver.output.geojson and gisserver.output.gml32 (private in
+# GISSERVER_VERSION), which the SQL expressions below have to match.
+AUTO_STR = (int, float, Decimal, date, time)
+
+def _json_default(obj):
+    """Serialize non-built in values to JSON"""
+    if isinstance(obj, (Decimal, Promise)):
+        return str(obj)
+    raise TypeError(f"Unable to serialize {obj.__class__.__name__} to JSON")
+
+def _tag_escape(s: str):
+    return s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+def _value_to_xml_string(value):
+    # Simple scalar value
+    if isinstance(value, str):  # most cases
+        return _tag_escape(value)
+    elif isinstance(value, datetime):
+        return value.astimezone(timezone.utc).isoformat()
+    elif isinstance(value, bool):
+        return "true" if value else "false"
+    elif isinstance(value, AUTO_STR):
+        return value  # no need for _tag_escape(), and f"{value}" works faster.
+    else:
+        return _tag_escape(str(value))
+
+# Internal types of the model fields the database writes like the Python renderers do
+DB_TEXT_TYPES = {"CharField", "TextField", "SlugField"}
+DB_INTEGER_TYPES = {
+    "AutoField", "BigAutoField", "SmallAutoField", "SmallIntegerField", "IntegerField", "BigIntegerField",
+    "PositiveSmallIntegerField", "PositiveIntegerField", "PositiveBigIntegerField",
+}
+
+class TextConcat(Func):
+    """CONCAT() of any number of text expressions (NULL ones are left out)."""
+    function = "CONCAT"
+    output_field = TextField()
+
+class JSONText(Func):
+    """The value as JSON text, NULL for NULL."""
+    template = "to_json(%(expressions)s)::text"
+    output_field = TextField()
+
+class FloatText(Func):
+    """The float text of PostgreSQL, integral values get a ".0" like str(float) writes them."""
+    template = "regexp_replace((%(expressions)s)::text, '^(-?[0-9]+)$', '\\1.0')"
+    output_field = TextField()
+
+class DecimalFloatText(Func):
+    """The float in plain decimal notation (PostgreSQL writes e.g. 1e15 as "1e+15")."""
+    template = "regexp_replace((%(expressions)s)::text::numeric::text, '^(-?[0-9]+)$', '\\1.0')"
+    output_field = TextField()
+
+class JSONExponentText(Func):
+    """The float in exponent notation as orjson writes it: "1e-6" and "1e16" instead of "1e-06" and "1e+16"."""
+    template = "regexp_replace((%(expressions)s)::text, 'e\\+?(-?)0*', 'e\\1')"
+    output_field = TextField()
+
+def _float_text(path, json=False):
+    """
+    The float column as str(float) writes it, or orjson with json. Both use
+    the shortest digits (like PostgreSQL 12+), in plain decimal notation from
+    1e-4 (1e-5 for orjson) up to 1e16, in exponent notation otherwise.
+    """
+    min_decimal = 1e-5 if json else 1e-4
+    decimal = (
+        Q(**{f"{path}__gte": min_decimal, f"{path}__lt": 1e16})
+        | Q(**{f"{path}__lte": -min_decimal, f"{path}__gt": -1e16})
+    )
+    return Case(
+        When(**{path: math.nan}, then=Value("null" if json else "nan")),
+        When(**{path: math.inf}, then=Value("null" if json else "inf")),
+        When(**{path: -math.inf}, then=Value("null" if json else "-inf")),
+        # keeps the sign of -0.0
+        When(**{path: 0}, then=FloatText(F(path))),
+        When(decimal, then=DecimalFloatText(F(path))),
+        default=JSONExponentText(F(path)) if json else Cast(path, TextField()),
+        output_field=TextField(),
+    )
+
+class ISODateTime(Func):
+    """The datetime column as datetime.isoformat() writes it in UTC, microseconds only when set."""
+    template = (
+        "regexp_replace(to_char(%(expressions)s AT TIME ZONE 'UTC', 'YYYY-MM-DD\"T\"HH24:MI:SS.US'), "
+        "'\\.000000$', '') || '+00:00'"
+    )
+    output_field = TextField()
+
+def _gml_with_id(gml, gml_id):
+    """Add the gml:id attribute to the first tag of the GML, like DBGMLRenderingMixin does."""
+    return Func(
+        gml,
+        Value("^([^>]*)>"),
+        TextConcat(Value('\\1 gml:id="'), gml_id, Value('">')),
+        function="regexp_replace",
+        output_field=TextField(),
+    )
+
+def _unless_null(condition, expression, null):
+    """The expression, or the null text when the path is NULL (or the Q condition holds)."""
+    if isinstance(condition, str):
+        condition = Q(**{f"{condition}__isnull": True})
+    return Case(When(condition, then=Value(null)), default=expression, output_field=TextField())
+
+def _xml_escape(expression):
+    """The text expression escaped like _tag_escape()."""
+    for char, entity in (("&", "&amp;"), ("<", "&lt;"), (">", "&gt;")):
+        expression = Replace(expression, Value(char), Value(entity))
+    return expression
+
+def _get_field_type(element):
+    """The internal type of the model field of a scalar element, None when it isn't a plain column."""
+    if element.is_many or element.type.is_complex_type or not isinstance(element.source, models.Field):
+        return None
+    if "__" in element.orm_path:
+        return None
+    return element.source.get_internal_type()
+
+def _geojson_value(value):
+    """The value as GeoJsonRenderer._format_geojson_value() passes it to orjson."""
+    if isinstance(value, datetime):
+        return value.astimezone(timezone.utc)
+    if isinstance(value, models.Model):
+        return str(value)
+    return value
+
+def _xml_field(element, value):
+    """A scalar element as GML32Renderer.write_xml_field() writes it."""
+    if value is None:
+        return f'<{element.xml_name} xsi:nil="true"/>\n'
+    return f"<{element.xml_name}>{_value_to_xml_string(value)}</{element.xml_name}>\n"
+
+def _merge_parts(parts):
+    """
+    Join consecutive SQL parts (texts and expressions) of a feature in a single
+    annotation. Returns the (annotation name, expression) of the SQL parts and
+    the elements written by Python in between, in their order.
+    """
+    merged = []
+    pending = []
+    for part in parts:
+        if isinstance(part, (str, models.Expression)):
+            pending.append(Value(part) if isinstance(part, str) else part)
+            continue
+        if pending:
+            merged.append((f"_as_feature_{len(merged)}", TextConcat(*pending)))
+            pending = []
+        merged.append(part)
+    if pending:
+        merged.append((f"_as_feature_{len(merged)}", TextConcat(*pending)))
+    return merged
+
+class DBFeatureRenderingMixin:
+    """
+    Let the database write each feature as text: the output of every row is
+    concatenated by PostgreSQL, Python only streams it. Values the database
+    can't write exactly like the Python renderers (e.g. JSON fields) are still
+    written by Python, in between. Feature types with related or computed
+    elements are rendered by the parent renderer. The renderers define the
+    parts of a feature (get_feature_parts) and how they are joined
+    (render_parts).
+
+    With OVERTUREMAPS_FEATURE_FRAGMENTS, the features pre-rendered at ingest
+    (see the fragment_fields of the model) are read as they are, only the
+    features without a fragment are written again.
+    """
+    # The format of the fragments, in the fragment_fields of the model
+    fragment_format = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.feature_parts = {}
+
+    @classmethod
+    def get_fragment_field(cls, feature_type, output_crs):
+        """The model field of the features pre-rendered for the output CRS, None when there is none."""
+        if not conf.OVERTUREMAPS_FEATURE_FRAGMENTS:
+            return None
+        fragment_fields = getattr(feature_type.model, "fragment_fields", {})
+        return fragment_fields.get((cls.fragment_format, output_crs.srid))
+
+    @classmethod
+    def decorate_feature_queryset(cls, feature_type, queryset, output_crs, fragment_field=None):
+        """
+        Read the SQL parts of the features, and only the fields of the elements
+        written by Python. With a fragment field, the SQL parts are only
+        computed for the features without a fragment.
+        """
+        parts = _merge_parts(cls.get_feature_parts(feature_type, queryset, output_crs))
+        fields = [part.orm_path for part in parts if not isinstance(part, tuple)]
+        annotations = dict(part for part in parts if isinstance(part, tuple))
+        if fragment_field is not None:
+            rendered = Q(**{f"{fragment_field}__isnull": False})
+            annotations = {
+                name: Case(When(rendered, then=Value(None)), default=expression, output_field=TextField())
+                for name, expression in annotations.items()
+            }
+            annotations["_as_fragment"] = F(fragment_field)
+        return queryset.only("pk", *fields).annotate(**annotations)
+
+    @classmethod
+    def render_fragments(cls, feature_type, queryset, output_crs):
+        """Yield the (pk, text) of the features as this renderer writes them, to store them as fragments."""
+        parts = cls.get_feature_parts(feature_type, queryset, output_crs)
+        if parts is None:
+            return
+        parts = _merge_parts(parts)
+        for instance in cls.decorate_feature_queryset(feature_type, queryset, output_crs).iterator():
+            yield instance.pk, cls.render_parts(parts, instance)
+
+    def get_merged_parts(self, sub_collection):
+        """The merged parts of the features of the sub collection, None when it isn't rendered by the database."""
+        feature_type = sub_collection.feature_type
+        if feature_type.name not in self.feature_parts:
+            parts = self.get_feature_parts(feature_type, sub_collection.queryset, self.output_crs)
+            self.feature_parts[feature_type.name] = _merge_parts(parts) if parts is not None else None
+        return self.feature_parts[feature_type.name]
+
+class DBFeatureGeoJsonRenderer(DBFeatureRenderingMixin, DBGeoJsonRenderer):
+    """GeoJSON renderer that has PostgreSQL write the features, byte for byte like GeoJsonRenderer."""
+    fragment_format = "geojson"
+
+    @classmethod
+    def get_value_expression(cls, element):
+        internal_type = _get_field_type(element)
+        path = element.orm_path
+        if internal_type in DB_TEXT_TYPES or internal_type in DB_INTEGER_TYPES or internal_type == "BooleanField":
+            return Coalesce(JSONText(F(path)), Value("null"), output_field=TextField())
+        if internal_type == "FloatField":
+            return _unless_null(path, _float_text(path, json=True), "null")
+        if internal_type == "DateTimeField":
+            return _unless_null(path, TextConcat(Value('"'), ISODateTime(F(path)), Value('"')), "null")
+        return None
+
+    @classmethod
+    def get_feature_parts(cls, feature_type, queryset, output_crs):
+        if feature_type.show_name_field and feature_type.display_field is None:
+            # the name is str(instance)
+            return None
+        if feature_type.geometry_fields:
+            match = feature_type.resolve_element(feature_type.geometry_field.name)
+            geometry = Coalesce(
+                AsGeoJSON(get_db_geometry_target(match, output_crs), precision=gisserver_conf.GISSERVER_DB_PRECISION),
+                Value("null"),
+                output_field=TextField(),
+            )
+        else:
+            geometry = "null"
+
+        parts = [
+            '    {"type":"Feature","id":',
+            JSONText(TextConcat(Value(f"{feature_type.name}."), Cast("pk", TextField()))),
+        ]
+        if feature_type.show_name_field:
+            name = feature_type.display_field_name
+            parts += [',"geometry_name":', Coalesce(JSONText(F(name)), Value("null"), output_field=TextField())]
+        parts += [
+            ',"geometry":',
+            geometry,
+            ',"properties":{',
+        ]
+        separator = ""
+        for element in feature_type.xsd_type.elements:
+            if element.is_geometry:
+                continue
+            if _get_field_type(element) is None:
+                return None
+            parts.append(separator + orjson.dumps(element.name).decode() + ":")
+            parts.append(cls.get_value_expression(element) or element)
+            separator = ","
+        parts.append("}}")
+        return parts
+
+    @classmethod
+    def decorate_queryset(cls, feature_type, queryset, output_crs, **params):
+        if cls.get_feature_parts(feature_type, queryset, output_crs) is None:
+            return super().decorate_queryset(feature_type, queryset, output_crs, **params)
+        # The geometry is part of the feature, not a separate _as_db_geojson annotation
+        queryset = super(DBGeoJsonRenderer, cls).decorate_queryset(feature_type, queryset, output_crs, **params)
+        return cls.decorate_feature_queryset(
+            feature_type, queryset, output_crs, cls.get_fragment_field(feature_type, output_crs)
+        )
+
+    @classmethod
+    def render_parts(cls, parts, instance) -> str:
+        return "".join(
+            getattr(instance, part[0]) if isinstance(part, tuple)
+            else orjson.dumps(_geojson_value(part.get_value(instance)), default=_json_default).decode()
+            for part in parts
+        )
+
+    def render_stream(self):
+        for sub_collection in self.collection.results:
+            self.get_merged_parts(sub_collection)
+        return super().render_stream()
+
+    def render_feature(self, feature_type, instance) -> bytes:
+        parts = self.feature_parts.get(feature_type.name)
+        if parts is None:
+            return super().render_feature(feature_type, instance)
+        fragment = getattr(instance, "_as_fragment", None)
+        if fragment is not None:
+            return fragment.encode()
+        return self.render_parts(parts, instance).encode()
+
+class DBFeatureGML32Renderer(DBFeatureRenderingMixin, DBGML32Renderer):
+    """GML 3.2 renderer that has PostgreSQL write the features, byte for byte like DBGML32Renderer."""
+    fragment_format = "gml"
+
+    @classmethod
+    def get_value_expression(cls, element):
+        internal_type = _get_field_type(element)
+        path = element.orm_path
+        if internal_type in DB_TEXT_TYPES:
+            return _xml_escape(F(path))
+        if internal_type in DB_INTEGER_TYPES:
+            return Cast(path, TextField())
+        if internal_type == "FloatField":
+            return _float_text(path)
+        if internal_type == "BooleanField":
+            return Case(When(**{path: True}, then=Value("true")), default=Value("false"), output_field=TextField())
+        if internal_type == "DateTimeField":
+            return ISODateTime(F(path))
+        return None
+
+    @classmethod
+    def get_feature_parts(cls, feature_type, queryset, output_crs):
+        geometry_elements = feature_type.xsd_type.geometry_elements
+        if len(geometry_elements) > 1:
+            # the gml:id sequence of the geometries depends on which ones are NULL
+            return None
+        parts = []
+        for element in feature_type.xsd_type.all_elements:
+            xml_name = element.xml_name
+            if isinstance(element, GmlBoundedByElement):
+                no_geometry = Q()
+                for field in feature_type.geometry_fields:
+                    no_geometry &= Q(**{f"{field.name}__isnull": True})
+                parts.append(_unless_null(no_geometry, TextConcat(
+                    Value("<gml:boundedBy>"),
+                    cls.get_db_envelope_as_gml(feature_type, queryset, output_crs),
+                    Value("</gml:boundedBy>\n"),
+                ), ""))
+            elif element.is_geometry:
+                if element.source is None or "__" in element.orm_path:
+                    return None
+                gml_id = TextConcat(Value(f"{feature_type.name}."), Cast("pk", TextField()), Value(".1"))
+                gml = AsGML(get_db_geometry_selects([element], output_crs)[element.name])
+                parts.append(_unless_null(element.orm_path, TextConcat(
+                    Value(f"<{xml_name}>"),
+                    _gml_with_id(gml, gml_id),
+                    Value(f"</{xml_name}>\n"),
+                ), f'<{xml_name} xsi:nil="true"/>\n'))
+            elif _get_field_type(element) is None:
+                return None
+            else:
+                value = cls.get_value_expression(element)
+                if value is None:
+                    parts.append(element)
+                else:
+                    parts.append(_unless_null(element.orm_path, TextConcat(
+                        Value(f"<{xml_name}>"), value, Value(f"</{xml_name}>\n"),
+                    ), f'<{xml_name} xsi:nil="true"/>\n'))
+        return parts
+
+    @classmethod
+    def decorate_queryset(cls, feature_type, queryset, output_crs, **params):
+        if cls.get_feature_parts(feature_type, queryset, output_crs) is None:
+            return super().decorate_queryset(feature_type, queryset, output_crs, **params)
+        # The geometries are part of the feature, not separate _as_gml_* annotations
+        queryset = super(DBGML32Renderer, cls).decorate_queryset(feature_type, queryset, output_crs, **params)
+        return cls.decorate_feature_queryset(
+            feature_type, queryset, output_crs, cls.get_fragment_field(feature_type, output_crs)
+        )
+
+    @classmethod
+    def render_parts(cls, parts, instance) -> str:
+        # the elements of the feature, the root tag is written by write_feature()
+        return "".join(
+            getattr(instance, part[0]) if isinstance(part, tuple) else _xml_field(part, part.get_value(instance))
+            for part in parts
+        )
+
+    def start_collection(self, sub_collection):
+        super().start_collection(sub_collection)
+        self.get_merged_parts(sub_collection)
+
+    def write_by_id_response(self, sub_collection, instance, extra_xmlns):
+        self.get_merged_parts(sub_collection)
+        return super().write_by_id_response(sub_collection, instance, extra_xmlns)
+
+    def write_feature(self, feature_type, instance, extra_xmlns="") -> None:
+        parts = self.feature_parts.get(feature_type.name)
+        if parts is None:
+            return super().write_feature(feature_type, instance, extra_xmlns=extra_xmlns)
+        pk = _tag_escape(str(instance.pk))
+        self._write(f'<{feature_type.xml_name} gml:id="{feature_type.name}.{pk}"{extra_xmlns}>\n')
+        fragment = getattr(instance, "_as_fragment", None)
+        self._write(fragment if fragment is not None else self.render_parts(parts, instance))
+        self._write(f"</{feature_type.xml_name}>\n")
+
+def select_feature_renderer(renderer_class, db_feature_renderer_class):
+    """
+    Like gisserver.output.select_renderer(): the renderer that has the
+    database write the features when OVERTUREMAPS_DB_FEATURE_RENDERING or
+    OVERTUREMAPS_FEATURE_FRAGMENTS is enabled (with GISSERVER_USE_DB_RENDERING
+    and the django-gisserver version it follows), else the gisserver one.
+    """
+
+    class SelectRenderer:
+
+        @classproperty
+        def real_class(self):
+            feature_rendering = conf.OVERTUREMAPS_DB_FEATURE_RENDERING or conf.OVERTUREMAPS_FEATURE_FRAGMENTS
+            if (
+                feature_rendering and gisserver_conf.GISSERVER_USE_DB_RENDERING
+                and db_feature_rendering_supported()
+            ):
+                return db_feature_renderer_class
+            return renderer_class
+
+        def __new__(cls, *args, **kwargs):
+            return cls.real_class(*args, **kwargs)
+
+        @classmethod
+        def decorate_collection(cls, *args, **kwargs):
+            return cls.real_class.decorate_collection(*args, **kwargs)
+
+        @classproperty
+        def max_page_size(cls):
+            return cls.real_class.max_page_size
+
+    return SelectRenderer
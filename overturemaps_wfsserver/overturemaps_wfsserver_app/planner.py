@@ -0,0 +1,98 @@
+import math
+
+from django.db import connection
+
+from . import conf
+from .models import ManifestRowGroupModel, ReleaseManifestModel
+from .utils import calculate_zoom_level
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+POSTGIS = "postgis"
+PMTILES = "pmtiles"
+REFUSE = "refuse"
+SUMMARY = "summary"
+
+class Plan:
+    """How a GetFeature request is answered."""
+    def __init__(self, route, zoom, estimate, reason):
+        self.route = route
+        self.zoom = zoom
+        self.estimate = estimate
+        self.reason = reason
+
+    def __str__(self):
+        estimate = f"~{self.estimate} features" if self.estimate is not None else "not estimated"
+        return f"{self.route} (zoom {self.zoom}, {estimate}: {self.reason})"
+
+def bbox_area_km2(bbox):
+    min_x, min_y, max_x, max_y = bbox
+    lat = math.radians((min_y + max_y) / 2)
+    return (max_x - min_x) * 111.32 * math.cos(lat) * (max_y - min_y) * 110.57
+
+def estimate_features(bbox):
+    """
+    Estimate the number of buildings in the bbox: from the row counts of the
+    intersecting row groups of the release manifest when it is built
+    (prorated by overlap), else from OVERTUREMAPS_PLANNER_DENSITY.
+    """
+    manifest = ReleaseManifestModel.objects.filter(release=conf.OVERTUREMAPS_RELEASE).first()
+    if manifest is None:
+        return int(bbox_area_km2(bbox) * conf.OVERTUREMAPS_PLANNER_DENSITY)
+
+    table = connection.ops.quote_name(ManifestRowGroupModel._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT COALESCE(SUM(num_rows * COALESCE("
+            f"ST_Area(ST_Intersection(geometry, envelope)) / NULLIF(ST_Area(geometry), 0), 1)), 0) "
+            f"FROM {table}, ST_MakeEnvelope(%s, %s, %s, %s, 4326) AS envelope "
+            f"WHERE manifest_id = %s AND geometry && envelope",
+            [*bbox, manifest.pk],
+        )
+        return int(cursor.fetchone()[0])
+
+def plan_request(bbox, source=None, geojson=True):
+    """
+    Choose how to answer a GetFeature for the bbox. Small areas are served
+    (and ingested) from PostGIS, medium ones from the generalized PMTiles
+    tiles, and huge ones are refused or summarized. Other formats than
+    GeoJSON can't be generalized, they are served from PostGIS up to the
+    hard limit of OVERTUREMAPS_PLANNER_MAX_FEATURES. The source can be
+    forced with the SOURCE request parameter, within that hard limit for
+    PostGIS. The buildings are only estimated when the route depends on it.
+    """
+    source = (source or conf.OVERTUREMAPS_FEATURE_SOURCE).lower()
+    zoom = calculate_zoom_level(bbox)
+    huge = conf.OVERTUREMAPS_PLANNER_HUGE
+    estimate = None
+
+    if source == POSTGIS:
+        estimate = estimate_features(bbox)
+        if estimate > conf.OVERTUREMAPS_PLANNER_MAX_FEATURES:
+            plan = Plan(huge, zoom, estimate, "requested postgis, above the hard limit")
+        else:
+            plan = Plan(POSTGIS, zoom, estimate, "requested")
+    elif source == PMTILES:
+        plan = Plan(PMTILES, zoom, estimate, "requested")
+    else:
+        small = zoom >= conf.OVERTUREMAPS_PLANNER_MIN_POSTGIS_ZOOM
+        if small or not geojson:
+            estimate = estimate_features(bbox)
+        if small and estimate <= conf.OVERTUREMAPS_PLANNER_MAX_POSTGIS_FEATURES:
+            plan = Plan(POSTGIS, zoom, estimate, "small area")
+        elif geojson and zoom >= conf.OVERTUREMAPS_PLANNER_MIN_PMTILES_ZOOM:
+            plan = Plan(PMTILES, zoom, estimate, "medium area")
+        elif not geojson and estimate <= conf.OVERTUREMAPS_PLANNER_MAX_FEATURES:
+            plan = Plan(POSTGIS, zoom, estimate, "large area, only GeoJSON can be generalized")
+        else:
+            if estimate is None:
+                # told to the client
+                estimate = estimate_features(bbox)
+            plan = Plan(huge, zoom, estimate, "large area" if geojson else "above the hard limit")
+
+    if plan.route == SUMMARY and not geojson:
+        plan.route = REFUSE
+    logger.info('Plan for BBOX %s: %s', bbox, plan)
+    return plan
@@ -0,0 +1,304 @@
+import asyncio
+import gzip
+import json
+import threading
+from collections import OrderedDict
+
+import aiohttp
+import mapbox_vector_tile
+import numpy as np
+import shapely
+from shapely.geometry import shape
+from pmtiles.tile import Compression, deserialize_directory, deserialize_header, find_tile, zxy_to_tileid
+
+from . import conf
+from .tiles import tile_range, tiles_for_bbox
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The header and root directory are within the first 16 KiB of an archive
+ROOT_SIZE = 16384
+
+# Levels of leaf directories followed below the root, archives need far less
+MAX_DIRECTORY_DEPTH = 8
+
+class TooManyTilesError(Exception):
+    """The bbox needs more tiles than allowed, even at the lowest zoom of the archive."""
+
+class LRUCache:
+    """A small thread safe LRU mapping."""
+    def __init__(self, size):
+        self.size = size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+def tile_to_lonlat(coords, z, x, y, extent):
+    """Project (N, 2) tile pixel coordinates (y axis up) of tile z/x/y to lon/lat."""
+    world_extent = 2 ** z * extent
+    world_x = x * extent + coords[:, 0]
+    world_y = y * extent + (extent - coords[:, 1])
+    lon = world_x / world_extent * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi - 2.0 * np.pi * world_y / world_extent)))
+    return np.column_stack([lon, lat])
+
+class DecodedTile:
+    """The features of a vector tile, with all geometries in lon/lat."""
+    def __init__(self, geometries, ids, properties):
+        self.geometries = geometries
+        self.ids = ids
+        self.properties = properties
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0, dtype=object), [], [])
+
+    @classmethod
+    def decode(cls, data, z, x, y):
+        geometries = []
+        ids = []
+        properties = []
+        for layer in mapbox_vector_tile.decode(data).values():
+            extent = layer.get('extent', 4096)
+            layer_geometries = np.array([shape(f['geometry']) for f in layer['features']], dtype=object)
+            if len(layer_geometries):
+                # all coordinates of the layer are projected at once
+                geometries.append(shapely.transform(
+                    layer_geometries, lambda coords: tile_to_lonlat(coords, z, x, y, extent)
+                ))
+            for feature in layer['features']:
+                props = feature['properties']
+                ids.append(props.get('id', feature.get('id')))
+                properties.append(props)
+        if not geometries:
+            return cls.empty()
+        return cls(np.concatenate(geometries), ids, properties)
+
+def merge_tile_features(decoded_tiles, bbox):
+    """
+    Return the (geometries, ids, properties) of the decoded tiles intersecting
+    the bbox. A building crossing tile edges is in each of these tiles, it is
+    returned once (by id, features without id are all kept).
+    """
+    geometries = []
+    ids = []
+    properties = []
+    seen = set()
+    area = shapely.box(*bbox)
+    for value in decoded_tiles:
+        if not len(value.geometries):
+            continue
+        mask = shapely.intersects(value.geometries, area)
+        for index in np.flatnonzero(mask):
+            feature_id = value.ids[index]
+            if feature_id is not None:
+                if feature_id in seen:
+                    continue
+                seen.add(feature_id)
+            geometries.append(value.geometries[index])
+            ids.append(feature_id)
+            properties.append(value.properties[index])
+    return np.array(geometries, dtype=object), ids, properties
+
+class PMTilesSource:
+    """
+    Read features from a remote PMTiles archive of vector tiles.
+    The tiles of a bbox are fetched concurrently; their byte ranges are
+    resolved first so adjacent tiles (PMTiles stores them in Hilbert order)
+    are read with a single range request. Decoded tiles are kept in an LRU
+    cache shared by the requests, and so are the event loop (in a thread of
+    its own) and the HTTP session doing the requests.
+    """
+    def __init__(self, url, cache_size=None, concurrency=None, max_tiles=None, coalesce_gap=None):
+        self.url = url
+        self.concurrency = concurrency or conf.OVERTUREMAPS_PMTILES_CONCURRENCY
+        self.max_tiles = max_tiles or conf.OVERTUREMAPS_PMTILES_MAX_TILES
+        self.coalesce_gap = conf.OVERTUREMAPS_PMTILES_COALESCE_GAP if coalesce_gap is None else coalesce_gap
+        self.tiles = LRUCache(cache_size or conf.OVERTUREMAPS_PMTILES_CACHE_SIZE)
+        self.directories = LRUCache(256)
+        self.header = None
+        self.root = None
+        self._loop = None
+        self._loop_lock = threading.Lock()
+        self._session = None
+
+    def _run(self, coroutine):
+        """Run the coroutine in the event loop of the source and return its result."""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="pmtiles", daemon=True).start()
+            loop = self._loop
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+    async def _get_session(self):
+        # only used within the event loop of the source, so it's created once
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    def close(self):
+        """Close the HTTP session and stop the event loop."""
+        with self._loop_lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+    def choose_zoom(self, bbox, max_zoom=None):
+        """The highest zoom at which the bbox needs at most max_tiles tiles."""
+        min_zoom = self.header['min_zoom'] if self.header else 0
+        zoom = min(max_zoom or conf.OVERTUREMAPS_COVERAGE_ZOOM, self.header['max_zoom'] if self.header else 14)
+        while zoom >= min_zoom:
+            tile_min_x, tile_min_y, tile_max_x, tile_max_y = tile_range(bbox, zoom)
+            if (tile_max_x - tile_min_x + 1) * (tile_max_y - tile_min_y + 1) <= self.max_tiles:
+                return zoom
+            zoom -= 1
+        raise TooManyTilesError(f"BBOX {bbox} needs more than {self.max_tiles} tiles at zoom {min_zoom}")
+
+    def get_features(self, bbox, max_zoom=None):
+        """Return the (geometries, ids, properties) intersecting the bbox, each building once."""
+        if self.header is None:
+            self._run(self._load_root())
+        zoom = self.choose_zoom(bbox, max_zoom)
+        tiles = list(tiles_for_bbox(bbox, zoom))
+
+        decoded = {tile: self.tiles.get((zoom,) + tile) for tile in tiles}
+        missing = [tile for tile, value in decoded.items() if value is None]
+        if missing:
+            decoded.update(self._run(self._fetch_tiles(zoom, missing)))
+        logger.debug('PMTiles %s: %s tiles at zoom %s, %s fetched', bbox, len(tiles), zoom, len(missing))
+        return merge_tile_features([decoded[tile] for tile in tiles], bbox)
+
+    def get_geojson(self, bbox, max_zoom=None, count=None):
+        """Return the features of the bbox as a GeoJSON FeatureCollection string."""
+        geometries, ids, properties = self.get_features(bbox, max_zoom)
+        if count is not None:
+            geometries, ids, properties = geometries[:count], ids[:count], properties[:count]
+        features = [
+            '{"type":"Feature","id":%s,"geometry":%s,"properties":%s}' % (json.dumps(feature_id), geometry, json.dumps(props))
+            for feature_id, geometry, props in zip(ids, shapely.to_geojson(geometries), properties)
+        ]
+        return '{"type":"FeatureCollection","numberReturned":%d,"features":[%s]}' % (len(features), ",".join(features))
+
+    async def _get(self, session, semaphore, offset, length):
+        async with semaphore:
+            headers = {"Range": f"bytes={offset}-{offset + length - 1}"}
+            async with session.get(self.url, headers=headers) as response:
+                response.raise_for_status()
+                return await response.read()
+
+    async def _load_root(self):
+        session = await self._get_session()
+        data = await self._get(session, asyncio.Semaphore(1), 0, ROOT_SIZE)
+        header = deserialize_header(data[:127])
+        self.root = deserialize_directory(data[header['root_offset']:header['root_offset'] + header['root_length']])
+        self.header = header
+
+    async def _fetch_tiles(self, zoom, tiles):
+        """Fetch and decode the tiles, returning {(x, y): DecodedTile}."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        session = await self._get_session()
+        # Resolve the tile entries, walking down the leaf directories
+        pending = {tile: (zxy_to_tileid(zoom, *tile), self.root) for tile in tiles}
+        entries = {}
+        depth = 0
+        while pending:
+            if depth == MAX_DIRECTORY_DEPTH:
+                raise ValueError(
+                    f"PMTiles archive {self.url} has more than {MAX_DIRECTORY_DEPTH} levels of leaf directories"
+                )
+            depth += 1
+            leaves = {}
+            for tile, (tile_id, directory) in pending.items():
+                entry = find_tile(directory, tile_id)
+                if entry is None:
+                    entries[tile] = None
+                elif entry.run_length == 0:
+                    leaves.setdefault((entry.offset, entry.length), []).append(tile)
+                else:
+                    entries[tile] = (entry.offset, entry.length)
+            directories = await asyncio.gather(*[
+                self._get_directory(session, semaphore, offset, length) for offset, length in leaves
+            ])
+            pending = {
+                tile: (pending[tile][0], directory)
+                for (key, tile_list), directory in zip(leaves.items(), directories)
+                for tile in tile_list
+            }
+
+        # Read the tile data, merging the ranges that are close to each other
+        ranges = sorted({entry for entry in entries.values() if entry is not None})
+        requests = []
+        for offset, length in ranges:
+            if requests and offset <= requests[-1][1] + self.coalesce_gap:
+                requests[-1][1] = max(requests[-1][1], offset + length)
+            else:
+                requests.append([offset, offset + length])
+        data_offset = self.header['tile_data_offset']
+        chunks = await asyncio.gather(*[
+            self._get(session, semaphore, data_offset + start, end - start) for start, end in requests
+        ])
+
+        contents = {}
+        for (start, end), chunk in zip(requests, chunks):
+            for offset, length in ranges:
+                if start <= offset < end:
+                    contents[(offset, length)] = chunk[offset - start:offset - start + length]
+        logger.debug('PMTiles fetched %s tiles with %s range requests', len(ranges), len(requests))
+
+        decoded = {}
+        for tile, entry in entries.items():
+            # tiles missing from the archive are cached as empty too
+            value = DecodedTile.empty()
+            if entry is not None:
+                data = contents[entry]
+                if Compression(self.header['tile_compression']) == Compression.GZIP:
+                    data = gzip.decompress(data)
+                value = DecodedTile.decode(data, zoom, *tile)
+            self.tiles.set((zoom,) + tile, value)
+            decoded[tile] = value
+        return decoded
+
+    async def _get_directory(self, session, semaphore, offset, length):
+        directory = self.directories.get(offset)
+        if directory is None:
+            data = await self._get(session, semaphore, self.header['leaf_directory_offset'] + offset, length)
+            directory = deserialize_directory(data)
+            self.directories.set(offset, directory)
+        return directory
+
+_source = None
+_source_lock = threading.Lock()
+
+def get_pmtiles_source():
+    """The PMTiles source of OVERTUREMAPS_PMTILES_URL, shared by all requests."""
+    global _source
+    with _source_lock:
+        if _source is None or _source.url != conf.OVERTUREMAPS_PMTILES_URL:
+            if _source is not None:
+                _source.close()
+            _source = PMTilesSource(conf.OVERTUREMAPS_PMTILES_URL)
+        return _source
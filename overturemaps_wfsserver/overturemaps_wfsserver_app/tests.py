@@ -1,3 +1,954 @@
-from django.test import TestCase
+import asyncio
+import json
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock
+
+import geopandas
+import mapbox_vector_tile
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+from django.contrib.gis.geos import MultiPolygon, Polygon
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.utils.http import http_date, quote_etag
+from pmtiles.tile import Compression, Entry, zxy_to_tileid
+from gisserver.exceptions import InvalidParameterValue
+from gisserver.geometries import CRS
+from gisserver.output import geojson_renderer
+from gisserver.output.geojson import DBGeoJsonRenderer
+from gisserver.output.gml32 import DBGML32Renderer
+
+from . import cache, conf, planner, views
+from .cache import ResponseCache, get_cached_response, get_request_version, normalize_parameters
+from .models import (
+    IngestionJobModel, OverturemapsBuildingModel, ParallelRecordBatchReader, get_buildings_feature_type, iter_chunks, store_fragments,
+)
+from .models import overturemapscoverage
+from .models.overturemapscoverage import get_missing_envelopes, inner_cells
+from .models.overturemapsreader import covered_by_regions
+from .operations import decode_cursor, encode_cursor, get_query_key
+from .output import (
+    GISSERVER_VERSION, DBFeatureGeoJsonRenderer, DBFeatureGML32Renderer, DBFeatureRenderingMixin,
+    select_feature_renderer,
+)
+from .pmtilessource import MAX_DIRECTORY_DEPTH, DecodedTile, PMTilesSource, merge_tile_features, tile_to_lonlat
+from .models.overturemapsingestion import batch_to_rows, prepare_geometries, upsert_buildings
+from .tiles import tile_bounds
+from .utils import calculate_zoom_level
+from .vectortiles import render_tile, tile_geometry_column
+from .views import OverturemapsWFSView
+
+
+class SyntheticBuildingReader:
+    """
+    A record batch reader generating building batches on demand, like the
+    Overture maps reader does while it downloads a large bbox.
+    """
+    def __init__(self, num_batches, rows_per_batch=2000):
+        self.num_batches = num_batches
+        self.rows_per_batch = rows_per_batch
+        self.read = 0
+
+    def read_next_batch(self):
+        if self.read == self.num_batches:
+            raise StopIteration
+        offset = self.read * self.rows_per_batch
+        self.read += 1
+        geometries = shapely.box(
+            [i * 0.0001 for i in range(self.rows_per_batch)], 0.0,
+            [i * 0.0001 + 0.00005 for i in range(self.rows_per_batch)], 0.00005,
+        )
+        return pa.RecordBatch.from_pydict({
+            "id": [f"building-{offset + i}" for i in range(self.rows_per_batch)],
+            "version": [1] * self.rows_per_batch,
+            "update_time": ["2024-05-16T00:00:00Z"] * self.rows_per_batch,
+            "has_parts": [False] * self.rows_per_batch,
+            "geometry": shapely.to_wkb(geometries).tolist(),
+            "height": [None] * self.rows_per_batch,
+            "sources": [[{"property": "", "dataset": "OpenStreetMap", "record_id": "w1", "confidence": None}]] * self.rows_per_batch,
+        })
+
+
+class IterChunksTest(SimpleTestCase):
+    budget = 256 * 1024
+
+    def consume(self, reader):
+        """Convert all chunks like the ingestion does, returning (rows, arrow peak, python peak)."""
+        rows = 0
+        arrow_peak = 0
+        tracemalloc.start()
+        try:
+            for chunk in iter_chunks(reader, self.budget):
+                self.assertLessEqual(sum(batch.nbytes for batch in chunk), self.budget)
+                for batch in chunk:
+                    batch_rows = batch_to_rows(batch)
+                    rows += len(batch_rows)
+                arrow_peak = max(arrow_peak, pa.total_allocated_bytes())
+                del chunk, batch, batch_rows
+            _, python_peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return rows, arrow_peak, python_peak
+
+    def test_all_rows(self):
+        rows, _, _ = self.consume(SyntheticBuildingReader(5, rows_per_batch=3000))
+        self.assertEqual(rows, 15000)
+
+    def test_memory_independent_of_bbox_size(self):
+        _, small_arrow, small_python = self.consume(SyntheticBuildingReader(5))
+        rows, large_arrow, large_python = self.consume(SyntheticBuildingReader(100))
+        self.assertEqual(rows, 200000)
+        # 20 times more data, while the peak stays about the same
+        self.assertLess(large_arrow, small_arrow * 1.5)
+        self.assertLess(large_python, small_python * 1.5)
+
+
+class ParallelRecordBatchReaderTest(SimpleTestCase):
+    # buildings as (id, xmin, ymin, xmax, ymax), some of them on the tile edges
+    buildings = [
+        (f"building-{i}", x, y, x + 0.004, y + 0.004)
+        for i, (x, y) in enumerate(
+            (-74.0 + dx * 0.0037, 40.70 + dy * 0.0029) for dx in range(30) for dy in range(30)
+        )
+    ]
+
+    def fetch(self, bbox):
+        """Return the buildings intersecting the bbox, like Overture maps does."""
+        min_x, min_y, max_x, max_y = bbox
+        rows = [b for b in self.buildings if b[1] < max_x and b[3] > min_x and b[2] < max_y and b[4] > min_y]
+        batch = pa.RecordBatch.from_pydict({
+            "id": [b[0] for b in rows],
+            "bbox": [{"xmin": b[1], "ymin": b[2], "xmax": b[3], "ymax": b[4]} for b in rows],
+        })
+        return pa.RecordBatchReader.from_batches(batch.schema, [batch])
+
+    def test_buildings_once(self):
+        bbox = (-73.99, 40.71, -73.93, 40.76)
+        expected = sorted(self.fetch(bbox).read_all().column("id").to_pylist())
+        with ParallelRecordBatchReader(bbox, workers=3, zoom=15, fetch=self.fetch) as reader:
+            self.assertGreater(len(reader.tiles), 1)
+            ids = sorted(id for batch in reader for id in batch.column("id").to_pylist())
+        self.assertEqual(ids, expected)
+
+
+class PrepareGeometriesTest(SimpleTestCase):
+
+    def prepare(self, *geometries):
+        wkb = np.array(
+            [geometry if isinstance(geometry, bytes) else shapely.to_wkb(geometry) for geometry in geometries],
+            dtype=object,
+        )
+        return list(shapely.from_wkb(prepare_geometries(wkb)))
+
+    def test_polygon(self):
+        [geometry] = self.prepare(shapely.box(0, 0, 1, 1))
+        self.assertEqual(geometry.geom_type, "MultiPolygon")
+        self.assertTrue(geometry.equals(shapely.MultiPolygon([shapely.box(0, 0, 1, 1)])))
+
+    def test_invalid(self):
+        bowtie = shapely.Polygon([(0, 0), (1, 1), (1, 0), (0, 1), (0, 0)])
+        [geometry] = self.prepare(bowtie)
+        self.assertEqual(geometry.geom_type, "MultiPolygon")
+        self.assertTrue(geometry.is_valid)
+        self.assertEqual(len(geometry.geoms), 2)
+        self.assertAlmostEqual(geometry.area, 0.5)
+
+    def test_collection(self):
+        collection = shapely.GeometryCollection([
+            shapely.box(0, 0, 1, 1),
+            shapely.LineString([(0, 0), (5, 5)]),
+            shapely.Point(7, 7),
+            shapely.MultiPolygon([shapely.box(2, 0, 3, 1), shapely.box(4, 0, 5, 1)]),
+        ])
+        [geometry] = self.prepare(collection)
+        self.assertEqual(geometry.geom_type, "MultiPolygon")
+        self.assertEqual(len(geometry.geoms), 3)
+        self.assertAlmostEqual(geometry.area, 3)
+
+    def test_no_area(self):
+        geometries = self.prepare(
+            shapely.box(0, 0, 1, 1),
+            shapely.LineString([(0, 0), (1, 1)]),
+            shapely.Point(0, 0),
+            shapely.Polygon(),
+            b"not wkb",
+            shapely.box(2, 0, 3, 1),
+        )
+        self.assertEqual([geometry is None for geometry in geometries], [False, True, True, True, True, False])
+        self.assertAlmostEqual(geometries[5].area, 1)
+
+
+class NormalizeParametersTest(SimpleTestCase):
+
+    def test_equivalent_requests(self):
+        a = normalize_parameters({
+            "REQUEST": "GetFeature", "TYPENAMES": "overturemapsbuildingmodel",
+            "BBOX": "-58.38000000001,-34.61,-58.37,-34.60", "OUTPUTFORMAT": "GeoJSON", "STARTINDEX": "0",
+        })
+        b = normalize_parameters({
+            "SERVICE": "WFS", "TYPENAME": "OverturemapsBuildingModel",
+            "BBOX": "-58.38,-34.61,-58.37,-34.6", "OUTPUTFORMAT": "geojson",
+        })
+        self.assertEqual(a, b)
+
+    def test_different_pages(self):
+        params = {"TYPENAMES": "overturemapsbuildingmodel", "BBOX": "-58.38,-34.61,-58.37,-34.6"}
+        self.assertNotEqual(
+            normalize_parameters({**params, "COUNT": "100"}),
+            normalize_parameters({**params, "COUNT": "100", "STARTINDEX": "100"}),
+        )
+
+
+class ResponseCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        self.response_cache = ResponseCache("overturemaps", max_size=100, max_bytes=250)
+        self.response_cache.cache.clear()
+
+    def store(self, version, size):
+        response = HttpResponse(b"x" * size, content_type="application/json")
+        self.response_cache.set(version, response)
+
+    def test_max_bytes(self):
+        self.store("a", 100)
+        self.store("b", 100)
+        self.assertIsNotNone(self.response_cache.get("a"))
+        # "b" is the least recently used one now
+        self.store("c", 100)
+        self.assertIsNone(self.response_cache.get("b"))
+        self.assertIsNotNone(self.response_cache.get("a"))
+        self.assertIsNotNone(self.response_cache.get("c"))
+        self.assertEqual(self.response_cache.stats(), {"hits": 3, "misses": 1, "entries": 2, "bytes": 200})
+
+    def test_max_size(self):
+        self.store("a", 101)
+        self.assertIsNone(self.response_cache.get("a"))
+
+    def test_server_url(self):
+        params = {"TYPENAMES": "overturemapsbuildingmodel", "BBOX": "-58.38,-34.61,-58.37,-34.6", "COUNT": "10"}
+        bbox = (-58.38, -34.61, -58.37, -34.6)
+        with mock.patch.object(cache, "_get_generations", return_value=[[1, 2, 0]]):
+            self.assertNotEqual(
+                get_request_version(params, bbox, "http://example.com/wfs/overturemaps/"),
+                get_request_version(params, bbox, "https://example.org/wfs/overturemaps/"),
+            )
+
+
+class ConditionalResponseTest(SimpleTestCase):
+    params = {"TYPENAMES": "overturemapsbuildingmodel", "BBOX": "-58.38,-34.61,-58.37,-34.6", "COUNT": "10"}
+    bbox = (-58.38, -34.61, -58.37, -34.6)
+    server_url = "http://testserver/wfs/overturemaps/"
+    last_modified = datetime(2026, 10, 1, tzinfo=timezone.utc)
+
+    def setUp(self):
+        self.response_cache = ResponseCache("overturemaps")
+        self.response_cache.cache.clear()
+
+    def get_version(self, generations):
+        with mock.patch.object(cache, "_get_generations", return_value=generations):
+            return get_request_version(self.params, self.bbox, self.server_url)
+
+    def get_response(self, version, **headers):
+        request = RequestFactory().get("/wfs/overturemaps/", self.params, **headers)
+        return get_cached_response(request, version, self.last_modified, self.response_cache, "public, max-age=60")
+
+    def test_not_modified(self):
+        version = self.get_version([[1, 2, 0], [1, 3, 4]])
+        response = self.get_response(version, HTTP_IF_NONE_MATCH=quote_etag(version))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], quote_etag(version))
+        self.assertEqual(response["Last-Modified"], http_date(self.last_modified.timestamp()))
+
+        response = self.get_response(version, HTTP_IF_MODIFIED_SINCE=http_date(self.last_modified.timestamp()))
+        self.assertEqual(response.status_code, 304)
+
+    def test_generation_bump(self):
+        old_version = self.get_version([[1, 2, 0], [1, 3, 4]])
+        version = self.get_version([[1, 2, 1], [1, 3, 4]])
+        self.assertNotEqual(old_version, version)
+        # not cached yet: rendered
+        self.assertIsNone(self.get_response(version, HTTP_IF_NONE_MATCH=quote_etag(old_version)))
+
+        self.response_cache.set(version, HttpResponse(b"{}", content_type="application/geo+json"))
+        response = self.get_response(version, HTTP_IF_NONE_MATCH=quote_etag(old_version))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["ETag"], quote_etag(version))
+        self.assertEqual(response["X-Cache"], "HIT")
+
+    def test_release_change(self):
+        generations = [[1, 2, 0], [1, 3, 4]]
+        old_version = self.get_version(generations)
+        with mock.patch.object(conf, "OVERTUREMAPS_RELEASE", "2024-08-20.0"):
+            version = self.get_version(generations)
+        self.assertNotEqual(old_version, version)
+
+        self.response_cache.set(version, HttpResponse(b"{}", content_type="application/geo+json"))
+        response = self.get_response(version, HTTP_IF_NONE_MATCH=quote_etag(old_version))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["ETag"], quote_etag(version))
+
+    def test_not_ingested(self):
+        self.assertIsNone(self.get_version(None))
+
+
+class InnerCellsTest(SimpleTestCase):
+
+    def test_aligned_bbox(self):
+        bbox = (*tile_bounds(100, 200, 10)[:2], *tile_bounds(102, 198, 10)[2:])
+        self.assertEqual(inner_cells(bbox, 10), (100, 198, 102, 200))
+
+    def test_partial_border_cells(self):
+        min_x, min_y, max_x, max_y = (*tile_bounds(100, 200, 10)[:2], *tile_bounds(102, 198, 10)[2:])
+        bbox = (min_x + 0.01, min_y + 0.01, max_x - 0.01, max_y - 0.01)
+        self.assertEqual(inner_cells(bbox, 10), (101, 199, 101, 199))
+
+    def test_inside_a_cell(self):
+        min_x, min_y, max_x, max_y = tile_bounds(100, 200, 10)
+        self.assertIsNone(inner_cells((min_x + 0.01, min_y + 0.01, max_x - 0.01, max_y - 0.01), 10))
+
+
+class MissingEnvelopesTest(SimpleTestCase):
+
+    def get_envelopes(self, missing):
+        with mock.patch.object(overturemapscoverage, "get_missing_cells", return_value=set(missing)):
+            return sorted(get_missing_envelopes((-58.38, -34.61, -58.37, -34.6), 14))
+
+    def envelope(self, min_x, min_y, max_x, max_y):
+        """The bbox of the cells from min_x, min_y to max_x, max_y (rows grow southwards)."""
+        return (*tile_bounds(min_x, max_y, 14)[:2], *tile_bounds(max_x, min_y, 14)[2:])
+
+    def test_covered(self):
+        self.assertEqual(self.get_envelopes([]), [])
+
+    def test_rectangle(self):
+        cells = [(x, y) for x in range(100, 103) for y in range(200, 202)]
+        self.assertEqual(self.get_envelopes(cells), [self.envelope(100, 200, 102, 201)])
+
+    def test_rows(self):
+        # an L shape: the first row is longer than the second one
+        cells = [(100, 200), (101, 200), (102, 200), (100, 201)]
+        self.assertEqual(
+            self.get_envelopes(cells), sorted([self.envelope(100, 200, 102, 200), self.envelope(100, 201, 100, 201)])
+        )
+
+    def test_gaps(self):
+        # two runs in each row, and a row without cells between the rectangles
+        cells = [(100, 200), (101, 200), (103, 200), (100, 201), (101, 201), (103, 201), (100, 203)]
+        self.assertEqual(self.get_envelopes(cells), sorted([
+            self.envelope(100, 200, 101, 201), self.envelope(103, 200, 103, 201), self.envelope(100, 203, 100, 203),
+        ]))
+
+
+class MirrorRegionsTest(SimpleTestCase):
+
+    def test_covered(self):
+        west = (*tile_bounds(100, 201, 14)[:2], *tile_bounds(101, 200, 14)[2:])
+        east = (*tile_bounds(102, 201, 14)[:2], *tile_bounds(103, 200, 14)[2:])
+        inside = (*tile_bounds(100, 201, 14)[:2], *tile_bounds(100, 200, 14)[2:])
+        across = (*tile_bounds(101, 201, 14)[:2], *tile_bounds(102, 200, 14)[2:])
+        self.assertTrue(covered_by_regions(inside, [west]))
+        self.assertFalse(covered_by_regions(across, [west]))
+        # adjacent regions cover the bbox together
+        self.assertTrue(covered_by_regions(across, [west, east]))
+        self.assertFalse(covered_by_regions(across, []))
+
+    def test_gap(self):
+        west = (*tile_bounds(100, 200, 14)[:2], *tile_bounds(100, 200, 14)[2:])
+        east = (*tile_bounds(102, 200, 14)[:2], *tile_bounds(102, 200, 14)[2:])
+        across = (*tile_bounds(100, 200, 14)[:2], *tile_bounds(102, 200, 14)[2:])
+        self.assertFalse(covered_by_regions(across, [west, east]))
+
+
+class CursorTest(SimpleTestCase):
+
+    def test_next_page(self):
+        params = {"TYPENAMES": "overturemapsbuildingmodel", "BBOX": "-58.38,-34.61,-58.37,-34.6", "COUNT": "100"}
+        cursor = encode_cursor(1234, get_query_key(params))
+        next_params = {**params, "STARTINDEX": "100", "CURSOR": cursor}
+        self.assertEqual(decode_cursor(cursor, get_query_key(next_params)), 1234)
+
+    def test_other_request(self):
+        params = {"TYPENAMES": "overturemapsbuildingmodel", "BBOX": "-58.38,-34.61,-58.37,-34.6"}
+        cursor = encode_cursor(1234, get_query_key(params))
+        with self.assertRaises(InvalidParameterValue):
+            decode_cursor(cursor, get_query_key({**params, "BBOX": "-58.39,-34.61,-58.37,-34.6"}))
+        with self.assertRaises(InvalidParameterValue):
+            decode_cursor("not a cursor", get_query_key(params))
+
+
+class PMTilesTest(SimpleTestCase):
+
+    def test_tile_to_lonlat(self):
+        coords = np.array([[0, 4096], [4096, 0], [2048, 2048]])
+        lonlat = tile_to_lonlat(coords, 0, 0, 0, 4096)
+        np.testing.assert_allclose(lonlat, [[-180, 85.0511288], [180, -85.0511288], [0, 0]], atol=1e-6)
+
+        # the pixel corners of a tile are its bounds
+        min_x, min_y, max_x, max_y = tile_bounds(9660, 19741, 15)
+        lonlat = tile_to_lonlat(np.array([[0, 4096], [4096, 0]]), 15, 9660, 19741, 4096)
+        np.testing.assert_allclose(lonlat, [[min_x, max_y], [max_x, min_y]], atol=1e-9)
+
+    def test_merge_tile_features(self):
+        left = DecodedTile(
+            np.array([shapely.box(0, 0, 1, 1), shapely.box(0.9, 0, 1, 0.1), shapely.box(5, 5, 6, 6)], dtype=object),
+            ["a", "b", "c"],
+            [{"height": 1}, {"height": 2}, {"height": 3}],
+        )
+        right = DecodedTile(
+            np.array([shapely.box(1, 0, 1.1, 0.1), shapely.box(1, 0, 2, 1), shapely.box(1, 0.5, 2, 0.6)], dtype=object),
+            ["b", "d", None],
+            [{"height": 2}, {"height": 4}, {}],
+        )
+        geometries, ids, properties = merge_tile_features([left, DecodedTile.empty(), right], (0, 0, 2, 2))
+        # "b" crosses the tile edge and is returned once, "c" is outside the bbox
+        self.assertEqual(ids, ["a", "b", "d", None])
+        self.assertEqual([p.get("height") for p in properties], [1, 2, 4, None])
+        self.assertTrue(shapely.equals(geometries[1], shapely.box(0.9, 0, 1, 0.1)))
+
+        geometries, ids, properties = merge_tile_features([DecodedTile.empty()], (0, 0, 2, 2))
+        self.assertEqual((len(geometries), ids, properties), (0, [], []))
+
+    def fetch_tiles(self, zoom, tiles, root, directories, data):
+        """Run _fetch_tiles on an archive of the root and {offset: leaf directory}, all tiles are data."""
+        source = PMTilesSource("http://example.com/buildings.pmtiles")
+        source.header = {
+            "tile_data_offset": 0, "leaf_directory_offset": 0, "tile_compression": Compression.NONE.value,
+        }
+        source.root = root
+
+        async def get_directory(session, semaphore, offset, length):
+            return directories[offset]
+
+        async def get(session, semaphore, offset, length):
+            return data
+
+        with mock.patch.object(source, "_get_session", mock.AsyncMock()), \
+                mock.patch.object(source, "_get_directory", get_directory), \
+                mock.patch.object(source, "_get", get):
+            return asyncio.run(source._fetch_tiles(zoom, tiles))
+
+    def test_leaf_directories(self):
+        data = mapbox_vector_tile.encode([{
+            "name": "buildings",
+            "features": [{"geometry": "POLYGON ((0 0, 100 0, 100 100, 0 100, 0 0))", "properties": {}, "id": 1}],
+        }])
+        tile_id = zxy_to_tileid(14, 5535, 9872)
+        # five levels of leaf directories below the root
+        root = [Entry(0, 100, 1, 0)]
+        directories = {100 + level: [Entry(0, 101 + level, 1, 0)] for level in range(5)}
+        directories[105] = [Entry(tile_id, 0, len(data), 1)]
+        decoded = self.fetch_tiles(14, [(5535, 9872), (5536, 9872)], root, directories, data)
+        self.assertEqual(len(decoded[(5535, 9872)].geometries), 1)
+        # not in the archive
+        self.assertEqual(len(decoded[(5536, 9872)].geometries), 0)
+
+    def test_directory_loop(self):
+        directories = {100: [Entry(0, 100, 1, 0)]}
+        with self.assertRaisesRegex(ValueError, str(MAX_DIRECTORY_DEPTH)):
+            self.fetch_tiles(14, [(5535, 9872)], [Entry(0, 100, 1, 0)], directories, b"")
+
+
+class FragmentFieldTest(SimpleTestCase):
+
+    def test_fragment_field(self):
+        feature_type = SimpleNamespace(model=OverturemapsBuildingModel)
+        with mock.patch.object(conf, "OVERTUREMAPS_FEATURE_FRAGMENTS", True):
+            self.assertEqual(DBFeatureGML32Renderer.get_fragment_field(feature_type, CRS.from_srid(3857)), "gml_3857")
+            self.assertEqual(
+                DBFeatureGeoJsonRenderer.get_fragment_field(feature_type, CRS.from_srid(4326)), "geojson_4326"
+            )
+            # reprojected responses are rendered
+            self.assertIsNone(DBFeatureGeoJsonRenderer.get_fragment_field(feature_type, CRS.from_srid(28992)))
+        with mock.patch.object(conf, "OVERTUREMAPS_FEATURE_FRAGMENTS", False):
+            self.assertIsNone(DBFeatureGML32Renderer.get_fragment_field(feature_type, CRS.from_srid(4326)))
+
+
+@mock.patch.object(conf, "OVERTUREMAPS_DB_FEATURE_RENDERING", True)
+@mock.patch("gisserver.conf.GISSERVER_USE_DB_RENDERING", True)
+class SelectFeatureRendererTest(SimpleTestCase):
+
+    def test_gisserver_version(self):
+        renderer_class = select_feature_renderer(geojson_renderer, DBFeatureGeoJsonRenderer)
+        with mock.patch("gisserver.__version__", GISSERVER_VERSION):
+            self.assertIs(renderer_class.real_class, DBFeatureGeoJsonRenderer)
+        # the SQL of the database renderers may not match another version
+        with mock.patch("gisserver.__version__", "1.5.0"):
+            self.assertIs(renderer_class.real_class, geojson_renderer)
+
+
+class ZoomLevelTest(SimpleTestCase):
+
+    def test_tile(self):
+        # a tile fills a map of its own size at its zoom
+        for zoom in (1, 8, 12, 14, 18):
+            self.assertEqual(calculate_zoom_level(tile_bounds(1, 1, zoom), viewport_size=256), zoom)
+
+    def test_viewport(self):
+        # a map 4 tiles wide shows a tile of zoom 14 at zoom 16
+        self.assertEqual(calculate_zoom_level(tile_bounds(3, 5, 14), viewport_size=1024), 16)
+
+    def test_degrees(self):
+        self.assertEqual(calculate_zoom_level((-58.5, 0, -57.5, 0.001), viewport_size=1024), 10)
+        self.assertEqual(calculate_zoom_level((-58.5, -34.6, -58.499, -33.6), viewport_size=1024), 10)
+        self.assertEqual(calculate_zoom_level((-180, -85, 180, 85), viewport_size=256), 0)
+
+
+class PlanRequestTest(SimpleTestCase):
+
+    def plan(self, bbox, estimate=1000, **kwargs):
+        with mock.patch.object(planner, "estimate_features", return_value=estimate) as estimate_features, \
+                mock.patch.object(conf, "OVERTUREMAPS_VIEWPORT_SIZE", 1024), \
+                mock.patch.object(conf, "OVERTUREMAPS_FEATURE_SOURCE", "auto"), \
+                mock.patch.object(conf, "OVERTUREMAPS_PLANNER_MAX_POSTGIS_FEATURES", 50000), \
+                mock.patch.object(conf, "OVERTUREMAPS_PLANNER_MAX_FEATURES", 500000), \
+                mock.patch.object(conf, "OVERTUREMAPS_PLANNER_MIN_POSTGIS_ZOOM", 12), \
+                mock.patch.object(conf, "OVERTUREMAPS_PLANNER_MIN_PMTILES_ZOOM", 8), \
+                mock.patch.object(conf, "OVERTUREMAPS_PLANNER_HUGE", planner.REFUSE):
+            plan = planner.plan_request(bbox, **kwargs)
+        self.estimated = estimate_features.called
+        return plan
+
+    def test_neighbourhood(self):
+        # ~5 km, zoom 14
+        plan = self.plan((-58.40, -34.62, -58.35, -34.58))
+        self.assertEqual((plan.route, plan.zoom), (planner.POSTGIS, 14))
+
+    def test_city(self):
+        # 1 degree, zoom 10: too large for PostGIS at zoom 12
+        plan = self.plan((-59.0, -35.0, -58.0, -34.0))
+        self.assertEqual((plan.route, plan.zoom), (planner.PMTILES, 10))
+        # served from PMTiles whatever its size
+        self.assertFalse(self.estimated)
+
+        # other formats can't be generalized, PostGIS serves them up to the hard limit
+        plan = self.plan((-59.0, -35.0, -58.0, -34.0), estimate=200000, geojson=False)
+        self.assertEqual(plan.route, planner.POSTGIS)
+        plan = self.plan((-59.0, -35.0, -58.0, -34.0), estimate=600000, geojson=False)
+        self.assertEqual(plan.route, planner.REFUSE)
+
+    def test_country(self):
+        # 10 degrees, zoom 6
+        plan = self.plan((-65.0, -40.0, -55.0, -30.0))
+        self.assertEqual((plan.route, plan.zoom, plan.estimate), (planner.REFUSE, 6, 1000))
+
+    def test_source(self):
+        plan = self.plan((-65.0, -40.0, -55.0, -30.0), source="pmtiles")
+        self.assertEqual(plan.route, planner.PMTILES)
+        self.assertFalse(self.estimated)
+        # within the hard limit
+        plan = self.plan((-65.0, -40.0, -55.0, -30.0), source="postgis")
+        self.assertEqual(plan.route, planner.POSTGIS)
+        plan = self.plan((-65.0, -40.0, -55.0, -30.0), estimate=600000, source="postgis")
+        self.assertEqual(plan.route, planner.REFUSE)
+
+    def test_too_many_features(self):
+        plan = self.plan((-58.40, -34.62, -58.35, -34.58), estimate=10 ** 6)
+        self.assertEqual(plan.route, planner.PMTILES)
+
+
+@mock.patch.object(conf, "OVERTUREMAPS_LOD1_ZOOM", 14)
+@mock.patch.object(conf, "OVERTUREMAPS_LOD2_ZOOM", 13)
+@mock.patch.object(conf, "OVERTUREMAPS_VIEWPORT_SIZE", 1024)
+class LevelOfDetailTest(SimpleTestCase):
+
+    def get_lod(self, bbox, **params):
+        view = OverturemapsWFSView()
+        view.KVP = params
+        return view.get_lod(bbox)
+
+    def test_bbox(self):
+        # a map of 4x4 tiles shows a tile at 2 zoom levels above it
+        self.assertEqual(self.get_lod(tile_bounds(2700, 4900, 13)), 0)
+        self.assertEqual(self.get_lod(tile_bounds(1350, 2450, 12)), 1)
+        self.assertEqual(self.get_lod(tile_bounds(675, 1225, 11)), 2)
+        self.assertEqual(self.get_lod(tile_bounds(300, 600, 10)), 2)
+
+    def test_parameter(self):
+        self.assertEqual(self.get_lod(tile_bounds(300, 600, 10), LOD="0"), 0)
+        with self.assertRaises(InvalidParameterValue):
+            self.get_lod(None, LOD="3")
+
+    def test_tiles(self):
+        self.assertEqual(tile_geometry_column(15), "geometry")
+        self.assertEqual(tile_geometry_column(14), "geometry_lod1")
+        self.assertEqual(tile_geometry_column(13), "geometry_lod2")
+        self.assertEqual(tile_geometry_column(12), "geometry_lod2")
+
+
+def render_features(renderer_class, feature_type, output_crs):
+    """The features of the feature type as the GML or GeoJSON renderer writes them, by primary key."""
+    view = SimpleNamespace(server_url="http://testserver/wfs/", xml_namespace="http://example.com/wfsserver")
+    renderer = renderer_class(SimpleNamespace(view=view), None, None, output_crs)
+    queryset = renderer_class.decorate_queryset(feature_type, feature_type.get_queryset(), output_crs)
+    if isinstance(renderer, DBFeatureRenderingMixin):
+        renderer.get_merged_parts(SimpleNamespace(feature_type=feature_type, queryset=queryset))
+    features = {}
+    for instance in queryset:
+        if isinstance(renderer, DBGML32Renderer):
+            renderer.output = StringIO()
+            renderer._write = renderer.output.write
+            renderer.gml_seq = 0
+            renderer.write_feature(feature_type, instance)
+            features[instance.pk] = renderer.output.getvalue()
+        else:
+            features[instance.pk] = renderer.render_feature(feature_type, instance).decode()
+    return features
+
+
+def create_buildings():
+    """Buildings with the values that are hard to write exactly like Python does."""
+    values = [
+        # height, roof_direction: plain, exponent and boundary floats
+        (12.5, None), (1e-5, 0.0), (1.5e16, -2.5e-7), (1e15, 1e-4), (None, 3.0), (9.5e-5, -0.0),
+    ]
+    for i, (height, roof_direction) in enumerate(values):
+        OverturemapsBuildingModel.objects.create(
+            geo_id=f"08b<{i}>&",
+            version=1,
+            update_time=datetime(2024, 5, 16, 10, 30, i, i * 1000, tzinfo=timezone.utc),
+            has_parts=bool(i % 2),
+            sources=[{"dataset": "OpenStreetMap", "record_id": f"w{i}", "confidence": None}],
+            geometry=MultiPolygon(Polygon.from_bbox((-58.38 + i * 0.001, -34.61, -58.3795 + i * 0.001, -34.6095))),
+            subtype="residential" if i else None,
+            classtype='house "A" & <B>',
+            num_floors=i or None,
+            height=height,
+            roof_direction=roof_direction,
+            roof_material="tile",
+        )
+
+
+class DBFeatureRenderingTest(TestCase):
+    """The features written by the database are the ones of the gisserver renderers."""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_buildings()
+
+    def assertSameFeatures(self, renderer_class, db_renderer_class):
+        feature_type = get_buildings_feature_type()
+        for srid in (4326, 3857):
+            output_crs = CRS.from_srid(srid)
+            expected = render_features(renderer_class, feature_type, output_crs)
+            self.assertEqual(len(expected), 6)
+            self.assertEqual(render_features(db_renderer_class, feature_type, output_crs), expected)
+
+    @mock.patch.object(conf, "OVERTUREMAPS_FEATURE_FRAGMENTS", False)
+    def test_geojson(self):
+        self.assertSameFeatures(DBGeoJsonRenderer, DBFeatureGeoJsonRenderer)
+
+    @mock.patch.object(conf, "OVERTUREMAPS_FEATURE_FRAGMENTS", False)
+    def test_gml(self):
+        self.assertSameFeatures(DBGML32Renderer, DBFeatureGML32Renderer)
+
+
+@mock.patch.object(conf, "OVERTUREMAPS_FEATURE_FRAGMENTS", True)
+@mock.patch.object(conf, "OVERTUREMAPS_FEATURE_SOURCE", "postgis")
+class BinaryOutputTest(TestCase):
+    params = {
+        "SERVICE": "WFS", "VERSION": "2.0.0", "REQUEST": "GetFeature",
+        "TYPENAMES": "overturemapsbuildingmodel", "BBOX": "-58.381,-34.611,-58.373,-34.609",
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        create_buildings()
+
+    def get_content(self, output_format, **params):
+        response = self.client.get("/wfs/overturemaps/", {**self.params, "OUTPUTFORMAT": output_format, **params})
+        self.assertEqual(response.status_code, 200)
+        return BytesIO(response.getvalue())
+
+    def assert_table(self, table):
+        self.assertEqual(table.num_rows, OverturemapsBuildingModel.objects.count())
+        self.assertEqual(table.schema.field("height").type, pa.float64())
+        self.assertEqual(table.schema.field("num_floors").type, pa.int32())
+        self.assertEqual(table.schema.field("update_time").type, pa.timestamp("us", tz="UTC"))
+        # JSON fields are strings
+        self.assertEqual(table.schema.field("sources").type, pa.string())
+        geometries = shapely.from_wkb(table.column("geometry").to_numpy(zero_copy_only=False))
+        self.assertTrue(all(geometry.geom_type == "MultiPolygon" for geometry in geometries))
+        heights = dict(OverturemapsBuildingModel.objects.values_list("geo_id", "height"))
+        self.assertEqual(
+            dict(zip(table.column("geo_id").to_pylist(), table.column("height").to_pylist())), heights
+        )
+
+    def test_arrow(self):
+        table = pa.ipc.open_stream(self.get_content("arrow")).read_all()
+        self.assert_table(table)
+        self.assertEqual(table.schema.field("geometry").metadata[b"ARROW:extension:name"], b"geoarrow.wkb")
+
+    def test_geoparquet(self):
+        table = pq.read_table(self.get_content("geoparquet"))
+        self.assert_table(table)
+        geo = json.loads(table.schema.metadata[b"geo"])
+        self.assertEqual(geo["primary_column"], "geometry")
+        self.assertEqual(geo["columns"]["geometry"]["geometry_types"], ["MultiPolygon"])
+        self.assertNotIn("crs", geo["columns"]["geometry"])
+
+        table = pq.read_table(self.get_content("geoparquet", SRSNAME="EPSG:3857"))
+        geo = json.loads(table.schema.metadata[b"geo"])
+        self.assertEqual(geo["columns"]["geometry"]["crs"]["id"]["code"], 3857)
+
+    def test_flatgeobuf(self):
+        frame = geopandas.read_file(self.get_content("flatgeobuf"), engine="pyogrio")
+        self.assertEqual(len(frame), OverturemapsBuildingModel.objects.count())
+        self.assertEqual(frame.crs.to_epsg(), 4326)
+        self.assertEqual(
+            sorted(frame["geo_id"]), sorted(OverturemapsBuildingModel.objects.values_list("geo_id", flat=True))
+        )
+
+    def test_flatgeobuf_page_size(self):
+        with mock.patch.object(conf, "OVERTUREMAPS_FLATGEOBUF_MAX_PAGE_SIZE", 2):
+            frame = geopandas.read_file(self.get_content("flatgeobuf"), engine="pyogrio")
+            self.assertEqual(len(frame), 2)
+            frame = geopandas.read_file(self.get_content("flatgeobuf", COUNT="100"), engine="pyogrio")
+            self.assertEqual(len(frame), 2)
+
+
+@mock.patch.object(conf, "OVERTUREMAPS_LOD1_ZOOM", 14)
+@mock.patch.object(conf, "OVERTUREMAPS_LOD2_ZOOM", 13)
+@mock.patch.object(conf, "OVERTUREMAPS_TILES_MIN_ZOOM", 13)
+class BuildingTileTest(TestCase):
+    # the tiles of the buildings of create_buildings at zoom 15 and 13
+    tile = (15, 11070, 19745)
+    lod2_tile = (13, 2767, 4936)
+
+    @classmethod
+    def setUpTestData(cls):
+        create_buildings()
+
+    def setUp(self):
+        cache.get_response_cache().cache.clear()
+
+    def decode(self, data):
+        return mapbox_vector_tile.decode(data)["buildings"]["features"]
+
+    def test_render_tile(self):
+        features = self.decode(render_tile(*self.tile))
+        self.assertEqual(
+            sorted(feature["properties"]["geo_id"] for feature in features),
+            sorted(OverturemapsBuildingModel.objects.values_list("geo_id", flat=True)),
+        )
+        heights = {feature["properties"].get("height") for feature in features}
+        self.assertEqual(heights - {None}, {12.5, 1e-5, 1.5e16, 1e15, 9.5e-5})
+
+    def test_level_of_detail(self):
+        # only the buildings with a simplified geometry are in the zoomed-out tiles
+        building = OverturemapsBuildingModel.objects.first()
+        OverturemapsBuildingModel.objects.filter(pk=building.pk).update(geometry_lod2=F("geometry"))
+        features = self.decode(render_tile(*self.lod2_tile))
+        self.assertEqual([feature["properties"]["geo_id"] for feature in features], [building.geo_id])
+        self.assertEqual(render_tile(14, 5535, 9872), b"")
+
+    def test_etag(self):
+        url = "/tiles/{}/{}/{}.mvt".format(*self.tile)
+        with mock.patch.object(views, "get_tile_version", return_value="v1"):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual((response["ETag"], response["X-Cache"]), ('"v1"', "MISS"))
+            self.assertEqual(len(self.decode(response.content)), OverturemapsBuildingModel.objects.count())
+
+            response = self.client.get(url, HTTP_IF_NONE_MATCH='"v1"')
+            self.assertEqual(response.status_code, 304)
+
+            cached = self.client.get(url)
+            self.assertEqual((cached.status_code, cached["X-Cache"]), (200, "HIT"))
+
+        with mock.patch.object(views, "get_tile_version", return_value="v2"):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH='"v1"')
+            self.assertEqual((response.status_code, response["ETag"]), (200, '"v2"'))
+
+    @mock.patch.object(conf, "OVERTUREMAPS_INGESTION_MODE", "background")
+    def test_pending(self):
+        response = self.client.get("/tiles/{}/{}/{}.mvt".format(*self.tile))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Ingestion"], "pending")
+        self.assertEqual(response["Cache-Control"], "no-store")
+        self.assertFalse(response.has_header("ETag"))
+        self.assertTrue(IngestionJobModel.objects.exists())
+
+    def test_out_of_range(self):
+        self.assertEqual(self.client.get("/tiles/2/4/0.mvt").status_code, 404)
+        response = self.client.get("/tiles/5/1/1.mvt")
+        self.assertEqual((response.status_code, response.content), (200, b""))
+
+
+class FeatureFragmentsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_buildings()
+
+    def setUp(self):
+        self.feature_type = get_buildings_feature_type()
+        store_fragments(self.feature_type, OverturemapsBuildingModel.objects.values_list("pk", flat=True))
+
+    def test_stored(self):
+        for column in OverturemapsBuildingModel.fragment_fields.values():
+            self.assertFalse(OverturemapsBuildingModel.objects.filter(**{f"{column}__isnull": True}).exists())
+
+    def test_spliced(self):
+        for renderer_class, db_renderer_class in [
+            (DBGeoJsonRenderer, DBFeatureGeoJsonRenderer), (DBGML32Renderer, DBFeatureGML32Renderer),
+        ]:
+            for srid in (4326, 3857):
+                output_crs = CRS.from_srid(srid)
+                self.assertEqual(
+                    render_features(db_renderer_class, self.feature_type, output_crs),
+                    render_features(renderer_class, self.feature_type, output_crs),
+                )
+
+    def test_fragment_is_written(self):
+        building = OverturemapsBuildingModel.objects.first()
+        OverturemapsBuildingModel.objects.filter(pk=building.pk).update(geojson_4326="fragment")
+        features = render_features(DBFeatureGeoJsonRenderer, self.feature_type, CRS.from_srid(4326))
+        self.assertEqual(features[building.pk], "fragment")
+
+    def test_new_version(self):
+        building = OverturemapsBuildingModel.objects.first()
+        batch = pa.RecordBatch.from_pydict({
+            "id": [building.geo_id],
+            "version": [building.version + 1],
+            "update_time": ["2024-07-22T00:00:00Z"],
+            "has_parts": [False],
+            "geometry": [shapely.to_wkb(shapely.box(-58.38, -34.61, -58.3795, -34.6095))],
+        })
+        upsert_buildings(OverturemapsBuildingModel, batch_to_rows(batch))
+        building.refresh_from_db()
+        for column in OverturemapsBuildingModel.fragment_fields.values():
+            self.assertIsNone(getattr(building, column))
+
+
+class UpsertBuildingsTest(TestCase):
+
+    def upsert(self, *buildings):
+        """Upsert the (geo_id, version, has_parts) buildings, as read from Overture maps."""
+        batch = pa.RecordBatch.from_pydict({
+            "id": [geo_id for geo_id, _, _ in buildings],
+            "version": [version for _, version, _ in buildings],
+            "update_time": ["2024-07-22T00:00:00Z"] * len(buildings),
+            "has_parts": [has_parts for _, _, has_parts in buildings],
+            "geometry": [
+                shapely.to_wkb(shapely.box(-58.38 + i * 0.001, -34.61, -58.3795 + i * 0.001, -34.6095))
+                for i in range(len(buildings))
+            ],
+        })
+        return upsert_buildings(OverturemapsBuildingModel, batch_to_rows(batch))
+
+    def test_insert(self):
+        ids, extent = self.upsert(("a", 1, False), ("b", 1, False))
+        self.assertEqual(len(ids), 2)
+        np.testing.assert_allclose(extent, (-58.38, -34.61, -58.3785, -34.6095))
+        building = OverturemapsBuildingModel.objects.get(geo_id="a")
+        self.assertIsNotNone(building.geometry_lod1)
+        self.assertIsNotNone(building.tile_x)
+
+    def test_same_version(self):
+        self.upsert(("a", 1, False), ("b", 1, False))
+        # not rewritten, even when a value differs
+        self.assertEqual(self.upsert(("a", 1, True), ("b", 1, True)), ([], None))
+        self.assertFalse(OverturemapsBuildingModel.objects.filter(has_parts=True).exists())
+
+    def test_new_version(self):
+        self.upsert(("a", 1, False), ("b", 1, False))
+        ids, extent = self.upsert(("a", 2, True), ("b", 1, True))
+        self.assertEqual(ids, [OverturemapsBuildingModel.objects.get(geo_id="a").pk])
+        self.assertEqual(
+            dict(OverturemapsBuildingModel.objects.values_list("geo_id", "has_parts")), {"a": True, "b": False}
+        )
+
+    def test_duplicates(self):
+        # the same building read twice in a batch (e.g. from overlapping row groups)
+        ids, extent = self.upsert(("a", 1, False), ("a", 1, False))
+        self.assertEqual(len(ids), 1)
+        self.assertEqual(OverturemapsBuildingModel.objects.count(), 1)
+
+
+class IngestionJobTest(TestCase):
+
+    def create_jobs(self, count):
+        jobs = [IngestionJobModel.enqueue(-58.38, -34.61 + i * 0.01, -58.37, -34.6 + i * 0.01) for i in range(count)]
+        for age, job in enumerate(reversed(jobs)):
+            # created in order, oldest first
+            IngestionJobModel.objects.filter(pk=job.pk).update(created=job.created - timedelta(minutes=age))
+        return jobs
+
+    def test_enqueue(self):
+        job = IngestionJobModel.enqueue(-58.38, -34.61, -58.37, -34.6)
+        self.assertEqual(IngestionJobModel.enqueue(-58.38, -34.61, -58.37, -34.6), job)
+
+    def test_claim_next(self):
+        first, second = self.create_jobs(2)
+        job = IngestionJobModel.claim_next()
+        self.assertEqual(job, first)
+        self.assertEqual((job.status, job.attempts), (IngestionJobModel.RUNNING, 1))
+        self.assertIsNotNone(job.started)
+        self.assertEqual(IngestionJobModel.claim_next(), second)
+        self.assertIsNone(IngestionJobModel.claim_next())
+
+    def test_requeue_stale(self):
+        stale, running = self.create_jobs(2)
+        IngestionJobModel.claim_next()
+        IngestionJobModel.claim_next()
+        IngestionJobModel.objects.filter(pk=stale.pk).update(started=datetime.now(timezone.utc) - timedelta(hours=2))
+        self.assertEqual(IngestionJobModel.requeue_stale(3600), 1)
+        stale.refresh_from_db()
+        running.refresh_from_db()
+        self.assertEqual(stale.status, IngestionJobModel.PENDING)
+        self.assertEqual(running.status, IngestionJobModel.RUNNING)
+        # claimed again, on its second attempt
+        job = IngestionJobModel.claim_next()
+        self.assertEqual((job, job.attempts), (stale, 2))
+
+    def test_mark_failed(self):
+        self.create_jobs(1)
+        job = IngestionJobModel.claim_next()
+        job.mark_failed("timeout", max_attempts=2)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), (IngestionJobModel.PENDING, "timeout"))
+
+        job = IngestionJobModel.claim_next()
+        job.mark_failed("timeout again", max_attempts=2)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), (IngestionJobModel.FAILED, "timeout again"))
+        self.assertIsNone(IngestionJobModel.claim_next())
+
+
+@mock.patch.object(conf, "OVERTUREMAPS_INGESTION_MODE", "background")
+@mock.patch.object(conf, "OVERTUREMAPS_FEATURE_SOURCE", "postgis")
+class PendingResponseTest(TestCase):
+    params = {
+        "SERVICE": "WFS", "VERSION": "2.0.0", "REQUEST": "GetFeature",
+        "TYPENAMES": "overturemapsbuildingmodel", "BBOX": "-58.38,-34.61,-58.37,-34.6", "OUTPUTFORMAT": "geojson",
+    }
+
+    @mock.patch.object(conf, "OVERTUREMAPS_PENDING_RESPONSE", "pending")
+    @mock.patch.object(conf, "OVERTUREMAPS_PENDING_RETRY_AFTER", 5)
+    def test_pending(self):
+        response = self.client.get("/wfs/overturemaps/", self.params)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response["Retry-After"], "5")
+        self.assertTrue(IngestionJobModel.objects.filter(status=IngestionJobModel.PENDING).exists())
+
+        # the same jobs are reused
+        jobs = IngestionJobModel.objects.count()
+        self.assertEqual(self.client.get("/wfs/overturemaps/", self.params).status_code, 202)
+        self.assertEqual(IngestionJobModel.objects.count(), jobs)
+
+    @mock.patch.object(conf, "OVERTUREMAPS_PENDING_RESPONSE", "cached")
+    def test_cached(self):
+        response = self.client.get("/wfs/overturemaps/", self.params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(IngestionJobModel.objects.filter(status=IngestionJobModel.PENDING).exists())
+        # partial, neither cached nor validated
+        self.assertEqual(response["X-Ingestion"], "pending")
+        self.assertEqual(response["Cache-Control"], "no-store")
+        self.assertFalse(response.has_header("ETag"))
 
-# Create your tests here.
@@ -0,0 +1,104 @@
+import math
+
+# Latitude limits of the Web Mercator tile grid
+MAX_LATITUDE = 85.0511287798066
+# Keeps bboxes aligned to tile edges from spilling into the neighbour tiles
+EPSILON = 1e-9
+
+def lonlat_to_tile(lon, lat, zoom):
+    """Return the (x, y) of the tile containing the point."""
+    n = 2 ** zoom
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return (max(0, min(n - 1, x)), max(0, min(n - 1, y)))
+
+def tile_bounds(x, y, zoom):
+    """Return the (min_x, min_y, max_x, max_y) of a tile in EPSG:4326."""
+    n = 2 ** zoom
+    min_x = x / n * 360.0 - 180.0
+    max_x = (x + 1) / n * 360.0 - 180.0
+    max_y = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    min_y = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return (min_x, min_y, max_x, max_y)
+
+def tile_range(bbox, zoom):
+    """Return the (min_x, min_y, max_x, max_y) tile numbers covering the bbox.
+    Note that tile rows grow southwards, so min_y is the northern row.
+    """
+    min_x, min_y, max_x, max_y = bbox
+    tile_min_x, tile_min_y = lonlat_to_tile(min_x + EPSILON, max_y - EPSILON, zoom)
+    tile_max_x, tile_max_y = lonlat_to_tile(max_x - EPSILON, min_y + EPSILON, zoom)
+    return (tile_min_x, tile_min_y, tile_max_x, tile_max_y)
+
+def tiles_for_bbox(bbox, zoom):
+    """Iterate over the (x, y) of all tiles covering the bbox."""
+    tile_min_x, tile_min_y, tile_max_x, tile_max_y = tile_range(bbox, zoom)
+    for y in range(tile_min_y, tile_max_y + 1):
+        for x in range(tile_min_x, tile_max_x + 1):
+            yield (x, y)
+
+def split_bbox(bbox, zoom):
+    """Split the bbox along the tile edges, returning the parts as bboxes."""
+    min_x, min_y, max_x, max_y = bbox
+    parts = []
+    for x, y in tiles_for_bbox(bbox, zoom):
+        tile_min_x, tile_min_y, tile_max_x, tile_max_y = tile_bounds(x, y, zoom)
+        parts.append((
+            max(min_x, tile_min_x), max(min_y, tile_min_y),
+            min(max_x, tile_max_x), min(max_y, tile_max_y),
+        ))
+    return parts
+
+def quadkey(x, y, zoom):
+    digits = []
+    for i in range(zoom, 0, -1):
+        mask = 1 << (i - 1)
+        digit = (1 if x & mask else 0) + (2 if y & mask else 0)
+        digits.append(str(digit))
+    return "".join(digits)
+
+def merge_tiles(tiles, zoom):
+    """
+    Merge a set of (x, y) tiles into a few rectangular bboxes: consecutive
+    tiles of a row become a run, and identical runs of consecutive rows
+    become a single rectangle
+    """
+    rows = {}
+    for x, y in tiles:
+        rows.setdefault(y, []).append(x)
+
+    # (x_start, x_end) -> [y_start, y_end] of the rectangle being grown
+    open_rects = {}
+    rects = []
+    for y in sorted(rows):
+        runs = []
+        xs = sorted(rows[y])
+        start = prev = xs[0]
+        for x in xs[1:]:
+            if x != prev + 1:
+                runs.append((start, prev))
+                start = x
+            prev = x
+        runs.append((start, prev))
+
+        next_rects = {}
+        for run in runs:
+            rect = open_rects.pop(run, None)
+            if rect is not None and rect[1] == y - 1:
+                rect[1] = y
+            else:
+                if rect is not None:
+                    rects.append((run, rect))
+                rect = [y, y]
+            next_rects[run] = rect
+        rects.extend(open_rects.items())
+        open_rects = next_rects
+    rects.extend(open_rects.items())
+
+    bboxes = []
+    for (x_start, x_end), (y_start, y_end) in rects:
+        min_x, _, _, max_y = tile_bounds(x_start, y_start, zoom)
+        _, min_y, max_x, _ = tile_bounds(x_end, y_end, zoom)
+        bboxes.append((min_x, min_y, max_x, max_y))
+    return bboxes
@@ -1,15 +1,59 @@
 import logging
+import math
 import xml.etree.ElementTree as ET
 from gisserver.geometries import CRS
 
+from . import conf
+from .tiles import EPSILON, MAX_LATITUDE
+
 RD_NEW = CRS.from_srid(3857)
 
+# Size in pixels of the tiles of the Web Mercator zoom levels
+TILE_SIZE = 256
+
 logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s',
     level=logging.DEBUG
 )
 logger = logging.getLogger(__name__)
 
+def _mercator_y(lat):
+    """The Web Mercator y of the latitude, in radians (the world is 2 * pi high)."""
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    return math.asinh(math.tan(math.radians(lat)))
+
+def calculate_zoom_level(bbox, viewport_size=None, max_zoom=22):
+    """
+    The Web Mercator zoom level (of 256 px tiles, as the XYZ tile zooms) at
+    which the bbox fills a map of viewport_size pixels (by default
+    OVERTUREMAPS_VIEWPORT_SIZE), i.e. the zoom a client displaying it is at.
+    """
+    min_lon, min_lat, max_lon, max_lat = bbox
+    tiles = (viewport_size or conf.OVERTUREMAPS_VIEWPORT_SIZE) / TILE_SIZE
+
+    zooms = []
+    width = max_lon - min_lon
+    if width > 0:
+        zooms.append(math.log2(360 / width * tiles))
+    height = _mercator_y(max_lat) - _mercator_y(min_lat)
+    if height > 0:
+        zooms.append(math.log2(2 * math.pi / height * tiles))
+    if not zooms:
+        return max_zoom
+    # the epsilon keeps a bbox of exactly a tile at the zoom of the tile
+    return max(0, min(max_zoom, math.floor(min(zooms) + EPSILON)))
+
+def get_zoom_lod(zoom):
+    """
+    The level of detail of the geometries served at a Web Mercator zoom
+    level: the zoom of a bbox (see calculate_zoom_level) or of a tile.
+    """
+    if zoom <= conf.OVERTUREMAPS_LOD2_ZOOM:
+        return 2
+    if zoom <= conf.OVERTUREMAPS_LOD1_ZOOM:
+        return 1
+    return 0
+
 class BoundingBoxExtractor:
         
     def get_bbox_from_filter(self, xml_content):
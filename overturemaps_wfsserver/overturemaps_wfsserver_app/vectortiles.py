@@ -0,0 +1,57 @@
+from django.db import connection
+
+from .models import OverturemapsBuildingModel
+from .tiles import tile_bounds
+from .utils import get_zoom_lod
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+MVT_CONTENT_TYPE = "application/vnd.mapbox-vector-tile"
+
+# Name of the layer of the building tiles
+LAYER = "buildings"
+
+# Tile coordinates extent and buffer (in tile coordinates), as ST_AsMVTGeom defaults
+EXTENT = 4096
+BUFFER = 64
+
+# Attributes of the buildings in the tiles (the 3D viewer extrudes height)
+ATTRIBUTES = ("geo_id", "height", "num_floors", "subtype", "classtype", "roof_shape")
+
+# The geometry column of each level of detail
+LOD_COLUMNS = {
+    0: "geometry",
+    1: "geometry_lod1",
+    2: "geometry_lod2",
+}
+
+def tile_geometry_column(z):
+    """The (simplified) geometry column read for tiles of zoom z, as GetFeature of a bbox of that zoom."""
+    return LOD_COLUMNS[get_zoom_lod(z)]
+
+def render_tile(z, x, y):
+    """Return the buildings of the tile z/x/y as a Mapbox vector tile, built by PostGIS."""
+    min_x, min_y, max_x, max_y = tile_bounds(x, y, z)
+    # the filter includes the tile buffer, as ST_AsMVTGeom clips to it
+    margin_x = (max_x - min_x) * BUFFER / EXTENT
+    margin_y = (max_y - min_y) * BUFFER / EXTENT
+    table = connection.ops.quote_name(OverturemapsBuildingModel._meta.db_table)
+    column = tile_geometry_column(z)
+    attributes = ", ".join(f"t.{name}" for name in ATTRIBUTES)
+    sql = (
+        f"SELECT ST_AsMVT(tile.*, %s, %s, 'geom') FROM ("
+        f"SELECT ST_AsMVTGeom(ST_Transform(t.{column}, 3857), ST_TileEnvelope(%s, %s, %s), %s, %s, true) AS geom, "
+        f"{attributes} "
+        f"FROM {table} t "
+        f"WHERE t.{column} && ST_MakeEnvelope(%s, %s, %s, %s, 4326)"
+        f") AS tile WHERE tile.geom IS NOT NULL"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [
+            LAYER, EXTENT, z, x, y, EXTENT, BUFFER,
+            min_x - margin_x, min_y - margin_y, max_x + margin_x, max_y + margin_y,
+        ])
+        data = cursor.fetchone()[0]
+    return bytes(data) if data is not None else b""
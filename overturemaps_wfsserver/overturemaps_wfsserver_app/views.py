@@ -1,14 +1,23 @@
+import json
 import logging
 
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import render
 from django.templatetags.static import static
+from django.views import View
+from gisserver.exceptions import InvalidParameterValue
 from gisserver.features import ServiceDescription
-from gisserver.geometries import CRS 
 from gisserver.views import WFSView
-from .models import OverturemapsBuildingModel, OverturemapsBuildingFeatureType
-from .utils import BoundingBoxExtractor
-
-RD_NEW = CRS.from_srid(3857)
+from . import conf, planner
+from .operations import HITS_ESTIMATED, HITS_EXACT, GetFeature
+from .cache import (
+    get_cached_response, get_last_modified, get_request_version, get_response_cache, get_tile_version, set_validators,
+)
+from .models import LOD_MODELS, IngestionContext, get_buildings_feature_type
+from .pmtilessource import TooManyTilesError, get_pmtiles_source
+from .tiles import tile_bounds
+from .utils import BoundingBoxExtractor, calculate_zoom_level, get_zoom_lod
+from .vectortiles import MVT_CONTENT_TYPE, render_tile
 
 logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s',
@@ -20,6 +29,13 @@ class OverturemapsWFSView(WFSView):
 
     xml_namespace = "http://geotekne.com.ar/wfsserver"
 
+    accept_operations = {
+        "WFS": {
+            **WFSView.accept_operations["WFS"],
+            "GetFeature": GetFeature,
+        },
+    }
+
     service_description = ServiceDescription(
         title="Overturemaps",
         abstract="Unittesting",
@@ -29,17 +45,50 @@ class OverturemapsWFSView(WFSView):
         contact_person="Jose Macchi",
     )
 
-    buildings_ft = OverturemapsBuildingFeatureType(OverturemapsBuildingModel.objects.all(),fields="__all__",other_crs=[RD_NEW])
-    
-    feature_types = [
-        buildings_ft,
-    ]
-    
+    # The bbox of a plain BBOX GetFeature, whose numberMatched is counted from the coverage cells
+    count_bbox = None
+    hits_mode = HITS_EXACT
+
+    def get_buildings_feature_type(self, context=None, lod=0):
+        # The simplified levels of detail are other models, but the same feature type
+        return get_buildings_feature_type(LOD_MODELS[lod], context)
+
+    def get_lod(self, bbox):
+        """The level of detail of the geometries: the LOD parameter, else by the zoom level of the bbox."""
+        lod = self.KVP.get("LOD")
+        if lod is not None:
+            if lod not in ("0", "1", "2"):
+                raise InvalidParameterValue("lod", "LOD must be 0 (full detail), 1 or 2 (most simplified)")
+            return int(lod)
+        if bbox is None:
+            return 0
+        return get_zoom_lod(calculate_zoom_level(bbox))
+
+    def get_count_bbox(self, bbox):
+        """The bbox when it is the only filter of the request (in lon/lat), else None."""
+        bbox_param = self.KVP.get("BBOX")
+        if bbox_param is None or len(bbox_param.split(",")) != 4:
+            return None
+        if any(self.KVP.get(name) for name in ("FILTER", "RESOURCEID", "STOREDQUERY_ID")):
+            return None
+        return bbox
+
+    def get_hits_mode(self):
+        """How numberMatched is counted: the HITS parameter, else OVERTUREMAPS_HITS."""
+        hits_mode = self.KVP.get("HITS", conf.OVERTUREMAPS_HITS).lower()
+        if hits_mode not in (HITS_EXACT, HITS_ESTIMATED):
+            raise InvalidParameterValue("hits", "HITS must be exact or estimated")
+        return hits_mode
+
     def get(self, request, *args, **kwargs):
         logger.debug('Get call entrypoint')
         # Convert to WFS key-value-pair format.
         self.KVP = {key.upper(): value for key, value in request.GET.items()}
         req = self.KVP.get("REQUEST")
+        context = None
+        lod = 0
+        response_cache = get_response_cache()
+        version = None
         if req == "GetFeature":
             bbox = None
             extractor = BoundingBoxExtractor()
@@ -52,10 +101,165 @@ class OverturemapsWFSView(WFSView):
             if filter_param is None and bbox_param is not None:
                 # then extract BBOX from bbox_param
                 bbox = extractor.get_bbox_from_param(bbox_param)
-            # update BBOX on FeatureTypes
             if bbox is not None:
                 logger.debug('BBOX %s',str(bbox))
-                self.buildings_ft.set_data(bbox)
+                context = IngestionContext(bbox)
+                plan = planner.plan_request(bbox, self.KVP.get("SOURCE"), geojson=self.is_geojson_output())
+                if plan.route != planner.POSTGIS:
+                    response = self.render_plan(bbox, plan)
+                    response["X-Overturemaps-Plan"] = plan.route
+                    return response
+                lod = self.get_lod(bbox)
+                logger.debug('Level of detail %s', lod)
+                self.count_bbox = self.get_count_bbox(bbox)
+                self.hits_mode = self.get_hits_mode()
+                version = get_request_version(self.KVP, bbox, self.server_url)
+                if version is not None:
+                    response = get_cached_response(
+                        request, version, get_last_modified(bbox), response_cache, conf.OVERTUREMAPS_CACHE_CONTROL
+                    )
+                    if response is not None:
+                        return response
+        # FeatureTypes are built for each request (the view instance is per request too),
+        # so overlapping requests never share their BBOX
+        buildings_ft = self.get_buildings_feature_type(context, lod)
+        self.feature_types = [
+            buildings_ft,
+        ]
+        contained = True
+        if context is not None:
+            contained = buildings_ft.set_data(context)
+            if not contained and conf.OVERTUREMAPS_PENDING_RESPONSE == "pending":
+                return self.render_pending()
+            if version is None and contained:
+                # ingested by this request
+                version = get_request_version(self.KVP, context.bbox, self.server_url)
         # then call the get in super
         ret = super().get(request,args,kwargs)
+        if not contained:
+            # partial, only what was already ingested
+            set_pending_headers(ret)
+        elif version is not None and ret.status_code == 200:
+            set_validators(ret, version, get_last_modified(context.bbox), conf.OVERTUREMAPS_CACHE_CONTROL)
+            if response_cache is not None:
+                ret = response_cache.set(version, ret)
         return ret
+
+    def is_geojson_output(self):
+        output_format = self.KVP.get("OUTPUTFORMAT", "").lower()
+        return output_format in ("geojson", "json", "application/json", "application/geo+json")
+
+    def render_plan(self, bbox, plan):
+        """Answer a GetFeature the planner didn't send to PostGIS."""
+        if plan.route == planner.PMTILES:
+            try:
+                return self.render_pmtiles(bbox, plan)
+            except TooManyTilesError:
+                plan.route = conf.OVERTUREMAPS_PLANNER_HUGE if self.is_geojson_output() else planner.REFUSE
+                plan.reason = "too many PMTiles tiles"
+                logger.info('Plan for BBOX %s changed to %s', bbox, plan)
+        if plan.route == planner.SUMMARY:
+            return self.render_summary(bbox, plan)
+        raise InvalidParameterValue(
+            "bbox",
+            f"The requested area holds about {plan.estimate} buildings, which is too much to return. "
+            f"Zoom in, or request GeoJSON for a generalized version.",
+        )
+
+    def render_pmtiles(self, bbox, plan):
+        """Answer the GetFeature from the PMTiles archive, without ingestion."""
+        if not self.is_geojson_output():
+            raise InvalidParameterValue("outputFormat", "The pmtiles source only supports GeoJSON output")
+        count = self.KVP.get("COUNT")
+        geojson = get_pmtiles_source().get_geojson(bbox, max_zoom=plan.zoom, count=int(count) if count else None)
+        return HttpResponse(geojson, content_type="application/geo+json; charset=utf-8")
+
+    def render_summary(self, bbox, plan):
+        """A single feature of the bbox telling how many buildings it holds."""
+        min_x, min_y, max_x, max_y = bbox
+        summary = {
+            "type": "FeatureCollection",
+            "numberReturned": 1,
+            "features": [{
+                "type": "Feature",
+                "id": "summary",
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [[[min_x, min_y], [max_x, min_y], [max_x, max_y], [min_x, max_y], [min_x, min_y]]],
+                },
+                "properties": {
+                    "estimated_features": plan.estimate,
+                    "zoom": plan.zoom,
+                    "message": "Zoom in to get the buildings of this area",
+                },
+            }],
+        }
+        return HttpResponse(json.dumps(summary), content_type="application/geo+json; charset=utf-8")
+
+    def render_pending(self):
+        """Tell the client the requested area is being ingested in background."""
+        response = HttpResponse(
+            "Ingestion of the requested area is pending, retry later.\n",
+            content_type="text/plain; charset=utf-8",
+            status=202,
+        )
+        response["Retry-After"] = str(conf.OVERTUREMAPS_PENDING_RETRY_AFTER)
+        return response
+
+
+def set_pending_headers(response):
+    """Flag a partial response, served while its area is still being ingested."""
+    response["X-Ingestion"] = "pending"
+    response["Cache-Control"] = "no-store"
+
+
+class BuildingTileView(View):
+    """
+    Mapbox vector tiles of the buildings, built by PostGIS. The missing
+    coverage cells of a tile are ingested first (or queued, see
+    OVERTUREMAPS_INGESTION_MODE). Tiles of ingested areas are cached and
+    carry an ETag; tiles of areas still being ingested are not cached.
+    """
+
+    def get(self, request, z, x, y):
+        if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            raise Http404("Tile out of range")
+        if not conf.OVERTUREMAPS_TILES_MIN_ZOOM <= z <= conf.OVERTUREMAPS_TILES_MAX_ZOOM:
+            # too many buildings to show, an empty tile
+            response = HttpResponse(b"", content_type=MVT_CONTENT_TYPE)
+            response["Cache-Control"] = conf.OVERTUREMAPS_TILES_CACHE_CONTROL
+            return response
+
+        bbox = tile_bounds(x, y, z)
+        response_cache = get_response_cache()
+        version = get_tile_version(z, x, y)
+        if version is None:
+            buildings_ft = get_buildings_feature_type()
+            if buildings_ft.set_data(IngestionContext(bbox)):
+                version = get_tile_version(z, x, y)
+        else:
+            response = get_cached_response(
+                request, version, get_last_modified(bbox), response_cache, conf.OVERTUREMAPS_TILES_CACHE_CONTROL
+            )
+            if response is not None:
+                return response
+
+        response = HttpResponse(render_tile(z, x, y), content_type=MVT_CONTENT_TYPE)
+        if version is None:
+            # partial, the ingestion of the tile is pending
+            set_pending_headers(response)
+            return response
+        set_validators(response, version, get_last_modified(bbox), conf.OVERTUREMAPS_TILES_CACHE_CONTROL)
+        if response_cache is not None:
+            response = response_cache.set(version, response)
+        return response
+
+
+class ResponseCacheStatsView(View):
+    """The hits, misses and size of the response cache of this server process."""
+
+    def get(self, request):
+        response_cache = get_response_cache()
+        if response_cache is None:
+            return JsonResponse({"enabled": False})
+        return JsonResponse({"enabled": True, "alias": response_cache.alias, **response_cache.stats()})
@@ -10,6 +10,7 @@ Useful docs:
 import logging
 import math
 import re
+from functools import cached_property
 from urllib.parse import urlencode
 
 from django.core.exceptions import FieldError, ValidationError
@@ -25,8 +26,10 @@ from gisserver.exceptions import (
     VersionNegotiationFailed,
 )
 from gisserver.geometries import CRS, BoundingBox
+from gisserver.output.utils import CountingIterator
 from gisserver.parsers import fes20
 from gisserver.queries import stored_query_registry
+from overturemaps_wfsserver_app import conf as overturemaps_conf
 
 from .base import (
     OutputFormat,
@@ -42,6 +45,64 @@ SAFE_VERSION = re.compile(r"\A[0-9.]+\Z")
 RE_SAFE_FILENAME = re.compile(r"\A[A-Za-z0-9]+[A-Za-z0-9.]*")  # no dot at the start.
 
 
+def without_output_annotations(queryset):
+    """Leave out the output annotations (e.g. AsGML) of a queryset to count it."""
+    if not any(key.startswith("_as_") for key in queryset.query.annotations):
+        return queryset
+    queryset = queryset.all()
+    queryset.query.annotations = {
+        key: value for key, value in queryset.query.annotations.items() if not key.startswith("_as_")
+    }
+    return queryset
+
+
+class StreamingFeatureCollection(output.SimpleFeatureCollection):
+    """A result page that is always streamed from a server side cursor.
+
+    The GML output writes numberReturned before the features, which made
+    the page fully read in memory first. Here it's counted with a COUNT
+    query instead, so the first bytes are sent right away and the memory
+    use doesn't depend on the page size.
+    """
+
+    @classmethod
+    def from_collection(cls, collection):
+        return cls(collection.feature_type, collection.queryset, collection.start, collection.stop)
+
+    def __iter__(self):
+        if self._result_cache is None and self.queryset._prefetch_related_lookups:
+            return self._chunked_iterator()
+        return self.iterator()
+
+    def iterator(self):
+        if self._result_iterator is not None:
+            raise RuntimeError("Results for feature collection are read twice.")
+
+        if self._result_cache is not None:
+            return iter(self._result_cache)
+        elif self.start == self.stop == 0:
+            # resulttype=hits
+            return iter([])
+        chunk_size = overturemaps_conf.OVERTUREMAPS_STREAMING_CHUNK_SIZE
+        if self._use_sentinel_record:
+            model_iter = self._paginated_queryset(add_sentinel=True).iterator(chunk_size=chunk_size)
+            self._result_iterator = CountingIterator(model_iter, max_results=(self.stop - self.start))
+        else:
+            model_iter = self._paginated_queryset(add_sentinel=False).iterator(chunk_size=chunk_size)
+            self._result_iterator = CountingIterator(model_iter)
+        return iter(self._result_iterator)
+
+    @cached_property
+    def number_returned(self) -> int:
+        if self.start == self.stop == 0:
+            return 0  # resulttype=hits
+        elif self._result_iterator is not None or self._result_cache is not None:
+            return super().number_returned
+
+        # Not read yet, count the page without reading it.
+        return without_output_annotations(self._paginated_queryset(add_sentinel=False)).count()
+
+
 class GetCapabilities(WFSMethod):
     """ "This operation returns map features, and available operations this WFS server supports."""
 
@@ -329,7 +390,11 @@ class BaseWFSGetDataMethod(WFSTypeNamesMethod):
         self, query: queries.QueryExpression, start, count
     ) -> output.FeatureCollection:
         """Return the actual results"""
-        return query.get_results(start, count=count)
+        collection = query.get_results(start, count=count)
+        collection.results = [
+            StreamingFeatureCollection.from_collection(sub_collection) for sub_collection in collection.results
+        ]
+        return collection
 
     def get_paginated_results(
         self, query: queries.QueryExpression, outputFormat, **params